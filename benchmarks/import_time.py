@@ -0,0 +1,101 @@
+"""
+Measures the cold start time of the command line and of the GUI.
+
+Each target is imported in a fresh interpreter several times and the median wall
+time is reported, together with the heavy dependencies the import pulled in. Run
+from the repository root:
+
+    python benchmarks/import_time.py [--repeat 5] [--importtime]
+
+With --importtime the per-module breakdown of ``python -X importtime`` is printed
+for the slowest imports of each target.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that should only be imported once the feature using them runs
+HEAVY_MODULES = (
+    'cv2', 'skimage', 'scipy', 'sklearn', 'pandas', 'bioio', 'bioio_nd2', 'ome_types',
+    'tifffile', 'tqdm', 'xarray', 'dask', 'matplotlib', 'mplcursors', 'vispy', 'ndv', 'qtpy',
+)
+
+TARGETS = {
+    'cli': 'import biaqc.cli',
+    'cli --help': (
+        'import sys, contextlib, io\n'
+        'sys.argv = ["biaqc", "--help"]\n'
+        'import biaqc.cli\n'
+        'with contextlib.suppress(SystemExit), contextlib.redirect_stdout(io.StringIO()):\n'
+        '    biaqc.cli.main()'
+    ),
+    'gui': 'import gui',
+}
+
+REPORT = (
+    'import sys; '
+    f'print(",".join(sorted({{m.split(".")[0] for m in sys.modules}} & set({HEAVY_MODULES!r}))))'
+)
+
+
+def time_import(statement: str, repeat: int) -> tuple[float | None, str]:
+    """Returns the median time of running the statement in a fresh interpreter."""
+    times = []
+    loaded = ''
+    for _ in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, '-c', f'{statement}\n{REPORT}'],
+            cwd=ROOT, capture_output=True, text=True,
+        )
+        elapsed = time.perf_counter() - start
+        if proc.returncode != 0:
+            return None, proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else 'failed'
+        times.append(elapsed)
+        loaded = proc.stdout.strip().splitlines()[-1] if proc.stdout.strip() else ''
+    return statistics.median(times), loaded
+
+
+def print_importtime(statement: str, top: int = 10) -> None:
+    """Prints the slowest modules imported by the statement (cumulative time)."""
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        # import time:  self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative_us), name.strip()))
+    for cumulative_us, name in sorted(rows, reverse=True)[:top]:
+        print(f'    {cumulative_us / 1000:8.1f} ms  {name}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5, help='Number of cold starts per target.')
+    parser.add_argument('--importtime', action='store_true', help='Print the slowest imports.')
+    args = parser.parse_args()
+
+    baseline, _ = time_import('pass', args.repeat)
+    print(f'{"interpreter":<12} {baseline * 1000:8.1f} ms')
+    for name, statement in TARGETS.items():
+        elapsed, loaded = time_import(statement, args.repeat)
+        if elapsed is None:
+            print(f'{name:<12} skipped ({loaded})')
+            continue
+        print(f'{name:<12} {elapsed * 1000:8.1f} ms  (+{(elapsed - baseline) * 1000:.1f} ms)  '
+              f'heavy modules: {loaded or "none"}')
+        if args.importtime:
+            print_importtime(statement)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,3 @@
+"""Bioimage Analysis Quality Control (BioIQ)."""
+
+__version__ = "0.1.0"
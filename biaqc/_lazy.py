@@ -0,0 +1,55 @@
+import importlib
+import threading
+from types import ModuleType
+from typing import Optional
+
+
+class LazyModule:
+    """
+    Stands in for a module and imports it on first attribute access.
+
+    Heavy dependencies (OpenCV, scikit-image, pandas, bioio, ...) are bound to a
+    LazyModule at import time, so importing a biaqc module is cheap and each
+    dependency is only loaded once the feature using it runs.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+        self.__dict__['_lock'] = threading.Lock()
+
+    def _load(self) -> ModuleType:
+        module: Optional[ModuleType] = self.__dict__['_module']
+        if module is None:
+            with self.__dict__['_lock']:
+                module = self.__dict__['_module']
+                if module is None:
+                    module = importlib.import_module(self.__dict__['_name'])
+                    self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr: str, value) -> None:
+        setattr(self._load(), attr, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self) -> str:
+        state = "loaded" if self.__dict__['_module'] is not None else "not loaded"
+        return f"<lazy module '{self.__dict__['_name']}' ({state})>"
+
+
+def lazy_import(name: str) -> LazyModule:
+    """
+    Returns a module that is only imported when one of its attributes is used.
+
+    Args:
+        name (str): Full name of the module, e.g. "skimage.feature".
+
+    Returns:
+        LazyModule: The lazily imported module.
+    """
+    return LazyModule(name)
@@ -1,11 +1,142 @@
-import pandas as pd
+from __future__ import annotations
+import os
+from typing import Iterator
 import numpy as np
-from sklearn.decomposition import PCA
+from ._lazy import lazy_import
+from .file_operations import RunStore, TableWriter, iter_table
+
+# Heavy dependencies, imported when first used
+pd = lazy_import("pandas")
+sk_decomposition = lazy_import("sklearn.decomposition")
+
+# Feature columns of each feature group, as produced by ND2ImageProcessor
+INTENSITY_COLUMNS = ['mean_intensity', 'median_intensity', 'std_intensity', 'variance',
+                     'min_intensity', 'max_intensity', 'dynamic_range', 'dynamic_range_utilization',
+                     'bit_depth', 'entropy', 'skewness', 'kurtosis']
+TEXTURE_COLUMNS = ['contrast', 'dissimilarity', 'homogeneity', 'energy', 'correlation', 'ASM',
+                   'lbp_bin_0', 'lbp_bin_1', 'lbp_bin_2', 'lbp_bin_3', 'lbp_bin_4', 'lbp_bin_5',
+                   'lbp_bin_6', 'lbp_bin_7', 'lbp_bin_8', 'lbp_bin_9']
+NOISE_COLUMNS = ['noise_level', 'snr']
+SHARPNESS_COLUMNS = ['laplacian', 'tenengrad', 'brenners_gradient', 'fourier_magnitude']
+
+# Columns identifying a plane rather than describing it
+ID_COLUMNS = ['file_path', 'image_name', 'extension', 'T', 'C', 'Z', 'histogram']
+
+# Columns of the focus search of ND2ImageProcessor, describing a Z stack rather than
+# a plane
+FOCUS_COLUMNS = ['focus_score', 'best_Z', 'focus_curve']
+
+# Perceptual hash and exact checksum of a plane, see biaqc.duplicates
+HASH_COLUMNS = ['phash', 'plane_checksum']
+
+# Numeric columns that are not features of a plane
+NON_FEATURE_COLUMNS = ID_COLUMNS + FOCUS_COLUMNS + HASH_COLUMNS
+
+# Feature groups reduced by FeaturePCA, in output order. The noise group has only
+# two features and is kept as is.
+GROUP_COLUMNS = {
+    'intensity': INTENSITY_COLUMNS,
+    'texture': TEXTURE_COLUMNS,
+    'noise': NOISE_COLUMNS,
+    'sharpness': SHARPNESS_COLUMNS,
+}
+
+# Number of planes from which the PCAs switch from a full SVD to a solver that
+# scales with the number of planes: the eigendecomposition of the feature
+# covariance, a single pass over the matrix when there are few features, or else a
+# randomized SVD
+LARGE_PCA_MIN_SAMPLES = 10_000
+COVARIANCE_PCA_MAX_FEATURES = 1_000
+
+
+def _feature_layout(df: pd.DataFrame) -> tuple[list[str], dict[str, slice]]:
+    """
+    Returns the feature columns of a feature table and the column range of each
+    feature group in them. The columns of the groups come first, in group order,
+    followed by the other numeric columns that do not identify a plane.
+    """
+    columns: list[str] = []
+    group_slices: dict[str, slice] = {}
+    for group, group_columns in GROUP_COLUMNS.items():
+        if all(col in df.columns for col in group_columns):
+            group_slices[group] = slice(len(columns), len(columns) + len(group_columns))
+            columns.extend(group_columns)
+    columns.extend(
+        col for col in df.columns
+        if col not in NON_FEATURE_COLUMNS and col not in columns
+        and pd.api.types.is_numeric_dtype(df[col])
+    )
+    return columns, group_slices
+
+
+def _to_matrix(df: pd.DataFrame, columns: list[str]) -> np.ndarray:
+    """Returns the given columns as a column-major float32 matrix, NaN where missing."""
+    # column-major, so that filling and standardizing a column is contiguous
+    matrix = np.empty((len(df), len(columns)), dtype=np.float32, order='F')
+    for j, col in enumerate(columns):
+        values = df[col]
+        if not pd.api.types.is_numeric_dtype(values):
+            values = pd.to_numeric(values, errors='coerce')
+        matrix[:, j] = values.to_numpy(dtype=np.float32, na_value=np.nan)
+    return matrix
+
+
+def _standardize(matrix: np.ndarray, mean: np.ndarray, scale: np.ndarray) -> np.ndarray:
+    """Standardizes a feature matrix in place, setting missing values to 0."""
+    matrix -= mean.astype(np.float32)
+    matrix /= scale.astype(np.float32)
+    np.nan_to_num(matrix, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+    return matrix
+
+
+def _pca_table(data: pd.DataFrame, id_columns: list[str], n_components: int,
+               components: dict[str, np.ndarray]) -> pd.DataFrame:
+    """
+    Assembles a PCA table with the columns of ``FeaturePCA.combine_pcas``.
+
+    Args:
+        data (pd.DataFrame): The feature table.
+        id_columns (list[str]): The identifier columns to copy from it.
+        n_components (int): Number of principal components per feature group.
+        components (dict[str, np.ndarray]): The principal components of each reduced
+            group and of "all", one row per plane.
+
+    Returns:
+        pd.DataFrame: The identifier columns followed by the PCA components of the
+        intensity, texture, noise, sharpness and all features.
+    """
+    names = [f'pca_{i+1}' for i in range(n_components)]
+    blocks, out_columns = [], []
+    for group in [*GROUP_COLUMNS, 'all']:
+        if group == 'noise' and all(col in data.columns for col in NOISE_COLUMNS):
+            blocks.append(data[NOISE_COLUMNS].to_numpy(dtype=np.float32))
+            out_columns.extend(f'noise_{name}' for name in NOISE_COLUMNS)
+        elif group in components:
+            blocks.append(components[group])
+            out_columns.extend(f'{group}_{name}' for name in names)
+    out = np.hstack(blocks).astype(np.float32, copy=False)
+    table = pd.DataFrame(out, columns=out_columns, index=data.index)
+    return pd.concat([data[id_columns], table], axis=1).reset_index(drop=True)
+
 
 class FeaturePCA:
-    def __init__(self):
+    def __init__(self, large_min_samples: int = LARGE_PCA_MIN_SAMPLES):
+        """
+        Initializes the FeaturePCA.
+
+        Args:
+            large_min_samples (int): Number of planes from which the PCAs are fitted
+                with a covariance or randomized solver instead of a full SVD.
+        """
         self.data = None
         self.pca_results = {}
+        self.pca_models = {}
+        self.large_min_samples = large_min_samples
+        self.feature_columns: list[str] = []
+        self.group_slices: dict[str, slice] = {}
+        self.mean: np.ndarray | None = None
+        self.scale: np.ndarray | None = None
+        self._matrix: np.ndarray | None = None
 
     def set_data(self, data: str | pd.DataFrame):
         """
@@ -20,22 +151,88 @@ class FeaturePCA:
             self.data = data
         else:
             raise ValueError("Wrong data type...")
-    
-    def _get_pca(self, df: pd.DataFrame, n_components=2):
+        self.pca_results = {}
+        self.pca_models = {}
+        self._matrix = None
+
+    def feature_matrix(self) -> np.ndarray:
+        """
+        Returns the standardized feature matrix, building it on first use.
+
+        The matrix is float32, one row per plane, with the columns of each feature
+        group stored contiguously (see ``group_slices``) so the group PCAs work on
+        views of it. Each column is centred and scaled to unit variance, and missing
+        values are set to the column mean (0 after standardization). Constant
+        columns are left at 0.
+
+        Returns:
+            np.ndarray: The standardized feature matrix.
+        """
+        if self._matrix is not None:
+            return self._matrix
+
+        self.feature_columns, self.group_slices = _feature_layout(self.data)
+        matrix = _to_matrix(self.data, self.feature_columns)
+
+        with np.errstate(invalid='ignore'):
+            self.mean = np.nanmean(matrix, axis=0, dtype=np.float64)
+            std = np.nanstd(matrix, axis=0, dtype=np.float64)
+        self.mean = np.nan_to_num(self.mean)
+        self.scale = np.where(np.isfinite(std) & (std > 0), std, 1.0)
+        _standardize(matrix, self.mean, self.scale)
+
+        self._matrix = matrix
+        return matrix
+
+    def _fit_pca(self, name: str, features: np.ndarray, n_components: int) -> np.ndarray:
+        """
+        Fits a PCA on a view of the feature matrix and returns the principal components.
+
+        Args:
+            name (str): Name under which the fitted model is kept in ``pca_models``.
+            features (np.ndarray): Standardized features, one row per plane.
+            n_components (int): Number of principal components to compute.
+
+        Returns:
+            np.ndarray: The principal components, one row per plane.
+        """
+        n_samples, n_features = features.shape
+        if n_samples < self.large_min_samples:
+            solvers = ['full']
+        elif n_features <= COVARIANCE_PCA_MAX_FEATURES:
+            # covariance_eigh needs scikit-learn >= 1.5
+            solvers = ['covariance_eigh', 'randomized']
+        else:
+            solvers = ['randomized']
+
+        for solver in solvers:
+            pca = sk_decomposition.PCA(n_components=n_components, svd_solver=solver, random_state=0)
+            try:
+                components = pca.fit_transform(features)
+                break
+            except ValueError:
+                if solver == solvers[-1]:
+                    raise
+        self.pca_models[name] = pca
+        return components.astype(np.float32, copy=False)
+
+    def _get_pca(self, group: str, n_components=2):
         """
-        Performs PCA on the given dataframe and returns the principal components.
+        Performs PCA on the columns of a feature group and returns the principal components.
 
         Args:
-            df (pd.DataFrame): DataFrame with selected features.
+            group (str): The feature group, or "all" for all the features.
             n_components (int): Number of principal components to compute.
 
         Returns:
             pd.DataFrame: DataFrame with principal components.
         """
-        pca = PCA(n_components=n_components)
-        pca_components = pca.fit_transform(df)
+        matrix = self.feature_matrix()
+        features = matrix if group == 'all' else matrix[:, self.group_slices[group]]
+        components = self._fit_pca(group, features, n_components)
         columns = [f'pca_{i+1}' for i in range(n_components)]
-        return pd.DataFrame(pca_components, columns=columns)
+        self.pca_results[group] = pd.DataFrame(components, columns=columns, index=self.data.index)
+        return self.pca_results[group]
 
     def get_intensity_pca(self, n_components=2):
         """
@@ -47,13 +244,7 @@ class FeaturePCA:
         Returns:
             pd.DataFrame: DataFrame with intensity PCA results.
         """
-        intensity_columns = ['mean_intensity', 'median_intensity', 'std_intensity', 'variance', 
-                             'min_intensity', 'max_intensity', 'dynamic_range', 'dynamic_range_utilization', 
-                             'bit_depth', 'entropy', 'skewness', 'kurtosis']
-        intensity_df = self.data[intensity_columns]
-        intensity_pca = self._get_pca(intensity_df, n_components)
-        self.pca_results['intensity'] = intensity_pca
-        return intensity_pca
+        return self._get_pca('intensity', n_components)
 
     def get_texture_pca(self, n_components=2):
         """
@@ -65,26 +256,19 @@ class FeaturePCA:
         Returns:
             pd.DataFrame: DataFrame with texture PCA results.
         """
-        texture_columns = ['contrast', 'dissimilarity', 'homogeneity', 'energy', 'correlation', 'ASM', 
-                           'lbp_bin_0', 'lbp_bin_1', 'lbp_bin_2', 'lbp_bin_3', 'lbp_bin_4', 'lbp_bin_5',
-                             'lbp_bin_6', 'lbp_bin_7', 'lbp_bin_8', 'lbp_bin_9']
-        texture_df = self.data[texture_columns]
-        texture_pca = self._get_pca(texture_df, n_components)
-        self.pca_results['texture'] = texture_pca
-        return texture_pca
+        return self._get_pca('texture', n_components)
 
     def get_noise_pca(self, n_components=2):
         """
-        Performs PCA on the noise features.
+        Returns the noise features, which are not reduced.
 
         Args:
-            n_components (int): Number of principal components to compute.
+            n_components (int): Unused, the noise group has two features.
 
         Returns:
-            pd.DataFrame: DataFrame with noise PCA results.
+            pd.DataFrame: DataFrame with the noise level and SNR.
         """
-        noise_columns = ['noise_level', 'snr']
-        noise_df = self.data[noise_columns]
+        noise_df = self.data[NOISE_COLUMNS]
         self.pca_results['noise'] = noise_df
         return noise_df
 
@@ -98,11 +282,7 @@ class FeaturePCA:
         Returns:
             pd.DataFrame: DataFrame with sharpness PCA results.
         """
-        sharpness_columns = ['laplacian', 'tenengrad', 'brenners_gradient', 'fourier_magnitude']
-        sharpness_df = self.data[sharpness_columns]
-        sharpness_pca = self._get_pca(sharpness_df, n_components)
-        self.pca_results['sharpness'] = sharpness_pca
-        return sharpness_pca
+        return self._get_pca('sharpness', n_components)
 
     def get_all_pca(self, n_components=2):
         """
@@ -114,55 +294,240 @@ class FeaturePCA:
         Returns:
             pd.DataFrame: DataFrame with all PCA results.
         """
-        feature_columns = [col for col in self.data.columns if col not in ['file_path', 'image_name', 'extension', 'T', 'C', 'Z', 'histogram']]
-        feature_df = self.data[feature_columns]
-        all_pca = self._get_pca(feature_df, n_components)
-        self.pca_results['all'] = all_pca
-        return all_pca
-
-    def _get_pcas(self):
-        self.get_intensity_pca()
-        self.get_texture_pca()
-        self.get_noise_pca()
-        self.get_sharpness_pca()
-        self.get_all_pca()
+        return self._get_pca('all', n_components)
 
-    def combine_pcas(self):
+    def combine_pcas(self, n_components=2):
         """
         Combines all PCA results into a single dataframe with additional columns for the PCA components.
 
+        The standardized feature matrix is built once and every group PCA is fitted
+        on a view of it. The components of all groups are written into one
+        preallocated float32 block, which is joined to the identifier columns once.
+
+        Args:
+            n_components (int): Number of principal components per feature group.
+
         Returns:
-            List[Dict[str, Any]]: A list of dictionaries with the image file path and PCA results for intensity, texture, noise, and sharpness.
-        """
-        combined_df = pd.DataFrame()
-        combined_df[['file_path', 'image_name', 'extension', 'T', 'C', 'Z', 'histogram']] = self.data[['file_path', 'image_name', 'extension', 'T', 'C', 'Z', 'histogram']]
-
-        self._get_pcas()
-
-        # Add all PCA components for each feature group to the combined dataframe
-        if 'intensity' in self.pca_results:
-            combined_df = pd.concat([combined_df, self.pca_results['intensity'].add_prefix('intensity_')], axis=1)
-        if 'texture' in self.pca_results:
-            combined_df = pd.concat([combined_df, self.pca_results['texture'].add_prefix('texture_')], axis=1)
-        if 'noise' in self.pca_results:
-            combined_df = pd.concat([combined_df, self.pca_results['noise'].add_prefix('noise_')], axis=1)
-        if 'sharpness' in self.pca_results:
-            combined_df = pd.concat([combined_df, self.pca_results['sharpness'].add_prefix('sharpness_')], axis=1)
-        if 'all' in self.pca_results:
-            combined_df = pd.concat([combined_df, self.pca_results['all'].add_prefix('all_')], axis=1)
-
-        # Convert the combined dataframe to a list of dictionaries
-        return combined_df
+            pd.DataFrame: The identifier columns followed by the PCA components of the
+            intensity, texture, noise, sharpness and all features.
+        """
+        matrix = self.feature_matrix()
+
+        # (output prefix, source) of each block of columns, in output order
+        blocks = []
+        for group in GROUP_COLUMNS:
+            if group not in self.group_slices:
+                continue
+            if group == 'noise':
+                blocks.append(('noise_', NOISE_COLUMNS, self.data[NOISE_COLUMNS].to_numpy(dtype=np.float32)))
+            else:
+                blocks.append((f'{group}_', None, matrix[:, self.group_slices[group]]))
+        blocks.append(('all_', None, matrix))
+
+        width = sum(len(names) if names else n_components for _, names, _ in blocks)
+        out = np.empty((len(self.data), width), dtype=np.float32)
+        out_columns = []
+        start = 0
+        for prefix, names, source in blocks:
+            group = prefix[:-1]
+            if names is None:
+                names = [f'pca_{i+1}' for i in range(n_components)]
+                out[:, start:start + n_components] = self._fit_pca(group, source, n_components)
+            else:
+                out[:, start:start + len(names)] = source
+            self.pca_results[group] = pd.DataFrame(
+                out[:, start:start + len(names)], columns=names, index=self.data.index
+            )
+            out_columns.extend(prefix + name for name in names)
+            start += len(names)
+
+        id_columns = [col for col in ID_COLUMNS if col in self.data.columns]
+        combined_df = pd.concat(
+            [self.data[id_columns], pd.DataFrame(out, columns=out_columns, index=self.data.index)],
+            axis=1,
+        )
+        return combined_df.reset_index(drop=True)
     
 
+class IncrementalFeaturePCA:
+    """
+    Embeds a feature table that does not fit in memory, reading it in chunks.
+
+    The table is read three times, holding one chunk at a time: once for the mean
+    and standard deviation of each feature, once to fit one IncrementalPCA per
+    feature group with ``partial_fit``, and once to transform the rows. The output
+    has the columns of ``FeaturePCA.combine_pcas``.
+    """
+
+    def __init__(self, n_components: int = 2, chunk_size: int = 100_000):
+        """
+        Initializes the IncrementalFeaturePCA.
+
+        Args:
+            n_components (int): Number of principal components per feature group.
+            chunk_size (int): Number of rows read at a time.
+        """
+        if chunk_size < n_components:
+            raise ValueError("The chunk size must be at least the number of components.")
+        self.n_components = n_components
+        self.chunk_size = chunk_size
+        self.pca_models = {}
+        self.feature_columns: list[str] = []
+        self.group_slices: dict[str, slice] = {}
+        self.id_columns: list[str] = []
+        self.mean: np.ndarray | None = None
+        self.scale: np.ndarray | None = None
+        self.n_samples = 0
+
+    def _chunks(self, source: str | RunStore) -> Iterator[pd.DataFrame]:
+        """Reads a CSV or Parquet feature table, or the features of a run store, in chunks."""
+        if isinstance(source, RunStore):
+            return source.iter('features', self.chunk_size)
+        return iter_table(source, self.chunk_size)
+
+    def _fit_scaling(self, source: str | RunStore) -> None:
+        """Computes the mean and standard deviation of each feature in one pass."""
+        count = mean = m2 = None
+        self.n_samples = 0
+        for chunk in self._chunks(source):
+            if count is None:
+                self.feature_columns, self.group_slices = _feature_layout(chunk)
+                self.id_columns = [col for col in ID_COLUMNS if col in chunk.columns]
+                count = np.zeros(len(self.feature_columns))
+                mean = np.zeros(len(self.feature_columns))
+                m2 = np.zeros(len(self.feature_columns))
+            matrix = _to_matrix(chunk, self.feature_columns).astype(np.float64)
+            self.n_samples += len(chunk)
+
+            # merge the chunk statistics into the running ones (Chan et al.)
+            chunk_count = np.sum(~np.isnan(matrix), axis=0)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                chunk_mean = np.nan_to_num(np.nanmean(matrix, axis=0))
+                chunk_m2 = np.nansum((matrix - chunk_mean) ** 2, axis=0)
+                total = count + chunk_count
+                delta = chunk_mean - mean
+                weight = np.where(total > 0, chunk_count / np.maximum(total, 1), 0.0)
+                mean = mean + delta * weight
+                m2 = m2 + chunk_m2 + delta ** 2 * count * weight
+            count = total
+
+        if count is None:
+            raise ValueError("The feature table is empty.")
+        std = np.sqrt(m2 / np.maximum(count, 1))
+        self.mean = mean
+        self.scale = np.where(std > 0, std, 1.0)
+
+    def _pca_groups(self) -> list[str]:
+        """Returns the groups reduced by a PCA, in output order."""
+        return [group for group in self.group_slices if group != 'noise'] + ['all']
+
+    def _group_features(self, matrix: np.ndarray, group: str) -> np.ndarray:
+        return matrix if group == 'all' else matrix[:, self.group_slices[group]]
+
+    def fit(self, source: str | RunStore) -> "IncrementalFeaturePCA":
+        """
+        Fits the PCAs on a feature table.
+
+        Args:
+            source (str | RunStore): Path of a CSV or Parquet feature table, or a run
+                store whose features table is used.
+
+        Returns:
+            IncrementalFeaturePCA: The fitted instance.
+        """
+        self._fit_scaling(source)
+        self.pca_models = {
+            group: sk_decomposition.IncrementalPCA(n_components=self.n_components)
+            for group in self._pca_groups()
+        }
+        for chunk in self._chunks(source):
+            matrix = _standardize(_to_matrix(chunk, self.feature_columns), self.mean, self.scale)
+            for group, pca in self.pca_models.items():
+                pca.partial_fit(self._group_features(matrix, group))
+        return self
+
+    def transform(self, chunk: pd.DataFrame) -> pd.DataFrame:
+        """
+        Projects a chunk of the feature table on the fitted PCAs.
+
+        Args:
+            chunk (pd.DataFrame): Rows of the feature table.
+
+        Returns:
+            pd.DataFrame: The identifier columns followed by the PCA components of
+            the intensity, texture, noise, sharpness and all features.
+        """
+        matrix = _standardize(_to_matrix(chunk, self.feature_columns), self.mean, self.scale)
+        return _pca_table(
+            chunk, self.id_columns, self.n_components,
+            {group: pca.transform(self._group_features(matrix, group))
+             for group, pca in self.pca_models.items()},
+        )
+
+    def fit_transform(self, source: str | RunStore, output_path: str) -> str:
+        """
+        Fits the PCAs on a feature table and writes the PCA coordinates of its rows.
+
+        Args:
+            source (str | RunStore): Path of a CSV or Parquet feature table, or a run
+                store whose features table is used.
+            output_path (str): Path of the PCA table, written as Parquet if it ends
+                with .parquet and CSV otherwise.
+
+        Returns:
+            str: The path of the PCA table.
+        """
+        self.fit(source)
+        with TableWriter(output_path) as writer:
+            for chunk in self._chunks(source):
+                writer.write(self.transform(chunk))
+        return output_path
+
+
+# Metadata columns checked by MetadataAnalysis, summarized together in one pass
+CHECKED_METADATA_COLUMNS = ['extension', 'instrument_model', 'objective_lens_na',
+                            'objective_nominal_magnification', 'significant_bits', 'size_x',
+                            'size_y', 'size_z', 'size_t', 'size_c', 'physical_size_x',
+                            'physical_size_y']
+
+# Key of the summary of all the planes
+ALL_PLANES = 'all'
+
+# Time units of the delta_t column, and the factor from each unit to the next
+TIME_UNITS = ['millisecond', 'second', 'minute', 'hour', 'day', 'month', 'year']
+TIME_UNIT_FACTORS = [1000, 60, 60, 24, 30, 12]
+
+
+def _run_starts(df: pd.DataFrame, columns: list[str]) -> np.ndarray:
+    """
+    Returns the rows starting a run of consecutive rows with the same values in all
+    the given columns. Missing values are equal to each other.
+    """
+    changed = np.zeros(len(df), dtype=bool)
+    changed[:1] = True
+    for col in columns:
+        values = df[col].array
+        missing = df[col].isna().to_numpy()
+        differs = pd.array(values[1:] != values[:-1], dtype='boolean').to_numpy(dtype=bool, na_value=True)
+        changed[1:] |= differs & ~(missing[1:] & missing[:-1])
+    return np.flatnonzero(changed)
+
+
 class MetadataAnalysis:
     """
     A class to analyze ND2 metadata from a CSV file and perform various checks.
+
+    The checks read a summary of the metadata computed in one pass over the planes
+    and cached. The checked metadata is the same for all the planes of a file, so
+    the planes are first reduced to the runs of consecutive planes with the same
+    values, found with vectorized comparisons, and the unique values of each column
+    (per group when asked) are counted on those few runs.
     """
 
     def __init__(self):
         self.metadata = None
         self.csv_path = None
+        self._summaries = {}
 
     def set_data(self, metadata: str | pd.DataFrame):
         """
@@ -177,47 +542,141 @@ class MetadataAnalysis:
             self.metadata = metadata
         else:
             raise ValueError("Wrong data type...")
-        
-        self.metadata['delta_time'] = self.metadata.groupby(['image_name', 'the_c'])['delta_t'].diff()
+        self._summaries = {}
+
+    def summary(self, by: str | None = None) -> dict:
+        """
+        Summarizes the checked metadata columns, optionally per group of planes.
+
+        Args:
+            by (str | None): Column to group the planes by (e.g. "instrument_model"),
+                "folder" for the folder of the file, or None for all the planes.
+
+        Returns:
+            dict: For each group (ALL_PLANES without grouping), a dict holding for
+            each checked column its number of unique values (NaN excluded) and its
+            unique values in order of appearance (NaN included), and under "delta_t"
+            the time between frames.
+        """
+        if by in self._summaries:
+            return self._summaries[by]
 
-    def _convert_time(self):
         df = self.metadata
+        columns = [col for col in CHECKED_METADATA_COLUMNS if col in df.columns]
+        if by is None:
+            group_columns = []
+        elif by == 'folder' and 'folder' not in df.columns:
+            group_columns = ['file_path']
+        else:
+            group_columns = [by]
+        starts = _run_starts(df, list(dict.fromkeys(columns + group_columns)))
+        runs = df.iloc[starts]
+
+        if by is None:
+            run_keys = np.full(len(runs), ALL_PLANES, dtype=object)
+        elif group_columns == ['file_path']:
+            run_keys = runs['file_path'].map(os.path.dirname).to_numpy()
+        else:
+            run_keys = runs[by].to_numpy()
+        run_codes, keys = pd.factorize(run_keys, use_na_sentinel=False)
+        # group of each plane, from the group of its run
+        group_codes = np.repeat(run_codes, np.diff(np.append(starts, len(df))))
+        delta_t = self._delta_t_stats(group_codes, len(keys))
+
+        summaries = {}
+        for code, key in enumerate(keys):
+            group_runs = runs[run_codes == code]
+            summary = {}
+            for col in columns:
+                summary[col] = (group_runs[col].nunique(), pd.unique(group_runs[col].to_numpy()))
+            summary['delta_t'] = delta_t[code]
+            summaries[key] = summary
+        self._summaries[by] = summaries
+        return summaries
+
+    def _delta_t_stats(self, group_codes: np.ndarray, n_groups: int) -> list:
+        """
+        Returns, for each group of planes, the time between consecutive planes of the
+        same image and channel as (mean, std, unit), or None without timestamps.
+        """
+        df = self.metadata
+        if not {'delta_t', 'delta_t_unit', 'image_name', 'the_c'} <= set(df.columns) or df.empty:
+            return [None] * n_groups
+
+        # consecutive planes of each image and channel, in the order of the table
+        image_starts = _run_starts(df, ['image_name'])
+        image_codes = np.repeat(
+            pd.factorize(df['image_name'].iloc[image_starts].to_numpy(), use_na_sentinel=False)[0],
+            np.diff(np.append(image_starts, len(df))),
+        )
+        channels = df['the_c'].to_numpy(dtype=np.int64)
+        series_codes = image_codes * (channels.max() + 1) + channels
+        order = np.argsort(series_codes, kind='stable')
+        delta_t = df['delta_t'].to_numpy(dtype=np.float64)[order]
+        delta = np.full(len(df), np.nan)
+        same_series = series_codes[order][1:] == series_codes[order][:-1]
+        delta[order[1:][same_series]] = (delta_t[1:] - delta_t[:-1])[same_series]
+
+        valid = ~np.isnan(delta)
+        if not valid.any():
+            return [None] * n_groups
+        diviser, unit = self._convert_time(float(np.median(delta[valid])))
+        delta = np.round(delta[valid] / diviser, 2)
+
+        groups = group_codes[valid]
+        count = np.bincount(groups, minlength=n_groups)
+        total = np.bincount(groups, weights=delta, minlength=n_groups)
+        squares = np.bincount(groups, weights=delta ** 2, minlength=n_groups)
+        stats = []
+        for n, s, s2 in zip(count, total, squares):
+            if n == 0:
+                stats.append(None)
+                continue
+            mean = s / n
+            # sample standard deviation, as pandas computes it
+            std = np.sqrt(max(s2 - n * mean ** 2, 0) / (n - 1)) if n > 1 else np.nan
+            stats.append((mean, std, unit))
+        return stats
+
+    def _convert_time(self, delta_time: float) -> tuple[int, str]:
+        """
+        Returns the factor dividing a time delta into the largest unit it spans,
+        and that unit.
+        """
+        time_unit = self.metadata.delta_t_unit.iloc[0]
         try:
-            time_unit = df.delta_t_unit.unique()[0].name.lower()
-        except:
-            time_unit = df.delta_t_unit.unique()[0].split('.')[-1].lower()
-        
-        delta_time = df.delta_time[3]
-        units = ['millisecond', 'second', 'minute', 'hour', 'day', 'month', 'year']
-        index = units.index(time_unit)
-        divisers = [1000, 60, 60, 24, 30, 12, 365]
+            time_unit = time_unit.name.lower()
+        except AttributeError:
+            time_unit = str(time_unit).split('.')[-1].lower()
+
+        index = TIME_UNITS.index(time_unit)
         diviser = 1
-        for i, d in enumerate(divisers[index:]):
+        for i, d in enumerate(TIME_UNIT_FACTORS[index:]):
             if (delta_time/d) > 1:
                 delta_time = delta_time/d
                 diviser = diviser*d
             else:
-                return diviser, units[i-1]
+                return diviser, TIME_UNITS[index + i]
+        return diviser, TIME_UNITS[-1]
 
-    def _get_generic_info(self, column):
+    def _get_generic_info(self, column, summary=None):
         """Generic function to return the number of unique items and their values."""
-        info = self.metadata.get(column, None)
-        if info is not None:
-            n_unique = info.nunique()
-            unique_values = info.unique()
-            return n_unique, unique_values
-        
-        return None, None
+        if summary is None:
+            summary = self.summary().get(ALL_PLANES, {})
+        return summary.get(column, (None, None))
+
+    def get_extension(self, summary=None):
+        n_extension, extensions = self._get_generic_info('extension', summary)
+
+        if n_extension is None:
+            return "[x] Could not find the image type."
 
-    def get_extension(self):
-        n_extension, extensions = self._get_generic_info('extension')
-        
         if n_extension > 1:
             return f"[x] More than one image type found. Found extensions are {extensions}."
         return f"[v] All images are of {extensions[0]} type."
 
-    def get_instrument(self):
-        n_instrument, instruments = self._get_generic_info('instrument_model')
+    def get_instrument(self, summary=None):
+        n_instrument, instruments = self._get_generic_info('instrument_model', summary)
 
         if n_instrument is None:
             return f"[x] Could not find the instrument name."
@@ -227,8 +686,8 @@ class MetadataAnalysis:
         
         return f"[v] All images are acquired using {instruments[0]}."
 
-    def get_lensNA(self):
-        n_lensNA, lensNA = self._get_generic_info('objective_lens_na')
+    def get_lensNA(self, summary=None):
+        n_lensNA, lensNA = self._get_generic_info('objective_lens_na', summary)
 
         if n_lensNA is None:
             return f"[x] Could not find the lens objective."
@@ -238,8 +697,8 @@ class MetadataAnalysis:
         
         return f"[v] All images are acquired with {lensNA[0]} objective."
 
-    def get_magnification(self):
-        n_magnification, magnifications = self._get_generic_info('objective_nominal_magnification')
+    def get_magnification(self, summary=None):
+        n_magnification, magnifications = self._get_generic_info('objective_nominal_magnification', summary)
 
         if n_magnification is None:
             return f"[x] Could not find the lens magnification."
@@ -248,8 +707,8 @@ class MetadataAnalysis:
             return f"[x] More than single magnification found. Found magnifications are {magnifications}."
         return f"[v] All images are acquired with {int(magnifications[0])}x."
 
-    def get_bit_depth(self):
-        n_bit_depth, bit_depths = self._get_generic_info('significant_bits')
+    def get_bit_depth(self, summary=None):
+        n_bit_depth, bit_depths = self._get_generic_info('significant_bits', summary)
         if n_bit_depth is None:
             return f"[x] Could not find bit depth."
         
@@ -257,8 +716,8 @@ class MetadataAnalysis:
             return f"[x] More than single bit depth found. Found bit depths are {bit_depths}."
         return f"[v] All images are acquired with {bit_depths[0]}."
 
-    def get_size_x(self):
-        n_size_x, size_x = self._get_generic_info('size_x')
+    def get_size_x(self, summary=None):
+        n_size_x, size_x = self._get_generic_info('size_x', summary)
         if n_size_x is None:
             return f"[x] Could not find image width."
         
@@ -266,8 +725,8 @@ class MetadataAnalysis:
             return f"[x] Different image widths found."
         return f"[v] Images have width {size_x[0]}."
 
-    def get_size_y(self):
-        n_size_y, size_y = self._get_generic_info('size_y')
+    def get_size_y(self, summary=None):
+        n_size_y, size_y = self._get_generic_info('size_y', summary)
         if n_size_y is None:
             return f"[x] Could not find image height."
         
@@ -275,40 +734,40 @@ class MetadataAnalysis:
             return f"[x] Different image heights found."
         return f"[v] Images have height {size_y[0]}."
 
-    def get_size_z(self):
-        n_size_z, size_z = self._get_generic_info('size_z')
+    def get_size_z(self, summary=None):
+        n_size_z, size_z = self._get_generic_info('size_z', summary)
         if n_size_z is None:
             return f"[x] Could not find z-depth."
         
         if n_size_z > 1:
             return f"[?] 3D z-stack with different z-depth."
-        elif size_z != 1:
+        elif size_z[0] != 1:
             return f"[?] 3D z-stack with single z-depth of {size_z[0]}."
         return f"[?] Not a z-stack."
 
-    def get_size_t(self):
-        n_size_t, size_t = self._get_generic_info('size_t')
+    def get_size_t(self, summary=None):
+        n_size_t, size_t = self._get_generic_info('size_t', summary)
         if n_size_t is None:
             return f"[?] Could not find t or not a time series."
         if n_size_t > 1:
             return f"[?] Time series data with different time."
-        elif size_t != 1:
+        elif size_t[0] != 1:
             return f"[?] Time series data with {size_t[0]} frames per image."
         return f"[?] Not a time series data."
 
-    def get_size_c(self):
-        n_size_c, size_c = self._get_generic_info('size_c')
+    def get_size_c(self, summary=None):
+        n_size_c, size_c = self._get_generic_info('size_c', summary)
         if n_size_c is None:
             return f"[x] Could not find number of channels."
         
         if n_size_c > 1:
             return f"[x] Different number of channels found."
-        elif size_c == 1:
+        elif size_c[0] == 1:
             return f"[?] Single channel image."
         return f"[v] Multi-channel image with {size_c[0]} channels per image."
 
-    def get_physical_x(self):
-        n_physical_size_x, physical_size_x = self._get_generic_info('physical_size_x')
+    def get_physical_x(self, summary=None):
+        n_physical_size_x, physical_size_x = self._get_generic_info('physical_size_x', summary)
         if n_physical_size_x is None:
             return f"[x] Could not find physical x size."
         
@@ -316,8 +775,8 @@ class MetadataAnalysis:
             return f"[x] Different physical size x found. Found physical size x are {np.round(physical_size_x, 4)}."
         return f"[v] All images acquired have {np.round(physical_size_x[0], 4)} micrometers physical size x."
 
-    def get_physical_y(self):
-        n_physical_size_y, physical_size_y = self._get_generic_info('physical_size_y')
+    def get_physical_y(self, summary=None):
+        n_physical_size_y, physical_size_y = self._get_generic_info('physical_size_y', summary)
         if n_physical_size_y is None:
             return f"[x] Could not find physical y size."
         
@@ -325,29 +784,47 @@ class MetadataAnalysis:
             return f"[x] Different physical size y found. Found physical size y are {np.round(physical_size_y, 4)}."
         return f"[v] All images acquired have {np.round(physical_size_y[0], 4)} micrometers physical size y."
 
-    def get_delta_t(self):
-        diviser, unit = self._convert_time()
-        self.metadata['delta_time'] = np.round(self.metadata['delta_time'] / diviser, 2)
-        mean_time = self.metadata['delta_time'].mean()
-        std_time = self.metadata['delta_time'].std()
+    def get_delta_t(self, summary=None):
+        if summary is None:
+            summary = self.summary().get(ALL_PLANES, {})
+        if summary.get('delta_t') is None:
+            return "[x] Could not find time delta."
+        mean_time, std_time, unit = summary['delta_t']
         return f"[v] Time between frames: {np.round(mean_time, 4)} +/- {np.round(std_time, 4)} {unit}s."
-        
-            # return f"[x] Cound not find time delta."
-
-    def generate_report(self):
-        """Generates a report by calling all functions and combining their outputs into a list of strings."""
-        report = []
-        report.append(self.get_extension())
-        report.append(self.get_instrument())
-        report.append(self.get_lensNA())
-        report.append(self.get_magnification())
-        report.append(self.get_bit_depth())
-        report.append(self.get_size_t())
-        report.append(self.get_size_z())
-        report.append(self.get_size_c())
-        report.append(self.get_size_x())
-        report.append(self.get_size_y())
-        report.append(self.get_physical_x())
-        report.append(self.get_physical_y())
-        report.append(self.get_delta_t())
-        return report
\ No newline at end of file
+
+    def _report(self, summary):
+        """Runs all the checks on the summary of a group of planes."""
+        return [
+            self.get_extension(summary),
+            self.get_instrument(summary),
+            self.get_lensNA(summary),
+            self.get_magnification(summary),
+            self.get_bit_depth(summary),
+            self.get_size_t(summary),
+            self.get_size_z(summary),
+            self.get_size_c(summary),
+            self.get_size_x(summary),
+            self.get_size_y(summary),
+            self.get_physical_x(summary),
+            self.get_physical_y(summary),
+            self.get_delta_t(summary),
+        ]
+
+    def generate_report(self, by: str | None = None):
+        """
+        Generates a report by calling all functions and combining their outputs into a list of strings.
+
+        Args:
+            by (str | None): Column to report per group of planes (e.g.
+                "instrument_model"), "folder" for the folder of the file, or None to
+                report on all the planes.
+
+        Returns:
+            list[str] | dict: The report lines without grouping, or else a dict of
+            the report lines of each group.
+        """
+        summaries = self.summary(by)
+        if by is None:
+            # an empty table has no planes to summarize: every check reports missing
+            return self._report(summaries.get(ALL_PLANES, {}))
+        return {key: self._report(summary) for key, summary in summaries.items()}
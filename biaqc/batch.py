@@ -0,0 +1,331 @@
+from __future__ import annotations
+import os
+import re
+import glob
+from typing import Dict, List, Optional, Sequence, Tuple
+from ._lazy import lazy_import
+from .analysis import FeaturePCA, MetadataAnalysis
+from .file_operations import TABLE_FORMATS, read_table, write_table
+from .histograms import HistogramAggregator
+from .illumination import PixelAccumulator
+from .image_analysis import SCORE_COLUMNS
+from .metadata import Metadata
+from .reference import ReferenceModel
+from .similarity import SimilarityIndex
+from .utils import FEATURE_GROUPS, ND2ImageProcessor
+import logging
+
+# Configure logging for the module
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Heavy dependencies, imported when first used
+bioio = lazy_import("bioio")
+bioio_nd2 = lazy_import("bioio_nd2")
+pd = lazy_import("pandas")
+
+# Matches the per-shard result files written by run_batch
+SHARD_FILE_PATTERN = re.compile(
+    r"^(?P<prefix>.+)_(?P<kind>features|metadata)\.shard-(?P<index>\d+)-of-(?P<count>\d+)"
+    r"(?P<ext>\.csv|\.parquet)$"
+)
+
+
+def parse_shard(spec: str) -> Tuple[int, int]:
+    """
+    Parses a shard specification of the form "i/N".
+
+    Shards are numbered from 0, so "0/4" to "3/4" cover a dataset split in four.
+
+    Args:
+        spec (str): The shard specification.
+
+    Returns:
+        Tuple[int, int]: The shard index and the number of shards.
+    """
+    match = re.fullmatch(r"\s*(\d+)\s*/\s*(\d+)\s*", spec)
+    if match is None:
+        raise ValueError(f"Invalid shard '{spec}', expected 'i/N'.")
+    index, count = int(match.group(1)), int(match.group(2))
+    if count < 1 or index >= count:
+        raise ValueError(f"Invalid shard '{spec}', expected 0 <= i < N.")
+    return index, count
+
+
+def count_planes(file_path: str) -> int:
+    """Returns the number of XY planes of an ND2 file, read from its metadata."""
+    dims = bioio.BioImage(file_path, reader=bioio_nd2.Reader).dims
+    return dims.T * dims.C * dims.Z
+
+
+def file_weights(file_paths: List[str], balance: str = "size") -> List[int]:
+    """
+    Returns the cost used to balance the files between shards.
+
+    Args:
+        file_paths (List[str]): The file paths.
+        balance (str): "size" to balance by bytes on disk, "planes" by plane count.
+
+    Returns:
+        List[int]: One weight per file.
+    """
+    if balance == "size":
+        return [os.path.getsize(f) for f in file_paths]
+    if balance == "planes":
+        return [count_planes(f) for f in file_paths]
+    raise ValueError(f"Unknown balance '{balance}', expected 'size' or 'planes'.")
+
+
+def partition_files(file_paths: List[str], n_shards: int, weights: List[int]) -> List[List[str]]:
+    """
+    Deterministically splits the files into shards of similar total weight.
+
+    Files are assigned largest first to the least loaded shard (ties go to the lowest
+    shard index), which only depends on the file list, so every job computes the same
+    partition without coordinating. Each shard keeps the files in input order.
+
+    Args:
+        file_paths (List[str]): The file paths, in output order.
+        n_shards (int): Number of shards.
+        weights (List[int]): The weight of each file.
+
+    Returns:
+        List[List[str]]: The files of each shard.
+    """
+    loads = [0] * n_shards
+    assignment: Dict[int, int] = {}
+    order = sorted(range(len(file_paths)), key=lambda i: (-weights[i], file_paths[i]))
+    for i in order:
+        shard = min(range(n_shards), key=lambda s: (loads[s], s))
+        assignment[i] = shard
+        loads[shard] += weights[i]
+    return [
+        [f for i, f in enumerate(file_paths) if assignment[i] == shard]
+        for shard in range(n_shards)
+    ]
+
+
+def output_paths(out_dir: str, prefix: str, shard: Optional[Tuple[int, int]] = None,
+                 fmt: str = "csv") -> Dict[str, str]:
+    """Returns the paths of the result files of a run or of one of its shards."""
+    ext = TABLE_FORMATS[fmt]
+    if shard is not None:
+        index, count = shard
+        width = len(str(count - 1))
+        suffix = f".shard-{index:0{width}d}-of-{count}"
+        return {
+            "features": os.path.join(out_dir, f"{prefix}_features{suffix}{ext}"),
+            "metadata": os.path.join(out_dir, f"{prefix}_metadata{suffix}{ext}"),
+            "histogram_counts": os.path.join(out_dir, f"{prefix}_histogram_counts{suffix}.npz"),
+            "pixel_statistics": os.path.join(out_dir, f"{prefix}_pixel_statistics{suffix}.npz"),
+        }
+    return {
+        "features": os.path.join(out_dir, f"{prefix}_features{ext}"),
+        "metadata": os.path.join(out_dir, f"{prefix}_metadata{ext}"),
+        "pca": os.path.join(out_dir, f"{prefix}_pca{ext}"),
+        "similarity": os.path.join(out_dir, f"{prefix}_similarity.npz"),
+        "histogram_counts": os.path.join(out_dir, f"{prefix}_histogram_counts.npz"),
+        "histograms": os.path.join(out_dir, f"{prefix}_histograms{ext}"),
+        "pixel_statistics": os.path.join(out_dir, f"{prefix}_pixel_statistics.npz"),
+        "illumination": os.path.join(out_dir, f"{prefix}_illumination{ext}"),
+        "report": os.path.join(out_dir, f"{prefix}_metadata_report.txt"),
+    }
+
+
+def default_prefix(folder_path: str) -> str:
+    """Returns the name used for the result files of a folder, as the GUI does."""
+    return os.path.basename(os.path.normpath(folder_path))
+
+
+def run_batch(folder_path: str, out_dir: str, prefix: Optional[str] = None,
+              shard: Optional[Tuple[int, int]] = None, balance: str = "size",
+              workers: int = 1, memory_budget: Optional[int | str] = None,
+              features: Sequence[str] = FEATURE_GROUPS, fmt: str = "csv",
+              plane_workers: int = 1, prefetch_depth: int = 0,
+              reference: Optional[str] = None, focus_search: bool = False,
+              keep_histograms: bool = True, pixel_statistics: bool = False,
+              pixel_bin: int = 1) -> Dict[str, str]:
+    """
+    Runs the feature and metadata pipelines on a folder, or on one shard of it.
+
+    Without a shard the PCA table and the metadata report are written as well. With a
+    shard only the per-shard features and metadata are written; ``merge_shards``
+    combines them once all the shards are done.
+
+    Args:
+        folder_path (str): Folder containing the ND2 files.
+        out_dir (str): Folder where the result files are written.
+        prefix (str, optional): Name of the result files. Defaults to the folder name.
+        shard (Tuple[int, int], optional): Shard index and number of shards.
+        balance (str): "size" or "planes", how the files are balanced between shards.
+        workers (int): Number of worker processes for the feature extraction.
+        memory_budget (int | str, optional): Memory available to the workers, e.g. "32G".
+        features (Sequence[str]): Feature groups to extract.
+        fmt (str): Format of the result tables, "csv" or "parquet".
+        plane_workers (int): Threads computing the plane features within a file.
+        prefetch_depth (int): Planes decoded ahead while features are computed.
+        reference (str, optional): Path of a ReferenceModel to project and score the
+            features with, instead of fitting a PCA on them.
+        focus_search (bool): Only extract the features of the planes around the best
+            focus of each Z stack (see ND2ImageProcessor.find_focus).
+        keep_histograms (bool): Whether to keep the per-plane histograms in the
+            feature table. The intensity summary is computed either way.
+        pixel_statistics (bool): Whether to accumulate the per-pixel statistics of each
+            channel and write the flat-field, hot and dead pixel maps and the
+            illumination summary.
+        pixel_bin (int): Binning of the per-pixel mean and variance images.
+
+    Returns:
+        Dict[str, str]: The paths of the written files.
+    """
+    prefix = prefix or default_prefix(folder_path)
+    os.makedirs(out_dir, exist_ok=True)
+
+    nd2_processor = ND2ImageProcessor(plane_workers=plane_workers, prefetch_depth=prefetch_depth,
+                                      features=features, focus_search=focus_search,
+                                      keep_histograms=keep_histograms,
+                                      pixel_statistics=pixel_statistics, pixel_bin=pixel_bin)
+    file_paths = nd2_processor.list_files(folder_path)
+    if shard is not None:
+        index, count = shard
+        file_paths = partition_files(file_paths, count, file_weights(file_paths, balance))[index]
+        logger.info(f"Shard {index}/{count}: {len(file_paths)} files.")
+
+    paths = output_paths(out_dir, prefix, shard, fmt)
+    if not pixel_statistics:
+        paths.pop("pixel_statistics")
+        paths.pop("illumination", None)
+    nd2_processor.process_files(file_paths, output_csv=paths["features"], workers=workers,
+                                memory_budget=memory_budget)
+    nd2_processor.histograms.save(paths["histogram_counts"])
+    if nd2_processor.pixels is not None:
+        nd2_processor.pixels.save(paths["pixel_statistics"])
+    metadata = Metadata()
+    metadata.process_files(file_paths, output_csv=paths["metadata"])
+
+    if shard is None:
+        write_reports(nd2_processor.df, metadata.df, paths, reference, nd2_processor.histograms,
+                      nd2_processor.pixels)
+    return paths
+
+
+def merge_shards(out_dir: str, prefix: str, reference: Optional[str] = None) -> Dict[str, str]:
+    """
+    Combines the per-shard result files into the files of a single-node run.
+
+    Rows are put back in the order a single-node run writes them (files sorted by
+    path, planes in T, C, Z order), then the PCA table and the metadata report are
+    computed on the merged data.
+
+    Args:
+        out_dir (str): Folder containing the shard files.
+        prefix (str): Name of the result files.
+        reference (str, optional): Path of a ReferenceModel to project and score the
+            features with, instead of fitting a PCA on them.
+
+    Returns:
+        Dict[str, str]: The paths of the written files.
+    """
+    shard_files: Dict[str, Dict[int, str]] = {"features": {}, "metadata": {}}
+    counts, extensions = set(), set()
+    for path in glob.glob(os.path.join(glob.escape(out_dir), f"{glob.escape(prefix)}_*.shard-*")):
+        match = SHARD_FILE_PATTERN.match(os.path.basename(path))
+        if match is None or match.group("prefix") != prefix:
+            continue
+        shard_files[match.group("kind")][int(match.group("index"))] = path
+        counts.add(int(match.group("count")))
+        extensions.add(match.group("ext"))
+
+    if len(counts) != 1 or len(extensions) != 1:
+        raise ValueError(f"Expected shard files of a single run in {out_dir}, "
+                         f"found counts {sorted(counts)} and formats {sorted(extensions)}.")
+    count = counts.pop()
+    fmt = {ext: fmt for fmt, ext in TABLE_FORMATS.items()}[extensions.pop()]
+    for kind, files in shard_files.items():
+        missing = sorted(set(range(count)) - set(files))
+        if missing:
+            raise FileNotFoundError(f"Missing {kind} shards {missing} of {count}.")
+
+    paths = output_paths(out_dir, prefix, fmt=fmt)
+    merged = {}
+    for kind, files in shard_files.items():
+        df = pd.concat([_read_shard(files[i]) for i in range(count)], ignore_index=True)
+        df = df.sort_values("file_path", kind="stable", ignore_index=True)
+        write_table(df, paths[kind])
+        merged[kind] = df
+
+    # the histogram counts of each shard, absent for runs of older versions
+    histograms = None
+    count_files = glob.glob(os.path.join(
+        glob.escape(out_dir), f"{glob.escape(prefix)}_histogram_counts.shard-*-of-{count}.npz"
+    ))
+    if len(count_files) == count:
+        histograms = HistogramAggregator()
+        for path in sorted(count_files):
+            histograms.merge(HistogramAggregator.load(path))
+        histograms.save(paths["histogram_counts"])
+    else:
+        logger.warning(f"Found {len(count_files)} of {count} histogram count shards, "
+                       f"the intensity summary is not written.")
+
+    # the pixel statistics of each shard, only written with pixel_statistics
+    pixels = None
+    pixel_files = glob.glob(os.path.join(
+        glob.escape(out_dir), f"{glob.escape(prefix)}_pixel_statistics.shard-*-of-{count}.npz"
+    ))
+    if len(pixel_files) == count:
+        pixels = PixelAccumulator.load(sorted(pixel_files)[0])
+        for path in sorted(pixel_files)[1:]:
+            pixels.merge(PixelAccumulator.load(path))
+        pixels.save(paths["pixel_statistics"])
+    else:
+        if pixel_files:
+            logger.warning(f"Found {len(pixel_files)} of {count} pixel statistics shards, "
+                           f"the illumination summary is not written.")
+        paths.pop("pixel_statistics")
+        paths.pop("illumination")
+
+    write_reports(merged["features"], merged["metadata"], paths, reference, histograms, pixels)
+    return paths
+
+
+def _read_shard(path: str) -> pd.DataFrame:
+    """Reads a shard file, which is empty when the shard had no files."""
+    try:
+        if path.endswith(TABLE_FORMATS["csv"]):
+            return read_table(path, float_precision="round_trip")
+        return read_table(path)
+    except pd.errors.EmptyDataError:
+        return pd.DataFrame()
+
+
+def write_reports(features_df: pd.DataFrame, metadata_df: pd.DataFrame, paths: Dict[str, str],
+                  reference: Optional[str] = None,
+                  histograms: Optional[HistogramAggregator] = None,
+                  pixels: Optional[PixelAccumulator] = None) -> None:
+    """
+    Writes the PCA table, the similarity index, the intensity summary of the
+    histograms and the illumination summary of the pixel statistics when given and
+    the metadata report of a run.
+
+    With a reference model the features are projected on its principal components
+    and the outlier scores against it are added to the PCA table.
+    """
+    feature_pca = FeaturePCA()
+    feature_pca.set_data(features_df)
+    if reference is None:
+        write_table(feature_pca.combine_pcas(), paths["pca"])
+    else:
+        model = ReferenceModel.load(reference)
+        scores = model.score(features_df)[SCORE_COLUMNS].reset_index(drop=True)
+        write_table(pd.concat([model.transform(features_df), scores], axis=1), paths["pca"])
+    SimilarityIndex().fit(features_df, feature_pca).save(paths["similarity"])
+    if histograms is not None:
+        write_table(histograms.summary(), paths["histograms"])
+    if pixels is not None:
+        write_table(pixels.summary(), paths["illumination"])
+
+    metadata_analysis = MetadataAnalysis()
+    metadata_analysis.set_data(metadata_df)
+    with open(paths["report"], "w") as f:
+        f.write("\n".join(metadata_analysis.generate_report()) + "\n")
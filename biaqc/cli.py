@@ -0,0 +1,200 @@
+import argparse
+import sys
+from typing import List, Optional
+from .analysis import ID_COLUMNS, IncrementalFeaturePCA
+from .batch import default_prefix, merge_shards, parse_shard, run_batch
+from .comparison import DistributionComparison
+from .duplicates import find_duplicates
+from .file_operations import TABLE_FORMATS, RunStore, read_table, write_table
+from .reference import ReferenceModel
+from .time_series import DriftAnalysis
+from .utils import FEATURE_GROUPS
+from .watch import QCWatcher
+
+
+def _feature_groups(value: str) -> List[str]:
+    groups = [group.strip() for group in value.split(",") if group.strip()]
+    unknown = [group for group in groups if group not in FEATURE_GROUPS]
+    if not groups or unknown:
+        raise argparse.ArgumentTypeError(
+            f"invalid feature groups {unknown or value!r}, choose from {', '.join(FEATURE_GROUPS)}"
+        )
+    return groups
+
+
+def _run(args: argparse.Namespace) -> None:
+    shard = parse_shard(args.shard) if args.shard else None
+    paths = run_batch(
+        args.folder,
+        args.out,
+        prefix=args.prefix,
+        shard=shard,
+        balance=args.balance,
+        workers=args.workers,
+        memory_budget=args.memory_budget,
+        features=args.features,
+        fmt=args.format,
+        plane_workers=args.plane_workers,
+        prefetch_depth=args.prefetch,
+        reference=args.reference,
+        focus_search=args.focus,
+        keep_histograms=not args.drop_histograms,
+        pixel_statistics=args.pixel_statistics,
+        pixel_bin=args.pixel_bin,
+    )
+    for path in paths.values():
+        print(path)
+
+
+def _merge(args: argparse.Namespace) -> None:
+    paths = merge_shards(args.out, args.prefix, reference=args.reference)
+    for path in paths.values():
+        print(path)
+
+
+def _watch(args: argparse.Namespace) -> None:
+    store = RunStore(args.out, args.prefix or default_prefix(args.folders[0]))
+    watcher = QCWatcher(
+        args.folders,
+        store,
+        poll_interval=args.poll,
+        settle_time=args.settle,
+        plane_workers=args.plane_workers,
+        prefetch_depth=args.prefetch,
+    )
+    watcher.run()
+
+
+def _pca(args: argparse.Namespace) -> None:
+    feature_pca = IncrementalFeaturePCA(n_components=args.components, chunk_size=args.chunk_size)
+    print(feature_pca.fit_transform(args.table, args.out))
+
+
+def _reference(args: argparse.Namespace) -> None:
+    model = ReferenceModel(n_components=args.components).fit(read_table(args.table))
+    model.save(args.out)
+    print(args.out)
+
+
+def _drift(args: argparse.Namespace) -> None:
+    drift = DriftAnalysis(sharpness_column=args.sharpness)
+    write_table(drift.analyze(read_table(args.table)), args.out)
+    print(args.out)
+
+
+def _duplicates(args: argparse.Namespace) -> None:
+    features = read_table(args.table)
+    duplicates = find_duplicates(features, max_distance=args.max_distance)
+    flagged = (duplicates['duplicate_group'] >= 0) | duplicates['frozen_frame']
+    id_columns = [col for col in ID_COLUMNS if col in features.columns and col != 'histogram']
+    write_table(features.loc[flagged, id_columns].join(duplicates[flagged]).reset_index(drop=True), args.out)
+    print(args.out)
+
+
+def _compare(args: argparse.Namespace) -> None:
+    test, reference = read_table(args.table), read_table(args.reference)
+    comparison = DistributionComparison(alpha=args.alpha)
+    write_table(comparison.compare(test, reference), args.out)
+    print(args.out)
+    if args.histograms:
+        write_table(comparison.compare_histograms(test, reference), args.histograms)
+        print(args.histograms)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="biaqc", description="Bioimage analysis quality control.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run = subparsers.add_parser("run", help="Extract features and metadata from a folder.")
+    run.add_argument("folder", help="Folder containing the ND2 files.")
+    run.add_argument("--out", required=True, help="Folder where the results are written.")
+    run.add_argument("--prefix", default=None, help="Name of the result files (default: folder name).")
+    run.add_argument("--workers", type=int, default=1, help="Number of worker processes (0: one per core).")
+    run.add_argument("--plane-workers", type=int, default=1, help="Threads computing plane features of a file.")
+    run.add_argument("--prefetch", type=int, default=0, help="Planes decoded ahead of the features.")
+    run.add_argument("--features", type=_feature_groups, default=list(FEATURE_GROUPS),
+                     help=f"Comma-separated feature groups (default: {','.join(FEATURE_GROUPS)}).")
+    run.add_argument("--format", choices=list(TABLE_FORMATS), default="csv", help="Format of the result tables.")
+    run.add_argument("--memory-budget", default=None, metavar="SIZE",
+                     help="Memory available to the workers, e.g. 32G. Schedules files by their size.")
+    run.add_argument("--shard", default=None, metavar="i/N",
+                     help="Only process shard i of N (from 0) and write per-shard results.")
+    run.add_argument("--balance", choices=["size", "planes"], default="size",
+                     help="Balance the shards by file size or by plane count.")
+    run.add_argument("--reference", default=None, metavar="MODEL",
+                     help="Reference model (.npz) to project and score the features with.")
+    run.add_argument("--focus", action="store_true",
+                     help="Only extract the planes around the best focus of each Z stack.")
+    run.add_argument("--drop-histograms", action="store_true",
+                     help="Leave the per-plane histograms out of the feature table.")
+    run.add_argument("--pixel-statistics", action="store_true",
+                     help="Accumulate per-pixel statistics: flat-field, vignetting, hot and dead pixels. "
+                          "With --focus, of the planes decoded by the focus search.")
+    run.add_argument("--pixel-bin", type=int, default=1,
+                     help="Binning of the per-pixel mean and variance images.")
+    run.set_defaults(func=_run)
+
+    merge = subparsers.add_parser("merge", help="Merge the results of a sharded run.")
+    merge.add_argument("out", help="Folder containing the shard results.")
+    merge.add_argument("--prefix", required=True, help="Name of the result files.")
+    merge.add_argument("--reference", default=None, metavar="MODEL",
+                       help="Reference model (.npz) to project and score the features with.")
+    merge.set_defaults(func=_merge)
+
+    watch = subparsers.add_parser("watch", help="Run QC on new files as they land in folders.")
+    watch.add_argument("folders", nargs="+", help="Acquisition folders to watch.")
+    watch.add_argument("--out", required=True, help="Folder of the run store.")
+    watch.add_argument("--prefix", default=None, help="Name of the run (default: first folder name).")
+    watch.add_argument("--poll", type=float, default=5.0, help="Seconds between folder scans.")
+    watch.add_argument("--settle", type=float, default=10.0,
+                       help="Seconds a file must stay unchanged before it is processed.")
+    watch.add_argument("--plane-workers", type=int, default=1, help="Threads computing plane features.")
+    watch.add_argument("--prefetch", type=int, default=2, help="Planes decoded ahead of the features.")
+    watch.set_defaults(func=_watch)
+
+    pca = subparsers.add_parser("pca", help="Embed a feature table too large for memory, in chunks.")
+    pca.add_argument("table", help="CSV or Parquet feature table.")
+    pca.add_argument("--out", required=True, help="Path of the PCA table (.csv or .parquet).")
+    pca.add_argument("--components", type=int, default=2, help="Principal components per feature group.")
+    pca.add_argument("--chunk-size", type=int, default=100_000, help="Rows read at a time.")
+    pca.set_defaults(func=_pca)
+
+    reference = subparsers.add_parser("reference", help="Fit a reference QC model on known-good features.")
+    reference.add_argument("table", help="CSV or Parquet feature table of known-good planes.")
+    reference.add_argument("--out", required=True, help="Path of the model file (.npz).")
+    reference.add_argument("--components", type=int, default=2, help="Principal components per feature group.")
+    reference.set_defaults(func=_reference)
+
+    drift = subparsers.add_parser("drift", help="Measure photobleaching and focus drift of time-lapse data.")
+    drift.add_argument("table", help="CSV or Parquet feature table.")
+    drift.add_argument("--out", required=True, help="Path of the per-series table (.csv or .parquet).")
+    drift.add_argument("--sharpness", default="laplacian", help="Sharpness feature used for the focus drift.")
+    drift.set_defaults(func=_drift)
+
+    duplicates = subparsers.add_parser("duplicates", help="Find duplicated fields and frozen frames.")
+    duplicates.add_argument("table", help="CSV or Parquet feature table with the perceptual hashes.")
+    duplicates.add_argument("--out", required=True, help="Path of the table of flagged planes (.csv or .parquet).")
+    duplicates.add_argument("--max-distance", type=int, default=4,
+                            help="Largest number of differing hash bits between near duplicates.")
+    duplicates.set_defaults(func=_duplicates)
+
+    compare = subparsers.add_parser("compare", help="Rank the features that drifted from a reference run.")
+    compare.add_argument("table", help="CSV or Parquet feature table of the run checked.")
+    compare.add_argument("reference", help="CSV or Parquet feature table of the reference run.")
+    compare.add_argument("--out", required=True, help="Path of the ranked feature comparison (.csv or .parquet).")
+    compare.add_argument("--histograms", default=None, metavar="PATH",
+                         help="Also compare the intensity histograms of each channel and write them here.")
+    compare.add_argument("--alpha", type=float, default=0.01, help="Significance level of the drift tests.")
+    compare.set_defaults(func=_compare)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    args.func(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
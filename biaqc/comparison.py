@@ -0,0 +1,267 @@
+from __future__ import annotations
+import warnings
+import numpy as np
+from ._lazy import lazy_import
+from .analysis import _feature_layout, _to_matrix
+import logging
+
+# Configure logging for the module
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Heavy dependencies, imported when first used
+pd = lazy_import("pandas")
+stats = lazy_import("scipy.stats")
+
+# Scale turning the median absolute deviation into a standard deviation
+MAD_TO_STD = 1.4826
+
+# Columns of the table returned by DistributionComparison.compare, after the
+# feature and group columns
+COMPARISON_COLUMNS = ['n_reference', 'n_test', 'reference_median', 'test_median', 'ks_statistic',
+                      'ks_pvalue', 'wasserstein', 'wasserstein_scaled', 'effect_size', 'robust_shift',
+                      'drifted']
+
+# Columns of the table returned by DistributionComparison.compare_histograms,
+# after the group column
+HISTOGRAM_COLUMNS = ['n_reference', 'n_test', 'js_divergence', 'hellinger', 'total_variation',
+                     'wasserstein']
+
+
+def _two_sample_stats(reference: np.ndarray, test: np.ndarray) -> dict[str, np.ndarray]:
+    """
+    Computes the two-sample Kolmogorov-Smirnov statistic and the Wasserstein-1
+    distance of every column of two matrices at once.
+
+    Both samples are pooled and sorted feature by feature, and the empirical CDFs of
+    each sample are the cumulated counts of its values in the pooled order.
+
+    Args:
+        reference (np.ndarray): Reference sample, one row per plane, NaN when missing.
+        test (np.ndarray): Test sample with the same columns.
+
+    Returns:
+        dict[str, np.ndarray]: The number of values of each sample and the KS
+        statistic and Wasserstein distance of each column.
+    """
+    # one row per feature, so that each feature is sorted in contiguous memory
+    pooled = np.concatenate([reference, test]).T.astype(np.float64, order='C')
+    order = np.argsort(pooled, axis=1)  # NaN last
+    values = np.take_along_axis(pooled, order, axis=1)
+    valid = ~np.isnan(values)
+    from_reference = order < len(reference)
+    n_reference = np.sum(valid & from_reference, axis=1)
+    n_test = np.sum(valid & ~from_reference, axis=1)
+
+    cdf_gap = np.cumsum(valid & from_reference, axis=1) / np.maximum(n_reference, 1)[:, None]
+    cdf_gap -= np.cumsum(valid & ~from_reference, axis=1) / np.maximum(n_test, 1)[:, None]
+    np.abs(cdf_gap, out=cdf_gap)
+    step = np.diff(values, axis=1)
+    # the CDFs are compared after the last of tied values only, which also makes
+    # the order of tied values irrelevant
+    last_of_tie = valid & np.hstack([step != 0, np.ones((len(values), 1), dtype=bool)])
+    ks = np.max(np.where(last_of_tie, cdf_gap, 0.0), axis=1, initial=0.0)
+    # the area between the CDFs, steps next to missing values are NaN
+    wasserstein = np.nansum(cdf_gap[:, :-1] * step, axis=1)
+    return {'n_reference': n_reference, 'n_test': n_test, 'ks_statistic': ks, 'wasserstein': wasserstein}
+
+
+def _ks_pvalue(ks: np.ndarray, n_reference: np.ndarray, n_test: np.ndarray) -> np.ndarray:
+    """Returns the asymptotic two-sided p-value of KS statistics, as scipy's ks_2samp."""
+    pvalue = np.full(len(ks), np.nan)
+    usable = (n_reference > 0) & (n_test > 0)
+    effective_n = np.round(n_reference[usable] * n_test[usable] / (n_reference[usable] + n_test[usable]))
+    pvalue[usable] = stats.kstwo.sf(ks[usable], np.maximum(effective_n, 1))
+    return np.clip(pvalue, 0, 1)
+
+
+def _histogram_matrix(histograms: pd.Series, n_bins: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Turns the stored per-plane histograms into a matrix with ``n_bins`` columns.
+
+    The histograms are arrays in memory and in Parquet tables, and lists in CSV
+    tables. The CSV tables of older versions hold the text form numpy shortens for
+    long histograms: those cannot be read and are skipped.
+    Histograms with a multiple of ``n_bins`` bins are merged into ``n_bins`` bins.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The matrix, and the rows of ``histograms``
+        it holds.
+    """
+    parsed, rows = [], []
+    for row, histogram in enumerate(histograms):
+        if isinstance(histogram, str):
+            if '...' in histogram:
+                continue
+            histogram = np.array(histogram.strip('[]').replace(',', ' ').split(), dtype=np.float64)
+        elif histogram is None or np.ndim(histogram) != 1:
+            continue
+        histogram = np.asarray(histogram, dtype=np.float64)
+        if len(histogram) < n_bins or len(histogram) % n_bins:
+            continue
+        parsed.append(histogram.reshape(n_bins, -1).sum(axis=1))
+        rows.append(row)
+    if not parsed:
+        return np.zeros((0, n_bins)), np.zeros(0, dtype=np.intp)
+    return np.stack(parsed), np.asarray(rows, dtype=np.intp)
+
+
+class DistributionComparison:
+    """
+    Compares the feature distributions of a test run with those of a reference run,
+    e.g. today's batch against a known-good one, or instrument A against B.
+
+    For every feature and channel, the two samples of planes are compared with the
+    two-sample Kolmogorov-Smirnov test, the Wasserstein distance and two effect
+    sizes: Cohen's d and the shift of the median in robust standard deviations of
+    the reference. All the features of a channel are compared at once, from one
+    column-wise sort of the pooled samples. The stored intensity histograms are
+    compared per channel with divergences between the summed histograms.
+    """
+
+    def __init__(self, group_column: str = 'C', alpha: float = 0.01, min_effect_size: float = 0.2,
+                 histogram_bins: int = 256):
+        """
+        Initializes the DistributionComparison.
+
+        Args:
+            group_column (str): Column grouping the planes compared together.
+            alpha (float): Significance level of the KS tests, Bonferroni corrected
+                over all the features and groups.
+            min_effect_size (float): Smallest absolute Cohen's d of a drifted feature,
+                so that negligible but significant shifts of large runs are not flagged.
+            histogram_bins (int): Number of bins the histograms are merged into.
+        """
+        self.group_column = group_column
+        self.alpha = alpha
+        self.min_effect_size = min_effect_size
+        self.histogram_bins = histogram_bins
+
+    def _groups(self, test: pd.DataFrame, reference: pd.DataFrame) -> list[tuple[object, np.ndarray, np.ndarray]]:
+        """Returns the groups found in both tables and their rows in each table."""
+        if self.group_column not in test.columns or self.group_column not in reference.columns:
+            return [('all', np.arange(len(reference)), np.arange(len(test)))]
+        reference_groups = reference[self.group_column].to_numpy()
+        test_groups = test[self.group_column].to_numpy()
+        keys = pd.unique(reference[self.group_column])
+        missing = set(pd.unique(test[self.group_column])) - set(keys)
+        if missing:
+            logger.warning(f"{self.group_column} {sorted(missing)} of the test run are not in the reference.")
+        return [
+            (key, np.flatnonzero(reference_groups == key), np.flatnonzero(test_groups == key))
+            for key in keys
+        ]
+
+    def compare(self, test: pd.DataFrame, reference: pd.DataFrame) -> pd.DataFrame:
+        """
+        Compares the features of each group of planes of two feature tables.
+
+        Args:
+            test (pd.DataFrame): Feature table of the run checked.
+            reference (pd.DataFrame): Feature table of the reference run.
+
+        Returns:
+            pd.DataFrame: One row per feature and group, with the columns ``feature``,
+            the group column and COMPARISON_COLUMNS, ranked from the most drifted:
+            drifted features first, then by decreasing KS statistic.
+        """
+        columns, _ = _feature_layout(reference)
+        missing = [col for col in columns if col not in test.columns]
+        if missing:
+            logger.warning(f"Features {missing} of the reference are not in the test run.")
+            columns = [col for col in columns if col in test.columns]
+        reference_matrix = _to_matrix(reference, columns)
+        test_matrix = _to_matrix(test, columns)
+
+        tables = []
+        for key, reference_rows, test_rows in self._groups(test, reference):
+            a, b = reference_matrix[reference_rows], test_matrix[test_rows]
+            result = _two_sample_stats(a, b)
+            # all-NaN features and groups warn and give NaN
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                a, b = a.astype(np.float64), b.astype(np.float64)
+                reference_median, test_median = np.nanmedian(a, axis=0), np.nanmedian(b, axis=0)
+                robust_std = MAD_TO_STD * np.nanmedian(np.abs(a - reference_median), axis=0)
+                variances = (np.nanvar(a, axis=0, ddof=1), np.nanvar(b, axis=0, ddof=1))
+                n_a, n_b = result['n_reference'], result['n_test']
+                pooled_std = np.sqrt(((n_a - 1) * variances[0] + (n_b - 1) * variances[1]) / (n_a + n_b - 2))
+                scale = np.where(pooled_std > 0, pooled_std, np.nan)
+                effect_size = (np.nanmean(b, axis=0) - np.nanmean(a, axis=0)) / scale
+                robust_shift = (test_median - reference_median) / np.where(robust_std > 0, robust_std, scale)
+            tables.append(pd.DataFrame({
+                'feature': columns,
+                self.group_column: key,
+                'n_reference': n_a,
+                'n_test': n_b,
+                'reference_median': reference_median,
+                'test_median': test_median,
+                'ks_statistic': result['ks_statistic'],
+                'ks_pvalue': _ks_pvalue(result['ks_statistic'], n_a, n_b),
+                'wasserstein': result['wasserstein'],
+                'wasserstein_scaled': result['wasserstein'] / scale,
+                'effect_size': effect_size,
+                'robust_shift': robust_shift,
+            }))
+        if not tables:
+            return pd.DataFrame(columns=['feature', self.group_column, *COMPARISON_COLUMNS])
+
+        comparison = pd.concat(tables, ignore_index=True)
+        n_tests = max(int(comparison['ks_pvalue'].notna().sum()), 1)
+        comparison['drifted'] = (comparison['ks_pvalue'] * n_tests < self.alpha) \
+            & (comparison['effect_size'].abs() >= self.min_effect_size)
+        comparison = comparison.sort_values(['drifted', 'ks_statistic'], ascending=False, kind='stable')
+        logger.info(f"{int(comparison['drifted'].sum())} of {len(comparison)} feature distributions drifted.")
+        return comparison.reset_index(drop=True)
+
+    def compare_histograms(self, test: pd.DataFrame, reference: pd.DataFrame) -> pd.DataFrame:
+        """
+        Compares the summed intensity histograms of each group of planes of two
+        feature tables.
+
+        The histograms of the planes of a group are summed and normalized into one
+        intensity distribution per run, and the two distributions are compared with
+        the Jensen-Shannon divergence (base 2, from 0 to 1), the Hellinger distance,
+        the total variation distance and the Wasserstein distance in fractions of
+        the intensity range.
+
+        Args:
+            test (pd.DataFrame): Feature table of the run checked, with histograms.
+            reference (pd.DataFrame): Feature table of the reference run.
+
+        Returns:
+            pd.DataFrame: One row per group, with the group column and
+            HISTOGRAM_COLUMNS, from the most to the least divergent.
+        """
+        if 'histogram' not in test.columns or 'histogram' not in reference.columns:
+            raise ValueError("Both feature tables need the 'histogram' column.")
+        reference_histograms, reference_kept = _histogram_matrix(reference['histogram'], self.histogram_bins)
+        test_histograms, test_kept = _histogram_matrix(test['histogram'], self.histogram_bins)
+
+        keys, p, q, n_reference, n_test = [], [], [], [], []
+        for key, reference_rows, test_rows in self._groups(test, reference):
+            reference_rows = np.isin(reference_kept, reference_rows)
+            test_rows = np.isin(test_kept, test_rows)
+            keys.append(key)
+            n_reference.append(int(reference_rows.sum()))
+            n_test.append(int(test_rows.sum()))
+            p.append(reference_histograms[reference_rows].sum(axis=0))
+            q.append(test_histograms[test_rows].sum(axis=0))
+        p = np.reshape(p, (len(keys), self.histogram_bins))
+        q = np.reshape(q, (len(keys), self.histogram_bins))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            p /= p.sum(axis=1, keepdims=True)
+            q /= q.sum(axis=1, keepdims=True)
+            mixture = (p + q) / 2
+            js = 0.5 * np.sum(np.where(p > 0, p * np.log2(p / mixture), 0), axis=1) \
+                + 0.5 * np.sum(np.where(q > 0, q * np.log2(q / mixture), 0), axis=1)
+        comparison = pd.DataFrame({
+            self.group_column: keys,
+            'n_reference': n_reference,
+            'n_test': n_test,
+            'js_divergence': js,
+            'hellinger': np.sqrt(np.maximum(1 - np.sum(np.sqrt(p * q), axis=1), 0)),
+            'total_variation': 0.5 * np.abs(p - q).sum(axis=1),
+            'wasserstein': np.abs(np.cumsum(p, axis=1) - np.cumsum(q, axis=1)).sum(axis=1) / self.histogram_bins,
+        })
+        return comparison.sort_values('js_divergence', ascending=False, kind='stable').reset_index(drop=True)
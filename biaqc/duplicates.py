@@ -0,0 +1,256 @@
+from __future__ import annotations
+from itertools import combinations
+from math import comb
+import numpy as np
+from ._lazy import lazy_import
+from .analysis import HASH_COLUMNS
+import logging
+
+# Configure logging for the module
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Heavy dependencies, imported when first used
+pd = lazy_import("pandas")
+csgraph = lazy_import("scipy.sparse.csgraph")
+sparse = lazy_import("scipy.sparse")
+
+# Number of bits of the perceptual hashes
+HASH_BITS = 64
+
+# Columns of the table returned by find_duplicates
+DUPLICATE_COLUMNS = ['duplicate_group', 'group_size', 'group_files', 'frozen_frame']
+
+
+def hamming_distance(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Returns the number of bits differing between two arrays of 64-bit hashes."""
+    return np.bitwise_count(np.bitwise_xor(a, b).view(np.uint64))
+
+
+def _flip_masks(bits: int, radius: int) -> np.ndarray:
+    """Returns the masks flipping up to ``radius`` of ``bits`` bits, starting with 0."""
+    masks = [sum(1 << bit for bit in flipped)
+             for count in range(radius + 1) for flipped in combinations(range(bits), count)]
+    return np.array(masks, dtype=np.uint64)
+
+
+def _matches(keys: np.ndarray, order: np.ndarray, probes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Joins probe keys with a sorted key table.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: For each match, the position of the probe and
+        the position of the matching row.
+    """
+    low = np.searchsorted(keys, probes, 'left')
+    counts = np.searchsorted(keys, probes, 'right') - low
+    probe_rows = np.repeat(np.arange(len(probes)), counts)
+    offsets = np.arange(len(probe_rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return probe_rows, order[low[probe_rows] + offsets]
+
+
+def _run_pairs(sorted_keys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the positions of all the pairs of equal values of a sorted array."""
+    n = len(sorted_keys)
+    run_starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    run_sizes = np.diff(np.r_[run_starts, n])
+    run_ends = np.repeat(run_starts + run_sizes, run_sizes)
+    # pair each row with the rows after it in its run, one offset at a time, so that
+    # the work is the number of pairs
+    rows, first, second = np.arange(n), [], []
+    for offset in range(1, int(run_sizes.max(initial=1))):
+        rows = rows[rows + offset < run_ends[rows]]
+        first.append(rows)
+        second.append(rows + offset)
+    if not first:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+    return np.concatenate(first), np.concatenate(second)
+
+
+class HashIndex:
+    """
+    Multi-index hashing of 64-bit perceptual hashes.
+
+    The hashes are cut into ``m`` bit ranges, each sorted once. Two hashes at most
+    ``r`` bits apart differ by at most ``r // m`` bits in one of the ranges, so the
+    candidates of a hash are found by looking up each of its ranges, and the values
+    a few bits away from it, in the sorted tables. Only the candidates are compared
+    bit by bit, which is close to linear in the number of hashes instead of
+    quadratic. The ranges are about log2(n) bits long, so that a lookup returns
+    about one unrelated hash.
+    """
+
+    def __init__(self, hashes: np.ndarray, max_distance: int = 4):
+        """
+        Indexes the hashes.
+
+        Args:
+            hashes (np.ndarray): The hashes, as 64-bit integers.
+            max_distance (int): Largest Hamming distance searched, below 64.
+        """
+        self.hashes = np.ascontiguousarray(hashes, dtype=np.int64)
+        self.max_distance = max_distance
+        n_chunks = int(round(HASH_BITS / max(np.log2(max(len(self.hashes), 2)), 8)))
+        n_chunks = max(1, min(n_chunks, max_distance + 1))
+        self.chunk_radius = max_distance // n_chunks
+        bounds = np.linspace(0, HASH_BITS, n_chunks + 1).astype(int)
+        unsigned = self.hashes.view(np.uint64)
+        # per bit range: the value of each hash, its values sorted, the order sorting
+        # them and the masks of the values looked up around a value
+        self._chunks: list[tuple[int, np.uint64, np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = []
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            shift, mask = np.uint64(start), np.uint64((1 << int(stop - start)) - 1)
+            keys = (unsigned >> shift) & mask
+            order = np.argsort(keys, kind='stable')
+            self._chunks.append((shift, mask, keys, keys[order], order,
+                                 _flip_masks(int(stop - start), self.chunk_radius)))
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def query(self, value: int, max_distance: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the indexed hashes close to a hash.
+
+        Args:
+            value (int): The hash searched.
+            max_distance (int, optional): Largest Hamming distance, at most the one
+                of the index. Defaults to the one of the index.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The positions of the close hashes, in
+            increasing order, and their distance to ``value``.
+        """
+        if max_distance is None:
+            max_distance = self.max_distance
+        if max_distance > self.max_distance:
+            raise ValueError(f"The index searches up to {self.max_distance} bits, not {max_distance}.")
+        unsigned = np.array(value, dtype=np.int64).view(np.uint64)
+        candidates = []
+        for shift, mask, _, sorted_keys, order, flips in self._chunks:
+            _, rows = _matches(sorted_keys, order, ((unsigned >> shift) & mask) ^ flips)
+            candidates.append(rows)
+        candidates = np.unique(np.concatenate(candidates))
+        distance = hamming_distance(self.hashes[candidates], np.int64(value))
+        keep = distance <= max_distance
+        return candidates[keep], distance[keep]
+
+    def pairs(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Finds all the pairs of indexed hashes at most ``max_distance`` bits apart.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray]: The positions ``i < j`` of the
+            two hashes of each pair and their distance.
+        """
+        n = len(self.hashes)
+        found = [np.zeros(0, dtype=np.int64)]
+        for _, mask, keys, _, _, _ in self._chunks:
+            bits = int(mask).bit_length()
+            # values at most r bits apart are equal once the same r bits are erased
+            for erased in _flip_masks(bits, self.chunk_radius)[-comb(bits, self.chunk_radius):]:
+                masked = keys & ~erased
+                order = np.argsort(masked)
+                first, second = _run_pairs(masked[order])
+                first, second = order[first], order[second]
+                first, second = np.minimum(first, second), np.maximum(first, second)
+                distance = hamming_distance(self.hashes[first], self.hashes[second])
+                keep = distance <= self.max_distance
+                found.append(first[keep].astype(np.int64) * n + second[keep])
+        pair_codes = np.unique(np.concatenate(found))
+        first, second = np.divmod(pair_codes, n)
+        return first, second, hamming_distance(self.hashes[first], self.hashes[second])
+
+
+def _combined_codes(features: pd.DataFrame, columns: list[str]) -> np.ndarray:
+    """Returns one integer per row identifying its combination of values of the columns."""
+    codes = np.zeros(len(features), dtype=np.int64)
+    for col in columns:
+        col_codes, col_keys = pd.factorize(features[col], use_na_sentinel=False)
+        codes = codes * len(col_keys) + col_codes
+    return codes
+
+
+def _frozen_frames(features: pd.DataFrame) -> np.ndarray:
+    """
+    Flags the planes whose pixels are identical to the ones of the previous
+    timepoint of the same file, channel and Z, from their checksums. The perceptual
+    hashes cannot tell them apart: they ignore the noise, so the timepoints of a
+    static sample have the same hash.
+    """
+    frozen = np.zeros(len(features), dtype=bool)
+    series = [col for col in ('file_path', 'C', 'Z') if col in features.columns]
+    checksum_column = HASH_COLUMNS[1]
+    if checksum_column not in features.columns:
+        logger.warning(f"The feature table has no '{checksum_column}' column, frozen frames are not searched.")
+        return frozen
+    if 'T' not in features.columns or not series:
+        return frozen
+    hashes = features[checksum_column].to_numpy(dtype=np.int64)
+    codes = _combined_codes(features, series)
+    timepoints = features['T'].to_numpy()
+    order = np.lexsort((timepoints, codes))
+    same = (codes[order][1:] == codes[order][:-1]) & (timepoints[order][1:] == timepoints[order][:-1] + 1) \
+        & (hashes[order][1:] == hashes[order][:-1])
+    frozen[order[1:][same]] = True
+    return frozen
+
+
+def find_duplicates(features: pd.DataFrame, max_distance: int = 4) -> pd.DataFrame:
+    """
+    Finds duplicated fields and frozen frames from the perceptual hashes of a
+    feature table.
+
+    Planes whose hashes are at most ``max_distance`` bits apart are linked, and the
+    connected groups of linked planes spanning more than one series (file and
+    channel) are duplicate groups: the same field acquired twice. Similar planes of
+    a single series, such as the timepoints of a static sample, are not reported.
+    A frozen frame is a timepoint with exactly the same pixels as the previous one
+    of its file, channel and Z, as when a camera repeats a frame, found from the
+    ``plane_checksum`` column.
+
+    Args:
+        features (pd.DataFrame): Feature table with the ``phash`` and
+            ``plane_checksum`` columns written by ND2ImageProcessor.
+        max_distance (int): Largest Hamming distance between near duplicates.
+
+    Returns:
+        pd.DataFrame: One row per plane, with the index of ``features``, holding the
+        columns of DUPLICATE_COLUMNS: the duplicate group (-1 outside any group), its
+        number of planes and of files, and whether the plane is a frozen frame.
+    """
+    hash_column = HASH_COLUMNS[0]
+    if hash_column not in features.columns:
+        raise ValueError(f"The feature table has no '{hash_column}' column, extract the 'hash' feature group.")
+    hashes = features[hash_column].to_numpy(dtype=np.int64)
+
+    # identical hashes are merged first, so that a large group of identical planes
+    # (e.g. blank frames) costs nothing in the pair search
+    unique_hashes, inverse = np.unique(hashes, return_inverse=True)
+    first, second, _ = HashIndex(unique_hashes, max_distance).pairs()
+    graph = sparse.coo_matrix((np.ones(len(first)), (first, second)), shape=(len(unique_hashes),) * 2)
+    _, components = csgraph.connected_components(graph, directed=False)
+    groups = components[inverse]
+
+    table = pd.DataFrame({
+        'group': groups,
+        'series': _combined_codes(features, [col for col in ('file_path', 'C') if col in features.columns]),
+        'file': _combined_codes(features, [col for col in ('file_path',) if col in features.columns]),
+    })
+    per_group = table.groupby('group').agg(size=('group', 'size'), n_series=('series', 'nunique'),
+                                           n_files=('file', 'nunique'))
+    duplicated = per_group.index[per_group['n_series'] > 1]
+    # number the duplicate groups from 0, in order of first appearance
+    is_duplicate = np.isin(groups, duplicated)
+    group_ids = np.full(len(features), -1, dtype=np.int64)
+    group_ids[is_duplicate] = pd.factorize(groups[is_duplicate])[0]
+
+    result = pd.DataFrame({
+        'duplicate_group': group_ids,
+        'group_size': np.where(is_duplicate, per_group['size'].reindex(groups).to_numpy(), 1),
+        'group_files': np.where(is_duplicate, per_group['n_files'].reindex(groups).to_numpy(), 1),
+        'frozen_frame': _frozen_frames(features),
+    }, index=features.index)
+    logger.info(f"Found {int(group_ids.max(initial=-1)) + 1} duplicate groups and "
+                f"{int(result['frozen_frame'].sum())} frozen frames in {len(features)} planes.")
+    return result
@@ -1,10 +1,13 @@
+import zlib
 import numpy as np
-from skimage import io
-from skimage.util import img_as_float, img_as_ubyte
-from scipy.stats import entropy, skew, kurtosis
-from skimage.feature import graycomatrix, graycoprops, local_binary_pattern, canny
-from skimage.restoration import estimate_sigma
-import cv2 as cv
+from ._lazy import lazy_import
+
+# Heavy dependencies, imported when a feature first uses them
+cv = lazy_import("cv2")
+stats = lazy_import("scipy.stats")
+sk_feature = lazy_import("skimage.feature")
+sk_restoration = lazy_import("skimage.restoration")
+sk_util = lazy_import("skimage.util")
 
 
 
@@ -192,6 +195,18 @@ class Sharpness:
         variance = laplacian.var()
         return variance
 
+    def focus_measure(self, downsample: int = 2):
+        """
+        Computes a cheap focus measure: the variance of the Laplacian of the image
+        binned by ``downsample`` pixels in each direction, in float32.
+        """
+        image = self.image.astype(np.float32)
+        if downsample > 1:
+            h = image.shape[0] // downsample * downsample
+            w = image.shape[1] // downsample * downsample
+            image = image[:h, :w].reshape(h // downsample, downsample, w // downsample, downsample).mean(axis=(1, 3))
+        return float(cv.Laplacian(image, cv.CV_32F).var())
+
     def tenengrad(self):
         """
         Computes the Tenengrad focus measure.
@@ -258,7 +273,7 @@ class Noise:
         """
         Estimates the noise level in the image.
         """
-        sigma_est = estimate_sigma(self.image, average_sigmas=True)
+        sigma_est = sk_restoration.estimate_sigma(self.image, average_sigmas=True)
 
         if np.isnan(sigma_est):
             return 0
@@ -285,6 +300,52 @@ class Noise:
         }
     
 
+class PerceptualHash:
+    """
+    64-bit DCT perceptual hash of a plane: planes showing the same field, even with
+    a different noise realisation or a slight intensity change, have hashes a few
+    bits apart. The CRC32 checksum of the pixels is computed alongside, to tell
+    identical planes from merely similar ones.
+    """
+    image: np.ndarray | None = None
+
+    def __init__(self, hash_size: int = 8, resize: int = 32):
+        # the hash is stored as a 64-bit integer, one bit per coefficient of an 8x8 block
+        if hash_size != 8:
+            raise ValueError(f"hash_size must be 8 for a 64-bit hash, got {hash_size}.")
+        self.hash_size = hash_size
+        self.resize = resize
+
+    def set_image(self, image: np.ndarray) -> None:
+        if not isinstance(image, np.ndarray):
+            raise TypeError("Input must be Numpy array")
+
+        self.image = image
+
+    def dct_hash(self):
+        """
+        Computes the hash: one bit per low-frequency DCT coefficient of the shrunk
+        plane, set when the coefficient is above their median. Returned as a signed
+        64-bit integer so that it is stored as such in CSV and Parquet tables.
+        """
+        small = cv.resize(self.image.astype(np.float32), (self.resize, self.resize), interpolation=cv.INTER_AREA)
+        coefficients = cv.dct(small)[:self.hash_size, :self.hash_size].ravel()
+        # the DC coefficient is the mean intensity, not the structure
+        bits = coefficients > np.median(coefficients[1:])
+        bits[0] = False
+        return int(np.packbits(bits).view('>i8')[0])
+
+    def checksum(self):
+        """Computes the CRC32 checksum of the pixel data, equal only for identical planes."""
+        return zlib.crc32(np.ascontiguousarray(self.image).data)
+
+    def extract_all_features(self):
+        return {
+            'phash' : self.dct_hash(),
+            'plane_checksum' : self.checksum()
+        }
+
+
 class IntensityFeatures:
     def __init__(self, image=None, bit_depth=None):
         """
@@ -333,7 +394,7 @@ class IntensityFeatures:
         """
         image = self.image.astype(np.float64)
         image /= (self.num_bins - 1)
-        return img_as_float(image)
+        return sk_util.img_as_float(image)
 
     def mean_intensity(self):
         """Calculates the mean intensity of the image."""
@@ -376,11 +437,11 @@ class IntensityFeatures:
         """Calculates the entropy of the image histogram."""
         hist = self.histogram()
         hist = hist / np.sum(hist)  # Normalize histogram to probabilities
-        return entropy(hist)
+        return stats.entropy(hist)
 
     def skewness(self):
         """Calculates the skewness of the image intensity distribution."""
-        sk = skew(self.normalized_image.flatten())
+        sk = stats.skew(self.normalized_image.flatten())
         if np.isnan(sk):
             return 0
 
@@ -388,7 +449,7 @@ class IntensityFeatures:
 
     def kurtosis(self):
         """Calculates the kurtosis of the image intensity distribution."""
-        kurt =  kurtosis(self.normalized_image.flatten())
+        kurt =  stats.kurtosis(self.normalized_image.flatten())
         if np.isnan(kurt):
             return 0
     
@@ -471,7 +532,7 @@ class TextureFeatures:
         image_uint8 = self._img_to_uint8(self.image)
 
         # Compute GLCM
-        glcm = graycomatrix(
+        glcm = sk_feature.graycomatrix(
             image_uint8,
             distances=distances,
             angles=angles,
@@ -481,12 +542,12 @@ class TextureFeatures:
 
         # Extract texture features
         features = {
-            'contrast': graycoprops(glcm, 'contrast').mean(),
-            'dissimilarity': graycoprops(glcm, 'dissimilarity').mean(),
-            'homogeneity': graycoprops(glcm, 'homogeneity').mean(),
-            'energy': graycoprops(glcm, 'energy').mean(),
-            'correlation': graycoprops(glcm, 'correlation').mean(),
-            'ASM': graycoprops(glcm, 'ASM').mean(),
+            'contrast': sk_feature.graycoprops(glcm, 'contrast').mean(),
+            'dissimilarity': sk_feature.graycoprops(glcm, 'dissimilarity').mean(),
+            'homogeneity': sk_feature.graycoprops(glcm, 'homogeneity').mean(),
+            'energy': sk_feature.graycoprops(glcm, 'energy').mean(),
+            'correlation': sk_feature.graycoprops(glcm, 'correlation').mean(),
+            'ASM': sk_feature.graycoprops(glcm, 'ASM').mean(),
         }
 
         return features
@@ -506,7 +567,7 @@ class TextureFeatures:
             raise ValueError("Image not set. Use set_image method to set the image.")
 
         # Compute LBP
-        lbp = local_binary_pattern(
+        lbp = sk_feature.local_binary_pattern(
             self.image,
             n_points,
             radius,
@@ -0,0 +1,323 @@
+from __future__ import annotations
+import json
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+import numpy as np
+from ._lazy import lazy_import
+import logging
+
+# Configure logging for the module
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Heavy dependencies, imported when first used
+pd = lazy_import("pandas")
+pq = lazy_import("pyarrow.parquet")
+pa = lazy_import("pyarrow")
+
+# Marks the end of the plane stream in the prefetch queue
+_END = object()
+
+# Table formats supported by write_table and read_table, by file extension
+TABLE_FORMATS = {'csv': '.csv', 'parquet': '.parquet'}
+
+
+def _encode_arrays(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns the table with its array cells (e.g. the per-plane histograms) as
+    complete JSON lists, to be written to CSV, where numpy shortens their default
+    text form.
+    """
+    array_columns = [col for col in df.columns[df.dtypes == object]
+                     if df[col].map(lambda v: isinstance(v, np.ndarray)).any()]
+    if array_columns:
+        df = df.copy()
+        for col in array_columns:
+            df[col] = df[col].map(lambda v: json.dumps(v.tolist()) if isinstance(v, np.ndarray) else v)
+    return df
+
+
+def write_table(df: pd.DataFrame, path: str) -> None:
+    """
+    Writes a results table, as Parquet if the path ends with .parquet and CSV otherwise.
+
+    Parquet needs one type per column, so object columns holding other values than
+    strings and arrays (e.g. the unit enums of the metadata) are stored as strings.
+    In CSV, arrays (e.g. the per-plane histograms) are stored as complete JSON lists,
+    as their default text form is shortened by numpy.
+
+    Args:
+        df (pd.DataFrame): The table.
+        path (str): The output path.
+    """
+    if path.endswith(TABLE_FORMATS['parquet']):
+        df = df.copy()
+        for col in df.columns[df.dtypes == object]:
+            if not df[col].map(lambda v: v is None or isinstance(v, (str, np.ndarray, list))).all():
+                df[col] = df[col].map(lambda v: v if v is None else str(v))
+        df.to_parquet(path, index=False)
+    else:
+        _encode_arrays(df).to_csv(path, index=False)
+
+
+def read_table(path: str, **kwargs) -> pd.DataFrame:
+    """
+    Reads a results table written by write_table. Keyword arguments are passed to the
+    pandas reader.
+    """
+    if path.endswith(TABLE_FORMATS['parquet']):
+        return pd.read_parquet(path, **kwargs)
+    return pd.read_csv(path, **kwargs)
+
+
+def iter_table(path: str, chunk_size: int = 100_000, columns: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+    """
+    Reads a results table written by write_table in chunks of rows, so tables larger
+    than the memory can be processed.
+
+    Args:
+        path (str): Path of the CSV or Parquet table.
+        chunk_size (int): Maximum number of rows per chunk.
+        columns (Optional[List[str]]): Columns to read (default: all).
+
+    Yields:
+        pd.DataFrame: The successive chunks of the table.
+    """
+    if path.endswith(TABLE_FORMATS['parquet']):
+        parquet_file = pq.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns):
+            yield batch.to_pandas()
+    else:
+        with pd.read_csv(path, chunksize=chunk_size, usecols=columns) as reader:
+            yield from reader
+
+
+class TableWriter:
+    """
+    Writes a results table chunk by chunk, as Parquet if the path ends with .parquet
+    and CSV otherwise, with array cells as JSON lists as ``write_table`` does. All
+    the chunks must have the columns of the first one.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Initializes the TableWriter. The table is created with the first chunk.
+
+        Args:
+            path (str): The output path.
+        """
+        self.path = path
+        self._parquet_writer = None
+        self._columns: Optional[List[str]] = None
+
+    def write(self, df: pd.DataFrame) -> None:
+        """Appends a chunk of rows to the table."""
+        first = self._columns is None
+        if first:
+            self._columns = list(df.columns)
+        else:
+            df = df[self._columns]
+
+        if self.path.endswith(TABLE_FORMATS['parquet']):
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self._parquet_writer is None:
+                self._parquet_writer = pq.ParquetWriter(self.path, table.schema)
+            self._parquet_writer.write_table(table.cast(self._parquet_writer.schema))
+        else:
+            _encode_arrays(df).to_csv(self.path, mode='w' if first else 'a', header=first, index=False)
+
+    def close(self) -> None:
+        """Finishes the table."""
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
+
+    def __enter__(self) -> "TableWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class PlanePrefetcher:
+    """
+    Reads and decodes planes in a background thread ahead of the consumer.
+
+    The reader thread pulls items from ``source`` (typically
+    ``ND2ImageProcessor.iter_XY_slices``) into a bounded queue while the consumer
+    computes features on the planes already decoded, so file I/O and decompression
+    overlap with feature extraction. At most ``depth`` decoded planes wait in the
+    queue at any time.
+
+    The time each stage spends blocked on the other is recorded in ``stats``:
+
+    - ``read_time``: time the reader spent decoding planes.
+    - ``read_stall``: time the reader waited for a free slot (compute bound).
+    - ``compute_stall``: time the consumer waited for a decoded plane (I/O bound).
+    """
+
+    def __init__(self, source: Iterable[Any], depth: int = 4) -> None:
+        """
+        Initializes the PlanePrefetcher and starts the reader thread.
+
+        Args:
+            source (Iterable): Iterable producing the decoded planes.
+            depth (int): Maximum number of decoded planes waiting in the queue.
+        """
+        if depth < 1:
+            raise ValueError("Prefetch depth must be at least 1.")
+        self.depth = depth
+        self.stats: Dict[str, float] = {
+            'read_time': 0.0,
+            'read_stall': 0.0,
+            'compute_stall': 0.0,
+            'planes': 0,
+        }
+        self._queue: queue.Queue = queue.Queue(maxsize=depth)
+        self._stop = threading.Event()
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._read, args=(iter(source),), daemon=True)
+        self._thread.start()
+
+    def _read(self, source: Iterator[Any]) -> None:
+        """Runs in the reader thread: decodes planes and puts them in the queue."""
+        try:
+            while not self._stop.is_set():
+                start = time.perf_counter()
+                try:
+                    item = next(source)
+                except StopIteration:
+                    break
+                self.stats['read_time'] += time.perf_counter() - start
+                if not self._put(item):
+                    return
+        except BaseException as e:  # forwarded to the consumer
+            self._error = e
+        self._put(_END)
+
+    def _put(self, item: Any) -> bool:
+        """Puts an item in the queue, waiting for a free slot unless stopped."""
+        start = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                self.stats['read_stall'] += time.perf_counter() - start
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __iter__(self) -> Iterator[Any]:
+        try:
+            while True:
+                start = time.perf_counter()
+                item = self._queue.get()
+                self.stats['compute_stall'] += time.perf_counter() - start
+                if item is _END:
+                    break
+                self.stats['planes'] += 1
+                yield item
+            if self._error is not None:
+                raise self._error
+        finally:
+            # after stop, the reader thread is left to end on its own
+            if not self._stop.is_set():
+                self.close()
+
+    @property
+    def ready(self) -> bool:
+        """Whether the next plane (or the end of the stream) is waiting in the queue."""
+        return not self._queue.empty()
+
+    def stop(self) -> None:
+        """
+        Asks the reader thread to stop and drops the planes still in the queue,
+        without waiting: the thread ends once the plane it is decoding, if any, is
+        read. Use it where blocking is not allowed, e.g. in a GUI thread.
+        """
+        self._stop.set()
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+    def close(self) -> None:
+        """Stops the reader thread, waiting for it to end, and drops the planes still in the queue."""
+        self.stop()
+        self._thread.join()
+
+    def log_stats(self, name: str = "") -> None:
+        """Logs the time spent in and blocked on each pipeline stage."""
+        logger.info(
+            f"Prefetch {name}: {self.stats['planes']} planes, "
+            f"read {self.stats['read_time']:.2f}s, "
+            f"read stalled {self.stats['read_stall']:.2f}s, "
+            f"compute stalled {self.stats['compute_stall']:.2f}s."
+        )
+
+
+class RunStore:
+    """
+    An append-only store of the results of a run, kept as CSV tables in a folder.
+    Array cells, such as the per-plane histograms, are stored as JSON lists.
+
+    Each table ``kind`` (e.g. "features", "metadata") lives in
+    ``<folder>/<prefix>_<kind>.csv``. Rows are appended file by file so results are
+    visible while the run is still going, and the header is written with the first
+    rows. Later rows are aligned to that header.
+    """
+
+    def __init__(self, folder_path: str, prefix: str) -> None:
+        """
+        Initializes the RunStore.
+
+        Args:
+            folder_path (str): Folder holding the tables.
+            prefix (str): Name of the run, used as prefix of the table files.
+        """
+        self.folder_path = folder_path
+        self.prefix = prefix
+        os.makedirs(folder_path, exist_ok=True)
+
+    def path(self, kind: str) -> str:
+        """Returns the path of a table of the store."""
+        return os.path.join(self.folder_path, f"{self.prefix}_{kind}.csv")
+
+    def append(self, kind: str, rows: List[Dict[str, Any]]) -> None:
+        """
+        Appends rows to a table of the store.
+
+        Args:
+            kind (str): The table, e.g. "features".
+            rows (List[Dict[str, Any]]): The rows to append.
+        """
+        if not rows:
+            return
+        df = _encode_arrays(pd.DataFrame(rows))
+        csv_path = self.path(kind)
+        if os.path.isfile(csv_path) and os.path.getsize(csv_path) > 0:
+            columns = pd.read_csv(csv_path, nrows=0).columns
+            dropped = [col for col in df.columns if col not in columns]
+            if dropped:
+                logger.warning(f"Columns {dropped} are not in {csv_path} and are not stored.")
+            df.reindex(columns=columns).to_csv(csv_path, mode='a', header=False, index=False)
+        else:
+            df.to_csv(csv_path, index=False)
+
+    def read(self, kind: str, **kwargs) -> pd.DataFrame:
+        """Reads a table of the store. Keyword arguments are passed to pd.read_csv."""
+        return pd.read_csv(self.path(kind), **kwargs)
+
+    def iter(self, kind: str, chunk_size: int = 100_000) -> Iterator[pd.DataFrame]:
+        """Reads a table of the store in chunks of rows (see iter_table)."""
+        return iter_table(self.path(kind), chunk_size)
+
+    def stored_files(self, kind: str = "features") -> Set[str]:
+        """Returns the paths of the image files that already have rows in a table."""
+        if not os.path.isfile(self.path(kind)):
+            return set()
+        return set(self.read(kind, usecols=["file_path"])["file_path"])
@@ -0,0 +1,190 @@
+from __future__ import annotations
+import json
+from typing import Any, Dict, Iterable, Sequence
+import numpy as np
+from ._lazy import lazy_import
+import logging
+
+# Configure logging for the module
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Heavy dependencies, imported when first used
+pd = lazy_import("pandas")
+
+# Percentiles reported by HistogramAggregator.summary
+PERCENTILES = (0.1, 1, 50, 99, 99.9)
+
+
+class HistogramAggregator:
+    """
+    Accumulates the intensity histograms of the planes into exact integer
+    histograms per file and channel and per channel of the whole dataset.
+
+    The per-plane histograms of IntensityFeatures have one bin per intensity level
+    (``2**bit_depth`` bins), so they are added level by level, the histograms of
+    files with fewer bits filling the first bins. Only one histogram per file and
+    channel is kept, and the dataset statistics (percentiles, saturation, bit usage
+    and display range) are derived from the sums without going back to the pixels.
+    """
+
+    def __init__(self, display_saturation: float = 0.001):
+        """
+        Initializes the HistogramAggregator.
+
+        Args:
+            display_saturation (float): Fraction of the pixels left out at each end of
+                the recommended display range.
+        """
+        self.display_saturation = display_saturation
+        self.files: Dict[tuple[str, int], np.ndarray] = {}
+        # per file and channel: number of planes and of pixels at the top level
+        # of the bit depth of each plane
+        self.n_planes: Dict[tuple[str, int], int] = {}
+        self.saturated: Dict[tuple[str, int], int] = {}
+
+    def add(self, file_path: str, channel: int, histogram: np.ndarray) -> None:
+        """
+        Adds the histogram of a plane.
+
+        Args:
+            file_path (str): The file of the plane.
+            channel (int): Its channel.
+            histogram (np.ndarray): Its histogram, one bin per intensity level.
+        """
+        histogram = np.asarray(histogram, dtype=np.int64)
+        key = (file_path, int(channel))
+        total = self.files.get(key)
+        if total is None:
+            self.files[key] = histogram.copy()
+        else:
+            if len(total) < len(histogram):
+                total = self.files[key] = np.pad(total, (0, len(histogram) - len(total)))
+            total[:len(histogram)] += histogram
+        self.n_planes[key] = self.n_planes.get(key, 0) + 1
+        self.saturated[key] = self.saturated.get(key, 0) + int(histogram[-1])
+
+    def add_rows(self, rows: Iterable[Dict[str, Any]]) -> None:
+        """Adds the histograms of feature rows of ND2ImageProcessor."""
+        for row in rows:
+            histogram = row.get('histogram')
+            if histogram is not None:
+                self.add(row['file_path'], row['C'], histogram)
+
+    def merge(self, other: "HistogramAggregator") -> "HistogramAggregator":
+        """Adds the histograms of another aggregator, e.g. of another shard."""
+        for key, histogram in other.files.items():
+            total = self.files.get(key)
+            if total is None:
+                self.files[key] = histogram.copy()
+            else:
+                length = max(len(total), len(histogram))
+                self.files[key] = np.pad(total, (0, length - len(total))) \
+                    + np.pad(histogram, (0, length - len(histogram)))
+            self.n_planes[key] = self.n_planes.get(key, 0) + other.n_planes[key]
+            self.saturated[key] = self.saturated.get(key, 0) + other.saturated[key]
+        return self
+
+    def channels(self) -> Dict[int, tuple[np.ndarray, int, int]]:
+        """Returns the histogram, number of planes and saturated pixels of each channel of the dataset."""
+        totals: Dict[int, list] = {}
+        for key, histogram in sorted(self.files.items()):
+            total = totals.setdefault(key[1], [np.zeros(0, dtype=np.int64), 0, 0])
+            if len(total[0]) < len(histogram):
+                total[0] = np.pad(total[0], (0, len(histogram) - len(total[0])))
+            total[0][:len(histogram)] += histogram
+            total[1] += self.n_planes[key]
+            total[2] += self.saturated[key]
+        return {channel: tuple(total) for channel, total in totals.items()}
+
+    def _statistics(self, histogram: np.ndarray, saturated: int,
+                    percentiles: Sequence[float]) -> Dict[str, float]:
+        """Derives the intensity statistics of a histogram."""
+        n_pixels = int(histogram.sum())
+        if n_pixels == 0:
+            return {'n_pixels': 0}
+        cumulative = np.cumsum(histogram)
+        levels = np.flatnonzero(histogram)
+
+        def level_at(fraction):
+            # the lowest level with at least this fraction of the pixels at or below it
+            return int(np.searchsorted(cumulative, max(fraction * n_pixels, 1)))
+
+        display_min = level_at(self.display_saturation)
+        display_max = level_at(1 - self.display_saturation)
+        probabilities = histogram[levels] / n_pixels
+        statistics = {
+            'n_pixels': n_pixels,
+            'min': int(levels[0]),
+            'max': int(levels[-1]),
+            **{f'p{q:g}': level_at(q / 100) for q in percentiles},
+            'saturated_fraction': saturated / n_pixels,
+            'zero_fraction': histogram[0] / n_pixels,
+            'used_levels': len(levels),
+            'effective_bits': float(np.log2(display_max - display_min + 1)),
+            'entropy_bits': float(-np.sum(probabilities * np.log2(probabilities))),
+            'display_min': display_min,
+            'display_max': display_max,
+        }
+        return statistics
+
+    def summary(self, percentiles: Sequence[float] = PERCENTILES) -> pd.DataFrame:
+        """
+        Summarizes the intensities of each channel of the dataset and of each file.
+
+        Args:
+            percentiles (Sequence[float]): Percentiles reported, between 0 and 100.
+
+        Returns:
+            pd.DataFrame: One row per channel of the dataset (``level`` "dataset")
+            then per file and channel (``level`` "file"), with the number of planes
+            and pixels, the extreme levels, the percentiles, the fractions of
+            saturated and zero pixels, the number of levels used, the bits spanned
+            by the display range and the entropy of the histogram in bits, and the
+            recommended display range.
+        """
+        rows = []
+        for channel, (histogram, n_planes, saturated) in sorted(self.channels().items()):
+            rows.append({'level': 'dataset', 'file_path': '', 'C': channel, 'n_planes': n_planes,
+                         **self._statistics(histogram, saturated, percentiles)})
+        for (file_path, channel), histogram in sorted(self.files.items()):
+            rows.append({'level': 'file', 'file_path': file_path, 'C': channel,
+                         'n_planes': self.n_planes[(file_path, channel)],
+                         **self._statistics(histogram, self.saturated[(file_path, channel)], percentiles)})
+        return pd.DataFrame(rows)
+
+    def save(self, path: str) -> None:
+        """
+        Saves the accumulated histograms to a ``.npz`` file, to merge them later.
+
+        Args:
+            path (str): The output path, ending with .npz.
+        """
+        keys = sorted(self.files)
+        header = {
+            'keys': [[file_path, channel, self.n_planes[(file_path, channel)],
+                      self.saturated[(file_path, channel)]] for file_path, channel in keys],
+        }
+        arrays = {f'histogram.{i}': self.files[key] for i, key in enumerate(keys)}
+        np.savez_compressed(path, header=np.array(json.dumps(header)), **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "HistogramAggregator":
+        """
+        Loads histograms saved with ``save``.
+
+        Args:
+            path (str): Path of the .npz file.
+
+        Returns:
+            HistogramAggregator: The loaded aggregator.
+        """
+        aggregator = cls()
+        with np.load(path, allow_pickle=False) as arrays:
+            header = json.loads(str(arrays['header']))
+            for i, (file_path, channel, n_planes, saturated) in enumerate(header['keys']):
+                key = (file_path, channel)
+                aggregator.files[key] = arrays[f'histogram.{i}']
+                aggregator.n_planes[key] = n_planes
+                aggregator.saturated[key] = saturated
+        return aggregator
@@ -0,0 +1,283 @@
+from __future__ import annotations
+import json
+from dataclasses import dataclass
+from typing import Dict, Optional
+import numpy as np
+from ._lazy import lazy_import
+import logging
+
+# Configure logging for the module
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Heavy dependencies, imported when first used
+cv = lazy_import("cv2")
+pd = lazy_import("pandas")
+
+# Version of the pixel statistics file format, increased when it changes
+FORMAT_VERSION = 1
+
+# Scale turning the median absolute deviation into a standard deviation
+MAD_TO_STD = 1.4826
+
+# Arrays of ChannelPixels saved by PixelAccumulator.save
+_STATE_FIELDS = ('mean', 'm2', 'saturated', 'zeros')
+
+
+@dataclass
+class ChannelPixels:
+    """Running per-pixel statistics of the planes of a channel."""
+    count: int
+    # running mean and sum of squared deviations (Welford), binned
+    mean: np.ndarray
+    m2: np.ndarray
+    # number of planes in which each pixel is saturated, or zero, at full resolution
+    saturated: np.ndarray
+    zeros: np.ndarray
+
+    @property
+    def variance(self) -> np.ndarray:
+        """The per-pixel variance across the planes."""
+        return self.m2 / max(self.count - 1, 1)
+
+
+class PixelAccumulator:
+    """
+    Accumulates per-pixel statistics of the planes of each channel across a
+    dataset, to see what is consistent from frame to frame: uneven illumination
+    and detector defects.
+
+    Each plane updates a running mean and variance image (Welford's algorithm, in
+    float32, optionally binned) and the counts of saturated and zero pixels, so the
+    memory is four image-sized buffers per channel whatever the number of planes.
+    Accumulators of different files or workers are combined with ``merge``.
+    """
+
+    def __init__(self, bin_factor: int = 1):
+        """
+        Initializes the PixelAccumulator.
+
+        Args:
+            bin_factor (int): Number of pixels averaged in each direction in the mean
+                and variance images. The hot and dead pixel maps use the unbinned
+                mean only when it is 1.
+        """
+        self.bin_factor = bin_factor
+        self.channels: Dict[int, ChannelPixels] = {}
+
+    def _bin(self, plane: np.ndarray) -> np.ndarray:
+        """Returns the plane as float32, averaged over bins of ``bin_factor`` pixels."""
+        plane = plane.astype(np.float32)
+        if self.bin_factor > 1:
+            h = plane.shape[0] // self.bin_factor * self.bin_factor
+            w = plane.shape[1] // self.bin_factor * self.bin_factor
+            plane = plane[:h, :w].reshape(h // self.bin_factor, self.bin_factor,
+                                          w // self.bin_factor, self.bin_factor).mean(axis=(1, 3))
+        return plane
+
+    def add(self, channel: int, plane: np.ndarray, bit_depth: Optional[int] = None) -> None:
+        """
+        Adds a plane.
+
+        Args:
+            channel (int): The channel of the plane.
+            plane (np.ndarray): The plane.
+            bit_depth (int, optional): Its bit depth, from which saturated pixels are
+                counted.
+        """
+        channel = int(channel)
+        state = self.channels.get(channel)
+        if state is None:
+            binned = self._bin(plane)
+            state = self.channels[channel] = ChannelPixels(
+                0, np.zeros_like(binned), np.zeros_like(binned),
+                np.zeros(plane.shape, dtype=np.uint32), np.zeros(plane.shape, dtype=np.uint32),
+            )
+        elif state.saturated.shape != plane.shape:
+            logger.warning(f"Skipping a {plane.shape} plane of channel {channel}, "
+                           f"the accumulated planes are {state.saturated.shape}.")
+            return
+
+        state.count += 1
+        delta = self._bin(plane)
+        delta -= state.mean
+        state.mean += delta / state.count
+        # delta * (x - new mean), with x - new mean = delta * (1 - 1 / count)
+        delta *= delta
+        delta *= 1 - 1 / state.count
+        state.m2 += delta
+        if bit_depth:
+            state.saturated += plane >= 2 ** bit_depth - 1
+        state.zeros += plane == 0
+
+    def merge(self, other: "PixelAccumulator") -> "PixelAccumulator":
+        """Adds the statistics of another accumulator with the same binning (Chan et al.)."""
+        for channel, theirs in other.channels.items():
+            ours = self.channels.get(channel)
+            if ours is None:
+                self.channels[channel] = ChannelPixels(theirs.count, *(
+                    getattr(theirs, field).copy() for field in _STATE_FIELDS))
+                continue
+            if ours.saturated.shape != theirs.saturated.shape:
+                logger.warning(f"Skipping channel {channel} of different plane shape.")
+                continue
+            count = ours.count + theirs.count
+            delta = theirs.mean - ours.mean
+            ours.m2 += theirs.m2 + delta ** 2 * (ours.count * theirs.count / count)
+            ours.mean += delta * (theirs.count / count)
+            ours.count = count
+            ours.saturated += theirs.saturated
+            ours.zeros += theirs.zeros
+        return self
+
+    def flat_field(self, channel: int, sigma: Optional[float] = None) -> np.ndarray:
+        """
+        Estimates the illumination profile of a channel: the mean image smoothed by a
+        Gaussian, so that the sample structure averages out, divided by its mean.
+        Dividing a plane by it corrects the uneven illumination.
+
+        Args:
+            channel (int): The channel.
+            sigma (float, optional): Standard deviation of the Gaussian in (binned)
+                pixels. Defaults to 1/50 of the largest image side.
+
+        Returns:
+            np.ndarray: The flat-field, of mean 1.
+        """
+        mean = self.channels[channel].mean
+        if sigma is None:
+            sigma = max(mean.shape) / 50
+        smooth = cv.GaussianBlur(mean, (0, 0), sigmaX=max(sigma, 0.5), borderType=cv.BORDER_REFLECT)
+        average = smooth.mean()
+        return smooth / average if average > 0 else np.ones_like(smooth)
+
+    def vignetting(self, channel: int, flat: Optional[np.ndarray] = None) -> Dict[str, float]:
+        """
+        Measures the vignetting of a channel from its flat-field.
+
+        Returns:
+            Dict[str, float]: ``corner_ratio``, the mean of the four corners (a tenth
+            of each side) over the mean of the centre; ``min_max_ratio``, the darkest
+            over the brightest flat-field value; and ``center_offset_x`` and
+            ``center_offset_y``, the position of the brightest point relative to the
+            image centre, in fractions of the width and height.
+        """
+        if flat is None:
+            flat = self.flat_field(channel)
+        h, w = flat.shape
+        dy, dx = max(h // 10, 1), max(w // 10, 1)
+        corners = np.mean([flat[:dy, :dx].mean(), flat[:dy, -dx:].mean(),
+                           flat[-dy:, :dx].mean(), flat[-dy:, -dx:].mean()])
+        center = flat[h // 2 - dy // 2:h // 2 + dy - dy // 2, w // 2 - dx // 2:w // 2 + dx - dx // 2].mean()
+        y, x = np.unravel_index(np.argmax(flat), flat.shape)
+        return {
+            'corner_ratio': float(corners / center),
+            'min_max_ratio': float(flat.min() / flat.max()),
+            'center_offset_x': float((x + 0.5) / w - 0.5),
+            'center_offset_y': float((y + 0.5) / h - 0.5),
+        }
+
+    def defect_maps(self, channel: int, z_threshold: float = 8.0,
+                    frame_fraction: float = 0.5) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the hot and dead pixels of a channel.
+
+        A pixel is hot when it is saturated in at least ``frame_fraction`` of the
+        planes, or, without binning, when its mean is ``z_threshold`` robust standard
+        deviations above the median of its 3x3 neighbourhood, relative to the temporal
+        noise of the mean around it or to the spread of the fixed pattern if larger. It is dead when it is
+        zero in at least ``frame_fraction`` of the planes, or, without binning, when
+        its mean is as far below its neighbourhood or it never changes.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The boolean hot and dead pixel maps, at
+            full resolution.
+        """
+        state = self.channels[channel]
+        count = max(state.count, 1)
+        hot = state.saturated >= frame_fraction * count
+        dead = state.zeros >= frame_fraction * count
+        if self.bin_factor == 1 and state.count:
+            residual = state.mean - cv.medianBlur(state.mean, 3)
+            scale = MAD_TO_STD * np.median(np.abs(residual - np.median(residual)))
+            if state.count > 1:
+                # in units of the local standard error of the mean, as the noise grows
+                # with the intensity, unless the fixed pattern of the sensor is larger
+                noise = np.sqrt(cv.medianBlur(state.variance.astype(np.float32), 3) / state.count)
+                residual /= np.maximum(noise, 1e-6)
+                scale = max(MAD_TO_STD * np.median(np.abs(residual - np.median(residual))), 1.0)
+            if scale > 0:
+                hot |= residual > z_threshold * scale
+                dead |= residual < -z_threshold * scale
+            if state.count > 2:
+                dead |= (state.m2 == 0) & ~hot
+        return hot, dead
+
+    def summary(self) -> pd.DataFrame:
+        """
+        Summarizes the illumination and defects of each channel.
+
+        Returns:
+            pd.DataFrame: One row per channel with the number of planes, the mean
+            intensity, the vignetting metrics and the numbers of hot and dead pixels.
+        """
+        rows = []
+        for channel, state in sorted(self.channels.items()):
+            hot, dead = self.defect_maps(channel)
+            rows.append({
+                'C': channel,
+                'n_planes': state.count,
+                'mean_intensity': float(state.mean.mean()),
+                **self.vignetting(channel),
+                'n_hot_pixels': int(hot.sum()),
+                'n_dead_pixels': int(dead.sum()),
+            })
+        return pd.DataFrame(rows)
+
+    def save(self, path: str) -> None:
+        """
+        Saves the accumulated statistics, with the flat-field, variance and defect
+        maps of each channel, to a ``.npz`` file.
+
+        Args:
+            path (str): The output path, ending with .npz.
+        """
+        header = {
+            'format_version': FORMAT_VERSION,
+            'bin_factor': self.bin_factor,
+            'channels': {str(channel): state.count for channel, state in self.channels.items()},
+        }
+        arrays = {'header': np.array(json.dumps(header))}
+        for channel, state in self.channels.items():
+            for field in _STATE_FIELDS:
+                arrays[f'channel.{channel}.{field}'] = getattr(state, field)
+            hot, dead = self.defect_maps(channel)
+            arrays[f'channel.{channel}.variance'] = state.variance
+            arrays[f'channel.{channel}.flat_field'] = self.flat_field(channel)
+            arrays[f'channel.{channel}.hot'] = hot
+            arrays[f'channel.{channel}.dead'] = dead
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "PixelAccumulator":
+        """
+        Loads the statistics saved with ``save``, e.g. to merge them.
+
+        Args:
+            path (str): Path of the .npz file.
+
+        Returns:
+            PixelAccumulator: The loaded accumulator.
+        """
+        with np.load(path, allow_pickle=False) as arrays:
+            header = json.loads(str(arrays['header']))
+            if header['format_version'] > FORMAT_VERSION:
+                raise ValueError(
+                    f"{path} has pixel statistics format {header['format_version']}, "
+                    f"this version of biaqc reads up to {FORMAT_VERSION}."
+                )
+            accumulator = cls(bin_factor=header['bin_factor'])
+            for channel, count in header['channels'].items():
+                accumulator.channels[int(channel)] = ChannelPixels(count, *(
+                    arrays[f'channel.{channel}.{field}'] for field in _STATE_FIELDS))
+        return accumulator
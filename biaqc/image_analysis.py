@@ -0,0 +1,279 @@
+from __future__ import annotations
+import warnings
+from dataclasses import dataclass
+import numpy as np
+from ._lazy import lazy_import
+from .analysis import _feature_layout, _to_matrix
+import logging
+
+# Configure logging for the module
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Heavy dependencies, imported when first used
+pd = lazy_import("pandas")
+stats = lazy_import("scipy.stats")
+sk_ensemble = lazy_import("sklearn.ensemble")
+
+# Scale turning the median absolute deviation into a standard deviation for
+# normally distributed features
+MAD_TO_STD = 1.4826
+# Scale turning the mean absolute deviation into a standard deviation, used when
+# more than half of the values of a feature are equal (MAD of 0)
+MEAN_AD_TO_STD = 1.2533
+
+# Columns of the scores returned by OutlierScorer.score
+SCORE_COLUMNS = ['outlier_score', 'is_outlier', 'robust_z_max', 'robust_z_feature',
+                 'mahalanobis', 'outlier_reasons']
+
+
+def _group_slices(codes: np.ndarray) -> tuple[np.ndarray, list[slice]]:
+    """
+    Returns the order sorting rows by group and the slice of each group in it.
+
+    Args:
+        codes (np.ndarray): Group code of each row, from 0 to the number of groups - 1.
+
+    Returns:
+        tuple[np.ndarray, list[slice]]: The sort order and one slice per group.
+    """
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(codes.max() + 2 if len(codes) else 1))
+    return order, [slice(start, stop) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def _robust_z(block: np.ndarray, median: np.ndarray, scale: np.ndarray) -> np.ndarray:
+    """Turns the features of a group into robust z-scores in place, 0 where missing."""
+    block -= median.astype(np.float32)
+    block /= scale.astype(np.float32)
+    np.nan_to_num(block, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+    return block
+
+
+@dataclass
+class GroupStats:
+    """Statistics of the features of a group of planes, fitted by OutlierScorer."""
+    median: np.ndarray
+    scale: np.ndarray
+    # mean of the robust z-scores, first principal components (one per column)
+    # and their variances
+    center: np.ndarray
+    components: np.ndarray
+    eigenvalues: np.ndarray
+    threshold: float
+
+    def mahalanobis(self, z: np.ndarray) -> np.ndarray:
+        """Returns the Mahalanobis distance of robust z-scores in the principal component space."""
+        projected = (z - self.center) @ self.components
+        return np.sqrt(np.sum(projected ** 2 / self.eigenvalues, axis=1))
+
+
+class OutlierScorer:
+    """
+    Scores how unusual each plane is compared to the other planes of its channel.
+
+    Three scores are computed per channel (or any other grouping column):
+
+    - a robust z-score of every feature, from the median and the median absolute
+      deviation, flagging planes with a feature far from the typical value;
+    - the Mahalanobis distance in the space of the first principal components of
+      the robust z-scores, flagging unusual combinations of features;
+    - optionally the anomaly score of an IsolationForest.
+
+    Each score is divided by its threshold and the largest ratio is the
+    ``outlier_score``: a plane is flagged when it is at least 1.
+    """
+
+    def __init__(self, z_threshold: float = 3.5, mahalanobis_quantile: float = 0.999,
+                 n_components: int = 5, isolation_forest: bool = False,
+                 group_column: str = 'C', max_reasons: int = 3):
+        """
+        Initializes the OutlierScorer.
+
+        Args:
+            z_threshold (float): Absolute robust z-score above which a feature is unusual.
+            mahalanobis_quantile (float): Quantile of the chi-squared distribution used
+                as threshold of the squared Mahalanobis distance.
+            n_components (int): Number of principal components of the Mahalanobis distance.
+            isolation_forest (bool): Whether to also score the planes with an IsolationForest.
+            group_column (str): Column grouping the planes scored together.
+            max_reasons (int): Maximum number of unusual features listed per plane.
+        """
+        self.z_threshold = z_threshold
+        self.mahalanobis_quantile = mahalanobis_quantile
+        self.n_components = n_components
+        self.isolation_forest = isolation_forest
+        self.group_column = group_column
+        self.max_reasons = max_reasons
+        self.feature_columns: list[str] = []
+        self.group_stats: dict[str, GroupStats] = {}
+        self.robust_z: np.ndarray | None = None
+
+    def _fit_robust(self, block: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the median and robust standard deviation of each feature of a group."""
+        # all-NaN features warn and give NaN, which ends up as a z-score of 0
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            median = np.nanmedian(block, axis=0)
+            deviation = np.abs(block - median)
+            scale = MAD_TO_STD * np.nanmedian(deviation, axis=0)
+            fallback = MEAN_AD_TO_STD * np.nanmean(deviation, axis=0)
+        scale = np.where(scale > 0, scale, fallback)
+        # constant features do not tell planes apart
+        scale = np.where(np.isfinite(scale) & (scale > 0), scale, np.inf)
+        return median, scale
+
+    def _fit_covariance(self, z: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns the mean of the robust z-scores of a group, and the first principal
+        components and their variances.
+        """
+        center = z.mean(axis=0) if len(z) else np.zeros(z.shape[1], dtype=np.float32)
+        n_components = min(self.n_components, z.shape[1], len(z) - 1)
+        if n_components < 1:
+            return center, np.zeros((z.shape[1], 0), dtype=np.float32), np.zeros(0)
+        centered = z - center
+        covariance = (centered.T @ centered).astype(np.float64) / (len(z) - 1)
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+        # eigh sorts the eigenvalues in increasing order
+        eigenvalues = eigenvalues[::-1][:n_components]
+        eigenvectors = eigenvectors[:, ::-1][:, :n_components]
+        keep = eigenvalues > max(eigenvalues[0], 0) * 1e-9
+        return center, eigenvectors[:, keep].astype(np.float32), eigenvalues[keep]
+
+    def _fit_group(self, block: np.ndarray) -> GroupStats:
+        """Fits the statistics of a group, turning its features into robust z-scores in place."""
+        median, scale = self._fit_robust(block)
+        _robust_z(block, median, scale)
+        center, components, eigenvalues = self._fit_covariance(block)
+        threshold = np.sqrt(stats.chi2.ppf(self.mahalanobis_quantile, len(eigenvalues))) \
+            if len(eigenvalues) else np.inf
+        return GroupStats(median, scale, center, components, eigenvalues, float(threshold))
+
+    def _isolation_scores(self, z: np.ndarray, slices: list[slice]) -> np.ndarray:
+        """
+        Returns the IsolationForest anomaly score of each row divided by the score
+        threshold of its group, so that rows from 1 are anomalous.
+        """
+        ratio = np.zeros(len(z), dtype=np.float32)
+        for rows in slices:
+            block = z[rows]
+            if len(block) < 2:
+                continue
+            forest = sk_ensemble.IsolationForest(random_state=0).fit(block)
+            # score_samples and offset_ are negative, lower is more anomalous
+            ratio[rows] = forest.score_samples(block) / forest.offset_
+        return ratio
+
+    def _reasons(self, z: np.ndarray, flagged: np.ndarray, mahalanobis_ratio: np.ndarray,
+                 isolation_ratio: np.ndarray | None) -> np.ndarray:
+        """Describes why each flagged row is an outlier."""
+        reasons = np.full(len(z), '', dtype=object)
+        columns = np.asarray(self.feature_columns)
+        for i in np.flatnonzero(flagged):
+            row = z[i]
+            unusual = np.flatnonzero(np.abs(row) >= self.z_threshold)
+            unusual = unusual[np.argsort(-np.abs(row[unusual]))][:self.max_reasons]
+            parts = [f"{'high' if row[j] > 0 else 'low'} {columns[j]} (z={row[j]:.1f})" for j in unusual]
+            if mahalanobis_ratio[i] >= 1:
+                parts.append("unusual feature combination")
+            if isolation_ratio is not None and isolation_ratio[i] >= 1:
+                parts.append("isolation forest")
+            reasons[i] = "; ".join(parts)
+        return reasons
+
+    def fit(self, features: pd.DataFrame) -> "OutlierScorer":
+        """
+        Fits the statistics of each group of planes of a feature table, to score
+        other tables against them with ``score(features, refit=False)``.
+
+        Args:
+            features (pd.DataFrame): Feature table, one row per plane, as written by
+                ND2ImageProcessor.
+
+        Returns:
+            OutlierScorer: The fitted instance.
+        """
+        self.score(features)
+        return self
+
+    def score(self, features: pd.DataFrame, refit: bool = True) -> pd.DataFrame:
+        """
+        Scores the planes of a feature table.
+
+        Args:
+            features (pd.DataFrame): Feature table, one row per plane, as written by
+                ND2ImageProcessor.
+            refit (bool): Whether to fit the statistics on this table, or score it
+                against the statistics fitted before. The IsolationForest is always
+                fitted on this table.
+
+        Returns:
+            pd.DataFrame: One row per plane, with the index of ``features``, holding
+            the columns of SCORE_COLUMNS and ``isolation_score`` when enabled.
+        """
+        if refit:
+            self.feature_columns, _ = _feature_layout(features)
+            self.group_stats = {}
+        elif not self.group_stats:
+            raise ValueError("The scorer is not fitted.")
+        else:
+            missing = [col for col in self.feature_columns if col not in features.columns]
+            if missing:
+                raise ValueError(f"Features {missing} are missing from the table.")
+
+        if self.group_column in features.columns:
+            codes, keys = pd.factorize(features[self.group_column], use_na_sentinel=False)
+        else:
+            codes, keys = np.zeros(len(features), dtype=np.intp), ['all']
+        order, slices = _group_slices(codes)
+
+        # work on the rows sorted by group so that each group is a contiguous block
+        z = _to_matrix(features, self.feature_columns)[order]
+        mahalanobis = np.zeros(len(z), dtype=np.float32)
+        threshold = np.full(len(z), np.inf, dtype=np.float32)
+        for key, rows in zip(keys, slices):
+            block = z[rows]
+            if refit:
+                group = self.group_stats[str(key)] = self._fit_group(block)
+            else:
+                group = self.group_stats.get(str(key))
+                if group is None:
+                    raise ValueError(f"No reference statistics for {self.group_column} {key}.")
+                _robust_z(block, group.median, group.scale)
+            mahalanobis[rows] = group.mahalanobis(block)
+            threshold[rows] = group.threshold
+
+        abs_z = np.abs(z)
+        if z.shape[1]:
+            max_index = abs_z.argmax(axis=1)
+            z_max = abs_z[np.arange(len(z)), max_index]
+        else:
+            max_index = np.zeros(len(z), dtype=np.intp)
+            z_max = np.zeros(len(z), dtype=np.float32)
+
+        ratios = [z_max / self.z_threshold, mahalanobis / threshold]
+        isolation_ratio = None
+        if self.isolation_forest:
+            isolation_ratio = self._isolation_scores(z, slices)
+            ratios.append(isolation_ratio)
+        outlier_score = np.max(ratios, axis=0)
+        flagged = outlier_score >= 1
+
+        # back to the order of the input rows
+        inverse = np.empty_like(order)
+        inverse[order] = np.arange(len(order))
+        self.robust_z = z[inverse]
+        scores = pd.DataFrame({
+            'outlier_score': outlier_score[inverse].astype(np.float32),
+            'is_outlier': flagged[inverse],
+            'robust_z_max': z_max[inverse].astype(np.float32),
+            'robust_z_feature': np.asarray(self.feature_columns + [''], dtype=object)[
+                np.where(z_max > 0, max_index, len(self.feature_columns))][inverse],
+            'mahalanobis': mahalanobis[inverse],
+            'outlier_reasons': self._reasons(z, flagged, mahalanobis / threshold, isolation_ratio)[inverse],
+        }, index=features.index)
+        if isolation_ratio is not None:
+            scores['isolation_score'] = isolation_ratio[inverse]
+        logger.info(f"Flagged {int(flagged.sum())} of {len(features)} planes as outliers.")
+        return scores
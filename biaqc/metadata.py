@@ -1,12 +1,16 @@
 import os
-import tifffile
-import pandas as pd
-from bioio import BioImage
-import bioio_nd2
-from ome_types import to_dict
 from typing import Any, Dict, List, Optional
+from ._lazy import lazy_import
+from .file_operations import write_table
 import logging
 
+# Heavy dependencies, imported when first used
+bioio = lazy_import("bioio")
+bioio_nd2 = lazy_import("bioio_nd2")
+ome_types = lazy_import("ome_types")
+pd = lazy_import("pandas")
+tifffile = lazy_import("tifffile")
+
 # Configure logging for the module
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -86,11 +90,11 @@ class Metadata:
 
         def load_image(self) -> None:
             """Loads the ND2 image using BioImage and the specified reader."""
-            self.image = BioImage(f"{self.parent.file_path}", reader=bioio_nd2.Reader)
+            self.image = bioio.BioImage(f"{self.parent.file_path}", reader=bioio_nd2.Reader)
 
         def convert_metadata_to_dict(self) -> None:
             """Converts the image metadata to a dictionary."""
-            self.metadata_dict = to_dict(self.image.metadata)
+            self.metadata_dict = ome_types.to_dict(self.image.metadata)
 
         def extract_instrument_metadata(self) -> Dict[str, Any]:
             """Extracts instrument-related metadata from the metadata dictionary."""
@@ -178,6 +182,19 @@ class Metadata:
         reader = self.ReadND2(self)
         return reader.extract_all_metadata()
 
+    def list_files(self, folder_path: str) -> List[str]:
+        """
+        Returns the sorted paths of all ND2 files in a folder.
+
+        Args:
+            folder_path (str): The path to the folder containing ND2 files.
+
+        Returns:
+            List[str]: Sorted list of ND2 file paths.
+        """
+        file_names = sorted(f for f in os.listdir(folder_path) if f.endswith(".nd2"))
+        return [os.path.join(folder_path, f) for f in file_names]
+
     def process_folder(self, folder_path: str, output_csv: str) -> None:
         """
         Processes all ND2 files in a folder and saves their metadata to a CSV file.
@@ -186,18 +203,26 @@ class Metadata:
             folder_path (str): The path to the folder containing ND2 files.
             output_csv (str): The path to the output CSV file.
         """
+        self.process_files(self.list_files(folder_path), output_csv)
+
+    def process_files(self, file_paths: List[str], output_csv: str) -> None:
+        """
+        Processes the given ND2 files and saves their metadata to a CSV file.
+
+        Args:
+            file_paths (List[str]): The paths of the ND2 files, in output order.
+            output_csv (str): The path to the output CSV file.
+        """
         all_metadata = []
-        for file_name in os.listdir(folder_path):
-            if file_name.endswith(".nd2"):
-                file_path = os.path.join(folder_path, file_name)
-                self.set_image_path(file_path)
-                metadata = self.get_nd2_metadata()
-                all_metadata.extend(metadata)
+        for file_path in file_paths:
+            self.set_image_path(file_path)
+            metadata = self.get_nd2_metadata()
+            all_metadata.extend(metadata)
 
         # Save results to CSV
-        # Convert metadata list to a pandas DataFrame and save to CSV
+        # Convert metadata list to a pandas DataFrame and save to CSV (or Parquet)
         self.df = pd.DataFrame(all_metadata)
-        self.df.to_csv(output_csv, index=False)
+        write_table(self.df, output_csv)
 
 
 # def read_nd2_metadata(file_path):
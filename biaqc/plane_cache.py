@@ -0,0 +1,240 @@
+from __future__ import annotations
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List
+import numpy as np
+from ._lazy import lazy_import
+from .file_operations import PlanePrefetcher
+from .scheduler import parse_size
+import logging
+
+# Configure logging for the module
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Heavy dependencies, imported when first used
+bioio = lazy_import("bioio")
+bioio_nd2 = lazy_import("bioio_nd2")
+
+# Memory kept for decoded planes by default
+DEFAULT_BUDGET = "1G"
+
+# Number of planes decoded around the selected one along T and Z, and of frames
+# decoded ahead during playback
+PREFETCH_RADIUS = 3
+PLAYBACK_DEPTH = 16
+
+
+def open_nd2(path: str):
+    """Opens an ND2 file lazily: only its metadata is read until planes are requested."""
+    return bioio.BioImage(path, reader=bioio_nd2.Reader)
+
+
+class PlaneCache:
+    """
+    Decodes single planes of image files on demand and keeps the recently used ones
+    within a memory budget.
+
+    Files are opened lazily (their reader and dask-backed array stay open, which
+    holds no pixel data) and only the requested (C, Z, T) plane is decoded. Decoded
+    planes are kept in least-recently-used order and the oldest are evicted once the
+    budget is exceeded. The cache may be used from several threads; planes are
+    decoded outside the lock.
+    """
+
+    def __init__(self, max_bytes: int | str = DEFAULT_BUDGET,
+                 open_image: Callable[[str], Any] = open_nd2) -> None:
+        """
+        Initializes the PlaneCache.
+
+        Args:
+            max_bytes (int | str): Memory budget of the decoded planes, in bytes or
+                with a K/M/G suffix. The last plane is kept even if larger.
+            open_image (Callable[[str], Any]): Opens a file as a bioio image, whose
+                ``xarray_dask_data`` has C, Z and T dimensions.
+        """
+        self.max_bytes = parse_size(max_bytes)
+        self.open_image = open_image
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._images: Dict[str, Any] = {}
+        self._planes: OrderedDict[tuple[str, int, int, int], np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._planes)
+
+    def __contains__(self, key: tuple[str, int, int, int]) -> bool:
+        return key in self._planes
+
+    def lazy_array(self, path: str):
+        """
+        Returns the lazy (dask-backed) xarray of a file, e.g. to browse it in a viewer
+        without loading it.
+
+        Args:
+            path (str): The file.
+        """
+        with self._lock:
+            image = self._images.get(path)
+        if image is None:
+            image = self.open_image(path)
+            with self._lock:
+                image = self._images.setdefault(path, image)
+        return image.xarray_dask_data
+
+    def get(self, path: str, c: int, z: int, t: int) -> np.ndarray:
+        """
+        Returns a plane, decoding it unless it is cached.
+
+        Args:
+            path (str): The file.
+            c (int): Channel.
+            z (int): Z position.
+            t (int): Timepoint.
+
+        Returns:
+            np.ndarray: The YX plane. It is shared with the cache and must not be
+            modified.
+        """
+        key = (path, int(c), int(z), int(t))
+        with self._lock:
+            plane = self._planes.get(key)
+            if plane is not None:
+                self._planes.move_to_end(key)
+                self.hits += 1
+                return plane
+            self.misses += 1
+
+        plane = np.asarray(self.lazy_array(path).isel(C=key[1], Z=key[2], T=key[3]).to_numpy())
+        plane.setflags(write=False)
+        self.put(key, plane)
+        return plane
+
+    def put(self, key: tuple[str, int, int, int], plane: np.ndarray) -> None:
+        """Adds a decoded plane as the most recently used, evicting the oldest over budget."""
+        with self._lock:
+            previous = self._planes.pop(key, None)
+            if previous is not None:
+                self.nbytes -= previous.nbytes
+            self._planes[key] = plane
+            self.nbytes += plane.nbytes
+            while self.nbytes > self.max_bytes and len(self._planes) > 1:
+                _, evicted = self._planes.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def clear(self) -> None:
+        """Forgets the decoded planes and the opened files."""
+        with self._lock:
+            self._planes.clear()
+            self._images.clear()
+            self.nbytes = 0
+
+
+def neighbour_planes(z: int, t: int, n_z: int, n_t: int, radius: int = PREFETCH_RADIUS) -> List[tuple[int, int]]:
+    """
+    Returns the (Z, T) positions around a plane, nearest first and the next
+    timepoint before the previous one, within the bounds of the stack.
+
+    Args:
+        z (int): Z position of the plane.
+        t (int): Its timepoint.
+        n_z (int): Number of Z positions.
+        n_t (int): Number of timepoints.
+        radius (int): Number of planes on each side along T and Z.
+    """
+    positions = []
+    for d in range(1, radius + 1):
+        for zz, tt in ((z, t + d), (z, t - d), (z + d, t), (z - d, t)):
+            if 0 <= zz < n_z and 0 <= tt < n_t:
+                positions.append((zz, tt))
+    return positions
+
+
+class NeighbourPrefetcher:
+    """
+    Decodes the planes around the selected one into a PlaneCache in a background
+    thread, so stepping through T or Z from a plane finds them decoded.
+
+    Each call to ``prefetch`` supersedes the previous one: the planes of an older
+    selection not decoded yet are skipped.
+    """
+
+    def __init__(self, cache: PlaneCache, radius: int = PREFETCH_RADIUS) -> None:
+        """
+        Initializes the NeighbourPrefetcher.
+
+        Args:
+            cache (PlaneCache): The cache the planes are decoded into.
+            radius (int): Number of planes decoded on each side along T and Z.
+        """
+        self.cache = cache
+        self.radius = radius
+        self.prefetched = 0
+        self._generation = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="plane-prefetch")
+
+    def prefetch(self, path: str, c: int, z: int, t: int) -> Future:
+        """
+        Starts decoding the planes of the same channel around a plane.
+
+        Returns:
+            Future: Done once the planes are decoded or superseded.
+        """
+        self._generation += 1
+        return self._executor.submit(self._prefetch, self._generation, path, c, z, t)
+
+    def _prefetch(self, generation: int, path: str, c: int, z: int, t: int) -> None:
+        """Runs in the prefetch thread: decodes the missing neighbours of a plane."""
+        try:
+            sizes = self.cache.lazy_array(path).sizes
+            for zz, tt in neighbour_planes(z, t, sizes['Z'], sizes['T'], self.radius):
+                if generation != self._generation:
+                    return
+                if (path, c, zz, tt) not in self.cache:
+                    self.cache.get(path, c, zz, tt)
+                    self.prefetched += 1
+        except Exception as e:  # prefetching is best effort, the viewer reads on demand
+            logger.warning(f"Prefetching around {path} C={c} Z={z} T={t} failed: {e}")
+
+    def close(self) -> None:
+        """Skips the pending planes and stops the prefetch thread."""
+        self._generation += 1
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+def playback(cache: PlaneCache, path: str, c: int, z: int, start: int = 0,
+             depth: int = PLAYBACK_DEPTH, loop: bool = True) -> PlanePrefetcher:
+    """
+    Plays the timepoints of a plane: a reader thread decodes the next frames into a
+    ring buffer of ``depth`` frames while the current ones are shown.
+
+    Args:
+        cache (PlaneCache): The cache the frames are read through, so that frames
+            seen before (e.g. in an earlier loop) are not decoded again.
+        path (str): The file.
+        c (int): Channel.
+        z (int): Z position.
+        start (int): First timepoint played.
+        depth (int): Number of frames decoded ahead.
+        loop (bool): Whether to start over after the last timepoint.
+
+    Returns:
+        PlanePrefetcher: Yields (T, frame) in order; ``ready`` tells whether the next
+        frame is decoded. Stop or close it to stop the playback.
+    """
+    n_t = cache.lazy_array(path).sizes['T']
+
+    def frames() -> Iterator[tuple[int, np.ndarray]]:
+        t = start % n_t
+        while True:
+            yield t, cache.get(path, c, z, t)
+            t += 1
+            if t == n_t:
+                if not loop:
+                    return
+                t = 0
+
+    return PlanePrefetcher(frames(), depth=depth)
@@ -0,0 +1,195 @@
+from __future__ import annotations
+import copy
+import json
+import time
+import numpy as np
+from . import __version__
+from ._lazy import lazy_import
+from .analysis import ID_COLUMNS, FeaturePCA, _pca_table, _standardize, _to_matrix
+from .image_analysis import GroupStats, OutlierScorer
+import logging
+
+# Configure logging for the module
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Heavy dependencies, imported when first used
+pd = lazy_import("pandas")
+
+# Version of the reference model file format, increased when it changes
+FORMAT_VERSION = 1
+
+# Parameters of the OutlierScorer kept in the reference model file
+_SCORER_PARAMS = ['z_threshold', 'mahalanobis_quantile', 'n_components', 'group_column', 'max_reasons']
+
+
+class ReferenceModel:
+    """
+    A QC model fitted once on known-good planes and reused to embed and score new
+    batches.
+
+    The model holds the feature standardization, the principal components of each
+    feature group and the robust statistics and covariance of each channel. New
+    tables are projected on it with matrix products and no refitting, so the PCA
+    coordinates and outlier scores of different runs are comparable. It is saved as
+    a small versioned ``.npz`` file.
+    """
+
+    def __init__(self, n_components: int = 2, scorer: OutlierScorer | None = None):
+        """
+        Initializes the ReferenceModel.
+
+        Args:
+            n_components (int): Number of principal components per feature group.
+            scorer (OutlierScorer | None): Scorer with the outlier thresholds to use
+                (default: OutlierScorer()). A copy without the IsolationForest is
+                kept, the given scorer is not modified.
+        """
+        self.n_components = n_components
+        self.scorer = copy.copy(scorer) if scorer is not None else OutlierScorer()
+        self.scorer.isolation_forest = False
+        self.feature_columns: list[str] = []
+        self.group_slices: dict[str, slice] = {}
+        self.mean: np.ndarray | None = None
+        self.scale: np.ndarray | None = None
+        # center and components (one per row) of the PCA of each group, and "all"
+        self.pca: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+        self.info: dict = {}
+
+    def fit(self, features: pd.DataFrame) -> "ReferenceModel":
+        """
+        Fits the model on a feature table of known-good planes.
+
+        Args:
+            features (pd.DataFrame): Feature table, one row per plane, as written by
+                ND2ImageProcessor.
+
+        Returns:
+            ReferenceModel: The fitted instance.
+        """
+        feature_pca = FeaturePCA()
+        feature_pca.set_data(features)
+        matrix = feature_pca.feature_matrix()
+        self.feature_columns = feature_pca.feature_columns
+        self.group_slices = feature_pca.group_slices
+        self.mean, self.scale = feature_pca.mean, feature_pca.scale
+
+        self.pca = {}
+        for group in [*self.group_slices, 'all']:
+            if group == 'noise':
+                continue
+            view = matrix if group == 'all' else matrix[:, self.group_slices[group]]
+            feature_pca._fit_pca(group, view, self.n_components)
+            model = feature_pca.pca_models[group]
+            self.pca[group] = (model.mean_.astype(np.float32), model.components_.astype(np.float32))
+
+        self.scorer.fit(features)
+        self.info = {
+            'n_samples': len(features),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'biaqc_version': __version__,
+        }
+        return self
+
+    def _check_columns(self, features: pd.DataFrame) -> None:
+        missing = [col for col in self.feature_columns if col not in features.columns]
+        if missing:
+            raise ValueError(f"Features {missing} of the reference model are missing from the table.")
+
+    def transform(self, features: pd.DataFrame) -> pd.DataFrame:
+        """
+        Projects a feature table on the principal components of the model.
+
+        Args:
+            features (pd.DataFrame): Feature table, one row per plane.
+
+        Returns:
+            pd.DataFrame: The identifier columns followed by the PCA components, with
+            the columns of ``FeaturePCA.combine_pcas``.
+        """
+        self._check_columns(features)
+        matrix = _standardize(_to_matrix(features, self.feature_columns), self.mean, self.scale)
+        components = {}
+        for group, (center, axes) in self.pca.items():
+            view = matrix if group == 'all' else matrix[:, self.group_slices[group]]
+            components[group] = (view - center) @ axes.T
+        id_columns = [col for col in ID_COLUMNS if col in features.columns]
+        return _pca_table(features, id_columns, self.n_components, components)
+
+    def score(self, features: pd.DataFrame) -> pd.DataFrame:
+        """
+        Scores the planes of a feature table against the reference statistics.
+
+        Args:
+            features (pd.DataFrame): Feature table, one row per plane.
+
+        Returns:
+            pd.DataFrame: The scores of OutlierScorer.score, with the index of ``features``.
+        """
+        self._check_columns(features)
+        return self.scorer.score(features, refit=False)
+
+    def save(self, path: str) -> None:
+        """
+        Saves the model to a ``.npz`` file.
+
+        Args:
+            path (str): The output path, ending with .npz.
+        """
+        header = {
+            'format_version': FORMAT_VERSION,
+            **self.info,
+            'n_components': self.n_components,
+            'feature_columns': self.feature_columns,
+            'group_slices': {group: [sl.start, sl.stop] for group, sl in self.group_slices.items()},
+            'pca_groups': list(self.pca),
+            'channels': list(self.scorer.group_stats),
+            'scorer': {param: getattr(self.scorer, param) for param in _SCORER_PARAMS},
+        }
+        arrays = {'header': np.array(json.dumps(header)), 'mean': self.mean, 'scale': self.scale}
+        for group, (center, axes) in self.pca.items():
+            arrays[f'pca.{group}.center'] = center
+            arrays[f'pca.{group}.components'] = axes
+        for channel, stats in self.scorer.group_stats.items():
+            for field in ('median', 'scale', 'center', 'components', 'eigenvalues'):
+                arrays[f'channel.{channel}.{field}'] = getattr(stats, field)
+            arrays[f'channel.{channel}.threshold'] = np.array(stats.threshold)
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "ReferenceModel":
+        """
+        Loads a model saved with ``save``.
+
+        Args:
+            path (str): Path of the .npz file.
+
+        Returns:
+            ReferenceModel: The loaded model.
+        """
+        with np.load(path, allow_pickle=False) as arrays:
+            header = json.loads(str(arrays['header']))
+            if header['format_version'] > FORMAT_VERSION:
+                raise ValueError(
+                    f"{path} has reference model format {header['format_version']}, "
+                    f"this version of biaqc reads up to {FORMAT_VERSION}."
+                )
+            model = cls(n_components=header['n_components'], scorer=OutlierScorer(**header['scorer']))
+            model.feature_columns = header['feature_columns']
+            model.group_slices = {group: slice(*bounds) for group, bounds in header['group_slices'].items()}
+            model.mean, model.scale = arrays['mean'], arrays['scale']
+            model.pca = {
+                group: (arrays[f'pca.{group}.center'], arrays[f'pca.{group}.components'])
+                for group in header['pca_groups']
+            }
+            model.scorer.feature_columns = model.feature_columns
+            model.scorer.group_stats = {
+                channel: GroupStats(
+                    *(arrays[f'channel.{channel}.{field}']
+                      for field in ('median', 'scale', 'center', 'components', 'eigenvalues')),
+                    threshold=float(arrays[f'channel.{channel}.threshold']),
+                )
+                for channel in header['channels']
+            }
+            model.info = {key: header[key] for key in ('n_samples', 'created', 'biaqc_version')}
+        return model
@@ -0,0 +1,206 @@
+import os
+import re
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from .metadata import Metadata
+import logging
+
+# Configure logging for the module
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Peak working memory of each feature group, in bytes per pixel of the plane.
+# Counted from the temporaries the extractors allocate, e.g. Sharpness holds the
+# complex128 FFT and its shifted copy, IntensityFeatures a float64 normalized image.
+FEATURE_BYTES_PER_PIXEL: Dict[str, int] = {
+    'intensity': 24,
+    'noise': 40,
+    'sharpness': 56,
+    'texture': 24,
+    'hash': 4,
+}
+
+# Memory of a feature row without its histogram, in bytes
+ROW_BYTES = 4096
+
+# Plane width and height assumed when the metadata does not give them, in pixels
+DEFAULT_PLANE_SIZE = 2048
+
+_SIZE_UNITS = {'': 1, 'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+
+
+def parse_size(size: str | int) -> int:
+    """
+    Parses a memory size such as "512M" or "16G" into bytes.
+
+    Args:
+        size (str | int): The size, as a number of bytes or with a K/M/G/T suffix.
+
+    Returns:
+        int: The size in bytes.
+    """
+    if isinstance(size, int):
+        return size
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*", size.upper())
+    if match is None:
+        raise ValueError(f"Invalid memory size '{size}'.")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2)])
+
+
+@dataclass
+class FileEstimate:
+    """Memory footprint of processing one file, estimated from its metadata."""
+    file_path: str
+    size_x: int
+    size_y: int
+    size_z: int
+    size_c: int
+    size_t: int
+    significant_bits: int
+
+    @property
+    def n_planes(self) -> int:
+        return self.size_z * self.size_c * self.size_t
+
+    @property
+    def plane_bytes(self) -> int:
+        """Bytes of one decoded plane."""
+        bytes_per_pixel = 1 if self.significant_bits <= 8 else 2 if self.significant_bits <= 16 else 4
+        return self.size_x * self.size_y * bytes_per_pixel
+
+    def plane_peak_bytes(self, feature_groups: Sequence[str]) -> int:
+        """Peak memory of extracting the features of one plane, including the plane."""
+        working = max(FEATURE_BYTES_PER_PIXEL[group] for group in feature_groups)
+        return self.plane_bytes + self.size_x * self.size_y * working
+
+    def result_bytes(self) -> int:
+        """Memory of the feature rows of the file, dominated by the histograms."""
+        return self.n_planes * (ROW_BYTES + 8 * 2 ** self.significant_bits)
+
+    def task_bytes(self, feature_groups: Sequence[str], planes_in_flight: int = 1) -> int:
+        """Peak memory of processing the whole file in one worker."""
+        return planes_in_flight * self.plane_peak_bytes(feature_groups) + self.result_bytes()
+
+
+def estimate_file(file_path: str) -> FileEstimate:
+    """
+    Reads the dimensions and bit depth of an ND2 file from its metadata only.
+
+    Args:
+        file_path (str): Path to the ND2 file.
+
+    Returns:
+        FileEstimate: The estimate of the file.
+    """
+    metadata = Metadata()
+    metadata.set_image_path(file_path)
+    reader = metadata.ReadND2(metadata)
+    reader.load_image()
+    reader.convert_metadata_to_dict()
+    pixels = reader.extract_pixels_metadata()
+    return _estimate_from_pixels(file_path, pixels)
+
+
+def _estimate_from_pixels(file_path: str, pixels: Dict[str, Any]) -> FileEstimate:
+    """Builds the estimate of a file from its pixels metadata, filling in the missing
+    sizes (left as [] by the reader) with defaults."""
+    if not pixels['size_x'] or not pixels['size_y']:
+        logger.warning(f"No plane size in the metadata of {file_path}, "
+                       f"assuming {DEFAULT_PLANE_SIZE}x{DEFAULT_PLANE_SIZE} pixels.")
+    return FileEstimate(
+        file_path=file_path,
+        size_x=int(pixels['size_x'] or DEFAULT_PLANE_SIZE),
+        size_y=int(pixels['size_y'] or DEFAULT_PLANE_SIZE),
+        size_z=int(pixels['size_z'] or 1),
+        size_c=int(pixels['size_c'] or 1),
+        size_t=int(pixels['size_t'] or 1),
+        significant_bits=int(pixels['significant_bits'] or 16),
+    )
+
+
+class ResourceScheduler:
+    """
+    Admits file tasks against a memory and core budget, largest file first.
+
+    Each task is charged its estimated peak memory while it runs. Tasks are tried
+    largest first so the enormous files do not end up alone at the tail of the run;
+    when the next largest does not fit in the memory left, smaller tasks that fit are
+    started instead. A task larger than the whole budget runs alone.
+    """
+
+    def __init__(self, memory_budget: int | str, cpu_budget: Optional[int] = None,
+                 feature_groups: Sequence[str] = tuple(FEATURE_BYTES_PER_PIXEL),
+                 planes_in_flight: int = 1) -> None:
+        """
+        Initializes the ResourceScheduler.
+
+        Args:
+            memory_budget (int | str): Memory available to the workers, e.g. "32G".
+            cpu_budget (int, optional): Cores available. Defaults to all cores.
+            feature_groups (Sequence[str]): Feature groups computed for each plane.
+            planes_in_flight (int): Planes each worker processes at the same time.
+        """
+        self.memory_budget = parse_size(memory_budget)
+        self.cpu_budget = cpu_budget or os.cpu_count() or 1
+        self.feature_groups = list(feature_groups)
+        self.planes_in_flight = planes_in_flight
+
+    def task_bytes(self, estimate: FileEstimate) -> int:
+        """Returns the memory charged to the task of a file."""
+        return estimate.task_bytes(self.feature_groups, self.planes_in_flight)
+
+    def workers(self, estimates: Sequence[FileEstimate]) -> int:
+        """Returns the number of worker processes worth starting for these files."""
+        if not estimates:
+            return 1
+        smallest = min(self.task_bytes(e) for e in estimates)
+        fit = max(1, self.memory_budget // max(smallest, 1))
+        return int(min(self.cpu_budget, fit, len(estimates)))
+
+    def threads_per_worker(self, workers: int) -> int:
+        """Returns the native threads each worker may use without oversubscribing."""
+        return max(1, self.cpu_budget // max(workers, 1))
+
+    def run(self, executor: Executor, fn: Callable[[str], Any],
+            estimates: Sequence[FileEstimate], max_running: int) -> Iterator[Tuple[int, Any]]:
+        """
+        Submits one task per file to the executor as the budget allows.
+
+        Args:
+            executor (Executor): Executor running the tasks.
+            fn (Callable[[str], Any]): Task, called with the file path.
+            estimates (Sequence[FileEstimate]): One estimate per file.
+            max_running (int): Maximum number of tasks running at the same time.
+
+        Yields:
+            Tuple[int, Any]: The index of the file in ``estimates`` and the task result,
+            in completion order.
+        """
+        costs = [self.task_bytes(e) for e in estimates]
+        waiting: List[int] = sorted(range(len(estimates)), key=lambda i: (-costs[i], i))
+        running: Dict[Future, int] = {}
+        used = 0
+
+        while waiting or running:
+            admitted = True
+            while waiting and len(running) < max_running and admitted:
+                admitted = False
+                for pos, idx in enumerate(waiting):
+                    if used + costs[idx] <= self.memory_budget or not running:
+                        if costs[idx] > self.memory_budget:
+                            logger.warning(
+                                f"{estimates[idx].file_path} needs about {costs[idx] / 2**30:.1f} GiB, "
+                                f"more than the memory budget; running it alone."
+                            )
+                        waiting.pop(pos)
+                        running[executor.submit(fn, estimates[idx].file_path)] = idx
+                        used += costs[idx]
+                        admitted = True
+                        break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                idx = running.pop(future)
+                used -= costs[idx]
+                yield idx, future.result()
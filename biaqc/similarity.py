@@ -0,0 +1,181 @@
+from __future__ import annotations
+import json
+import numpy as np
+from ._lazy import lazy_import
+from .analysis import FeaturePCA
+import logging
+
+# Configure logging for the module
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Heavy dependencies, imported when first used
+pd = lazy_import("pandas")
+spatial = lazy_import("scipy.spatial")
+
+# Version of the similarity index file format, increased when it changes
+FORMAT_VERSION = 1
+
+# Columns identifying the planes of the index
+KEY_COLUMNS = ['file_path', 'C', 'Z', 'T']
+
+
+class SimilarityIndex:
+    """
+    Nearest-neighbour index over the standardized feature vectors of the planes,
+    answering "which other planes look like this one?".
+
+    The vectors are the feature matrix of FeaturePCA, so that every feature weighs
+    the same in the Euclidean distance. A KD-tree is built over them, which is fast
+    to build and gives exact neighbours. With a few tens of features it prunes
+    little unless the planes lie close to a low-dimensional subset, so a query may
+    cost nearly as much as a scan of all the vectors (tens of milliseconds per
+    million planes). The index is saved as the vectors and the plane keys in an
+    ``.npz`` file, the tree being rebuilt when first queried after loading.
+    """
+
+    def __init__(self, leaf_size: int = 32):
+        """
+        Initializes the SimilarityIndex.
+
+        Args:
+            leaf_size (int): Number of planes in the leaves of the KD-tree.
+        """
+        self.leaf_size = leaf_size
+        self.feature_columns: list[str] = []
+        self.vectors: np.ndarray | None = None
+        self.keys: pd.DataFrame | None = None
+        self._tree = None
+        self._positions: dict[tuple, int] | None = None
+
+    def fit(self, features: pd.DataFrame, feature_pca: FeaturePCA | None = None) -> "SimilarityIndex":
+        """
+        Indexes the planes of a feature table.
+
+        Args:
+            features (pd.DataFrame): Feature table, one row per plane, as written by
+                ND2ImageProcessor.
+            feature_pca (FeaturePCA, optional): A FeaturePCA set with the same table,
+                whose feature matrix is reused instead of being built again.
+
+        Returns:
+            SimilarityIndex: The fitted instance.
+        """
+        if feature_pca is None:
+            feature_pca = FeaturePCA()
+            feature_pca.set_data(features)
+        self.vectors = np.ascontiguousarray(feature_pca.feature_matrix(), dtype=np.float32)
+        self.feature_columns = feature_pca.feature_columns
+        key_columns = [col for col in KEY_COLUMNS if col in features.columns]
+        self.keys = features[key_columns].reset_index(drop=True)
+        self._tree = None
+        self._positions = None
+        return self
+
+    @property
+    def tree(self):
+        """The KD-tree over the vectors, built on first use."""
+        if self._tree is None:
+            if self.vectors is None:
+                raise ValueError("The index is not fitted.")
+            self._tree = spatial.cKDTree(self.vectors, leafsize=self.leaf_size,
+                                         balanced_tree=False, compact_nodes=False)
+        return self._tree
+
+    def __len__(self) -> int:
+        return 0 if self.vectors is None else len(self.vectors)
+
+    def position_of(self, file_path: str, c: int, z: int, t: int) -> int | None:
+        """
+        Returns the position of a plane in the index.
+
+        Args:
+            file_path (str): The file of the plane.
+            c (int): Its channel.
+            z (int): Its Z.
+            t (int): Its timepoint.
+
+        Returns:
+            int | None: The row of the plane in the indexed table, None when it is
+            not indexed, or when the indexed table has no key columns.
+        """
+        if self.keys is None or not set(KEY_COLUMNS).issubset(self.keys.columns):
+            return None
+        if self._positions is None:
+            self._positions = {
+                tuple(key): position
+                for position, key in enumerate(self.keys[KEY_COLUMNS].itertuples(index=False))
+            }
+        try:
+            key = (file_path, int(c), int(z), int(t))
+        except (TypeError, ValueError):
+            return None
+        return self._positions.get(key)
+
+    def neighbors(self, position: int, k: int = 10) -> pd.DataFrame:
+        """
+        Finds the planes most similar to an indexed plane.
+
+        Args:
+            position (int): The row of the plane in the indexed table.
+            k (int): Number of similar planes returned.
+
+        Returns:
+            pd.DataFrame: The ``k`` nearest planes, closest first and without the
+            plane itself, with their ``position`` in the indexed table, their
+            ``distance`` in standardized feature units and their key columns.
+        """
+        k = min(k, len(self) - 1)
+        if k < 1:
+            return self.keys.iloc[:0].assign(position=np.zeros(0, dtype=np.intp), distance=np.zeros(0))
+        distance, positions = self.tree.query(self.vectors[position], k=k + 1)
+        # the plane itself, or an identical one, comes first
+        keep = positions != position
+        positions, distance = positions[keep][:k], distance[keep][:k]
+        result = self.keys.iloc[positions].reset_index(drop=True)
+        result.insert(0, 'distance', distance.astype(np.float32))
+        result.insert(0, 'position', positions)
+        return result
+
+    def save(self, path: str) -> None:
+        """
+        Saves the index to a ``.npz`` file.
+
+        Args:
+            path (str): The output path, ending with .npz.
+        """
+        header = {
+            'format_version': FORMAT_VERSION,
+            'leaf_size': self.leaf_size,
+            'feature_columns': self.feature_columns,
+            'key_columns': list(self.keys.columns),
+        }
+        arrays = {'header': np.array(json.dumps(header)), 'vectors': self.vectors}
+        for col in self.keys.columns:
+            values = self.keys[col].to_numpy()
+            arrays[f'key.{col}'] = values.astype(str) if values.dtype == object else np.asarray(values)
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "SimilarityIndex":
+        """
+        Loads an index saved with ``save``.
+
+        Args:
+            path (str): Path of the .npz file.
+
+        Returns:
+            SimilarityIndex: The loaded index.
+        """
+        with np.load(path, allow_pickle=False) as arrays:
+            header = json.loads(str(arrays['header']))
+            if header['format_version'] > FORMAT_VERSION:
+                raise ValueError(
+                    f"{path} has similarity index format {header['format_version']}, "
+                    f"this version of biaqc reads up to {FORMAT_VERSION}."
+                )
+            index = cls(leaf_size=header['leaf_size'])
+            index.feature_columns = header['feature_columns']
+            index.vectors = arrays['vectors']
+            index.keys = pd.DataFrame({col: arrays[f'key.{col}'] for col in header['key_columns']})
+        return index
@@ -0,0 +1,271 @@
+from __future__ import annotations
+import numpy as np
+from ._lazy import lazy_import
+import logging
+
+# Configure logging for the module
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Heavy dependencies, imported when first used
+pd = lazy_import("pandas")
+
+# Columns identifying a time series of planes
+SERIES_COLUMNS = ['file_path', 'C', 'Z']
+
+# Scale turning the median absolute deviation into a standard deviation
+MAD_TO_STD = 1.4826
+
+
+def _grouped_sum(values: np.ndarray, codes: np.ndarray, n_groups: int) -> np.ndarray:
+    return np.bincount(codes, weights=values, minlength=n_groups)
+
+
+def _grouped_median(values: np.ndarray, codes: np.ndarray, starts: np.ndarray,
+                    counts: np.ndarray) -> np.ndarray:
+    """
+    Returns the median of the values of each group, NaN for groups without values.
+
+    The rows must be sorted by group, group i holding rows ``starts[i]`` to
+    ``starts[i] + counts[i]``.
+    """
+    n_groups, width = len(starts), int(counts.max(initial=0))
+    # one row per group, padded with NaN, which np.sort puts last
+    padded = np.full((n_groups, width), np.nan)
+    padded[codes, np.arange(len(values)) - starts[codes]] = values
+    padded.sort(axis=1)
+    n_valid = np.sum(~np.isnan(padded), axis=1)
+    rows = np.flatnonzero(n_valid)
+    low = padded[rows, (n_valid[rows] - 1) // 2]
+    high = padded[rows, n_valid[rows] // 2]
+    median = np.full(n_groups, np.nan)
+    median[rows] = (low + high) / 2
+    return median
+
+
+def _grouped_linear_fit(x: np.ndarray, y: np.ndarray, codes: np.ndarray,
+                        n_groups: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Fits y = intercept + slope * x by least squares in each group.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: The slope, intercept and
+        coefficient of determination of each group.
+    """
+    n = np.bincount(codes, minlength=n_groups).astype(np.float64)
+    sx, sy = _grouped_sum(x, codes, n_groups), _grouped_sum(y, codes, n_groups)
+    sxx, sxy = _grouped_sum(x * x, codes, n_groups), _grouped_sum(x * y, codes, n_groups)
+    syy = _grouped_sum(y * y, codes, n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        var_x = sxx - sx * sx / n
+        slope = (sxy - sx * sy / n) / var_x
+        intercept = (sy - slope * sx) / n
+        var_y = syy - sy * sy / n
+        r2 = (slope * (sxy - sx * sy / n)) / var_y
+    slope = np.where(var_x > 0, slope, 0.0)
+    intercept = np.where(var_x > 0, intercept, sy / np.maximum(n, 1))
+    r2 = np.where((var_x > 0) & (var_y > 0), r2, np.nan)
+    return slope, intercept, r2
+
+
+def _grouped_first(mask: np.ndarray, values: np.ndarray, codes: np.ndarray, n_groups: int) -> np.ndarray:
+    """Returns the smallest value of each group where the mask is set, NaN if none."""
+    first = np.full(n_groups, np.inf)
+    np.minimum.at(first, codes[mask], values[mask])
+    return np.where(np.isfinite(first), first, np.nan)
+
+
+class DriftAnalysis:
+    """
+    Detects photobleaching and focus drift in time-lapse data from the plane features.
+
+    Every (file, C, Z) series of planes is analysed over T, all the series at once:
+    the rows are sorted so each series is contiguous and every statistic is a
+    grouped NumPy reduction (bincount, lexsort medians, cumulative sums).
+
+    - Bleaching: an exponential decay ``I(T) = I0 * exp(-rate * T)`` is fitted to
+      the mean intensity by least squares on its logarithm.
+    - Focus drift: a linear trend is fitted to the sharpness relative to its
+      baseline, and the best single break point (step change) is located.
+    - Jumps: frame-to-frame changes of the relative sharpness or intensity that are
+      far from the typical change of the series (robust z-score).
+
+    The first bad timepoint of a series is the first T where the fitted bleaching
+    or the sharpness loss exceeds its tolerance, or where a jump occurs.
+    """
+
+    def __init__(self, intensity_column: str = 'mean_intensity', sharpness_column: str = 'laplacian',
+                 bleach_tolerance: float = 0.2, sharpness_tolerance: float = 0.2,
+                 jump_threshold: float = 5.0, baseline_frames: int = 3, min_timepoints: int = 3):
+        """
+        Initializes the DriftAnalysis.
+
+        Args:
+            intensity_column (str): Feature used for the bleaching fit.
+            sharpness_column (str): Feature used for the focus drift.
+            bleach_tolerance (float): Fraction of the initial intensity that may be lost.
+            sharpness_tolerance (float): Fraction of the baseline sharpness that may be lost.
+            jump_threshold (float): Robust z-score of a frame-to-frame change above
+                which it is a jump.
+            baseline_frames (int): Number of first timepoints whose median sharpness is
+                the baseline.
+            min_timepoints (int): Series with fewer timepoints are not analysed.
+        """
+        self.intensity_column = intensity_column
+        self.sharpness_column = sharpness_column
+        self.bleach_tolerance = bleach_tolerance
+        self.sharpness_tolerance = sharpness_tolerance
+        self.jump_threshold = jump_threshold
+        self.baseline_frames = baseline_frames
+        self.min_timepoints = min_timepoints
+
+    def _jumps(self, values: np.ndarray, codes: np.ndarray, starts: np.ndarray,
+               counts: np.ndarray) -> np.ndarray:
+        """
+        Flags the rows whose change from the previous timepoint of the series is a
+        jump. ``values`` are relative to the series level.
+        """
+        delta = np.full(len(values), np.nan)
+        delta[1:] = values[1:] - values[:-1]
+        delta[starts] = np.nan
+        median = _grouped_median(delta, codes, starts, counts)
+        deviation = np.abs(delta - median[codes])
+        # changes below 1% of the level are never jumps, even in a flat series
+        scale = np.maximum(MAD_TO_STD * _grouped_median(deviation, codes, starts, counts), 0.01)
+        with np.errstate(invalid='ignore'):
+            return deviation / scale[codes] > self.jump_threshold
+
+    def _break_points(self, values: np.ndarray, codes: np.ndarray, starts: np.ndarray,
+                      counts: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Locates the best single step change of each series: the split into a before
+        and an after segment of constant level with the least squared error.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The row starting the after segment of each
+            series, and the change of level (after - before).
+        """
+        n_series = len(starts)
+        cum = np.cumsum(values)
+        cum_sq = np.cumsum(values ** 2)
+        # sums up to and including each row, within its series
+        offset = np.where(starts > 0, cum[starts - 1], 0.0)
+        offset_sq = np.where(starts > 0, cum_sq[starts - 1], 0.0)
+        left = cum - offset[codes]
+        left_sq = cum_sq - offset_sq[codes]
+        total = left[starts + counts - 1]
+        total_sq = left_sq[starts + counts - 1]
+
+        n_left = np.arange(len(values)) - starts[codes] + 1
+        n_right = counts[codes] - n_left
+        right = total[codes] - left
+        right_sq = total_sq[codes] - left_sq
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cost = (left_sq - left ** 2 / n_left) + (right_sq - right ** 2 / n_right)
+        # the after segment must not be empty
+        cost[n_right == 0] = np.inf
+
+        best_cost = np.full(n_series, np.inf)
+        np.minimum.at(best_cost, codes, cost)
+        is_best = cost == best_cost[codes]
+        split = _grouped_first(is_best, np.arange(len(values), dtype=np.float64), codes, n_series)
+        split = np.nan_to_num(split, nan=0).astype(np.intp)
+
+        before = left[split] / n_left[split]
+        after = right[split] / np.maximum(n_right[split], 1)
+        return split + 1, after - before
+
+    def analyze(self, features: pd.DataFrame) -> pd.DataFrame:
+        """
+        Computes the drift and bleaching metrics of every time series of a feature table.
+
+        Args:
+            features (pd.DataFrame): Feature table, one row per plane, as written by
+                ND2ImageProcessor.
+
+        Returns:
+            pd.DataFrame: One row per (file_path, C, Z) series with at least
+            ``min_timepoints`` timepoints, holding:
+
+            - n_timepoints
+            - bleach_rate: fitted intensity decay per frame, and bleach_half_life in
+              frames, bleach_fraction (intensity lost over the series) and bleach_r2
+            - sharpness_slope: change of the relative sharpness per frame, and
+              sharpness_change over the series
+            - break_T and break_change: start and size of the largest sharpness step
+            - n_jumps and first_jump_T
+            - first_bad_T: first timepoint out of tolerance, NaN if none
+        """
+        df = features
+        # series of each plane, from the codes of the series columns
+        combined = np.zeros(len(df), dtype=np.int64)
+        for col in SERIES_COLUMNS:
+            col_codes, uniques = pd.factorize(df[col], use_na_sentinel=False)
+            combined = combined * len(uniques) + col_codes
+        _, first_rows, codes = np.unique(combined, return_index=True, return_inverse=True)
+        counts = np.bincount(codes, minlength=len(first_rows))
+        kept_series = np.flatnonzero(counts >= self.min_timepoints)
+        n_series = len(kept_series)
+        series_index = np.full(len(first_rows), -1)
+        series_index[kept_series] = np.arange(n_series)
+        keep = counts[codes] >= self.min_timepoints
+        codes = series_index[codes[keep]]
+        t_values = df['T'].to_numpy(dtype=np.float64)[keep]
+        intensity = df[self.intensity_column].to_numpy(dtype=np.float64)[keep]
+        sharpness = df[self.sharpness_column].to_numpy(dtype=np.float64)[keep]
+
+        # each series contiguous and in time order
+        order = np.lexsort((t_values, codes))
+        codes, t_values = codes[order], t_values[order]
+        intensity, sharpness = intensity[order], sharpness[order]
+        counts = np.bincount(codes, minlength=n_series)
+        starts = np.cumsum(counts) - counts
+        t0 = t_values[starts][codes]
+        elapsed = t_values - t0
+
+        # bleaching: log-linear fit of the intensity decay
+        log_intensity = np.log(np.maximum(intensity, np.finfo(np.float64).tiny))
+        slope, _, bleach_r2 = _grouped_linear_fit(elapsed, log_intensity, codes, n_series)
+        bleach_rate = -slope
+        duration = t_values[starts + counts - 1] - t_values[starts]
+        bleach_fraction = 1 - np.exp(-bleach_rate * duration)
+        with np.errstate(divide='ignore'):
+            half_life = np.where(bleach_rate > 0, np.log(2) / bleach_rate, np.inf)
+
+        # focus drift: sharpness relative to the median of the first frames
+        position = np.arange(len(codes)) - starts[codes]
+        in_baseline = position < self.baseline_frames
+        baseline = _grouped_median(np.where(in_baseline, sharpness, np.nan), codes, starts, counts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            relative_sharpness = sharpness / baseline[codes]
+        relative_sharpness = np.nan_to_num(relative_sharpness, nan=1.0, posinf=1.0, neginf=1.0)
+        sharpness_slope, _, _ = _grouped_linear_fit(elapsed, relative_sharpness, codes, n_series)
+        break_row, break_change = self._break_points(relative_sharpness, codes, starts, counts)
+
+        # abrupt jumps of the sharpness or of the intensity
+        with np.errstate(invalid='ignore', divide='ignore'):
+            relative_intensity = intensity / _grouped_median(intensity, codes, starts, counts)[codes]
+        jumps = self._jumps(relative_sharpness, codes, starts, counts) | \
+            self._jumps(np.nan_to_num(relative_intensity, nan=1.0), codes, starts, counts)
+
+        # first bad timepoint
+        fitted_loss = 1 - np.exp(-bleach_rate[codes] * elapsed)
+        bad = jumps | (fitted_loss > self.bleach_tolerance) | \
+            (relative_sharpness < 1 - self.sharpness_tolerance)
+
+        result = df[SERIES_COLUMNS].iloc[first_rows[kept_series]].reset_index(drop=True)
+        result['n_timepoints'] = counts
+        result['bleach_rate'] = bleach_rate
+        result['bleach_half_life'] = half_life
+        result['bleach_fraction'] = bleach_fraction
+        result['bleach_r2'] = bleach_r2
+        result['sharpness_slope'] = sharpness_slope
+        result['sharpness_change'] = sharpness_slope * duration
+        result['break_T'] = t_values[np.minimum(break_row, starts + counts - 1)]
+        result['break_change'] = break_change
+        result['n_jumps'] = np.bincount(codes[jumps], minlength=n_series)
+        result['first_jump_T'] = _grouped_first(jumps, t_values, codes, n_series)
+        result['first_bad_T'] = _grouped_first(bad, t_values, codes, n_series)
+        logger.info(f"{int(result['first_bad_T'].notna().sum())} of {n_series} time series "
+                    f"go out of tolerance.")
+        return result
@@ -0,0 +1,152 @@
+import itertools
+import os
+from multiprocessing import shared_memory
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import numpy as np
+import logging
+
+# Configure logging for the module
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Shared memory blocks attached by the current (worker) process, by block name,
+# and the pool they belong to
+_attached_blocks: Dict[str, shared_memory.SharedMemory] = {}
+_attached_pool: Optional[str] = None
+
+# Numbers the SharedPlanePools of this process
+_pool_ids = itertools.count()
+
+
+class PlaneDescriptor(NamedTuple):
+    """Describes a plane stored in a shared memory block of a SharedPlanePool."""
+    block_name: str
+    shape: Tuple[int, ...]
+    dtype: str
+    T: int
+    C: int
+    Z: int
+    # the pool holding the block, unique across processes
+    pool_id: str = ""
+
+
+class SharedPlanePool:
+    """
+    A reusable pool of shared memory blocks to hand planes to worker processes.
+
+    The producer copies each decoded plane into a free block with ``put`` and sends
+    only the returned PlaneDescriptor to the worker, which maps the same block with
+    ``attach_plane`` without copying or pickling the pixels. Once the worker is done
+    the producer calls ``release`` and the block is reused for a later plane.
+
+    Blocks are created on demand, at most ``max_blocks`` of them, and are sized to
+    the largest plane seen so far.
+    """
+
+    def __init__(self, max_blocks: int) -> None:
+        """
+        Initializes the SharedPlanePool.
+
+        Args:
+            max_blocks (int): Maximum number of blocks, i.e. of planes in flight.
+        """
+        if max_blocks < 1:
+            raise ValueError("The pool needs at least one block.")
+        self.max_blocks = max_blocks
+        self.pool_id = f"{os.getpid()}-{next(_pool_ids)}"
+        self._blocks: Dict[str, shared_memory.SharedMemory] = {}
+        self._free: List[str] = []
+
+    def put(self, plane: np.ndarray, t: int, c: int, z: int) -> PlaneDescriptor:
+        """
+        Copies a plane into a free block.
+
+        Args:
+            plane (np.ndarray): The plane to share.
+            t (int): T index of the plane.
+            c (int): C index of the plane.
+            z (int): Z index of the plane.
+
+        Returns:
+            PlaneDescriptor: Descriptor to pass to the worker process.
+        """
+        block = self._acquire(plane.nbytes)
+        view = np.ndarray(plane.shape, dtype=plane.dtype, buffer=block.buf)
+        view[...] = plane
+        return PlaneDescriptor(block.name, plane.shape, plane.dtype.str, t, c, z, self.pool_id)
+
+    def release(self, descriptor: PlaneDescriptor) -> None:
+        """Returns the block of a plane the worker is done with to the pool."""
+        self._free.append(descriptor.block_name)
+
+    def _acquire(self, nbytes: int) -> shared_memory.SharedMemory:
+        """Returns a free block of at least ``nbytes`` bytes."""
+        while self._free:
+            block = self._blocks[self._free.pop()]
+            if block.size >= nbytes:
+                return block
+            # too small for this plane: replace it with a larger block, in a new
+            # pool generation so that the workers unmap the old blocks
+            self._unlink(block)
+            self.pool_id = f"{os.getpid()}-{next(_pool_ids)}"
+
+        if len(self._blocks) >= self.max_blocks:
+            raise RuntimeError("All shared memory blocks are in use.")
+        block = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+        self._blocks[block.name] = block
+        return block
+
+    def _unlink(self, block: shared_memory.SharedMemory) -> None:
+        del self._blocks[block.name]
+        block.close()
+        block.unlink()
+
+    def close(self) -> None:
+        """Frees all the blocks of the pool."""
+        for block in list(self._blocks.values()):
+            self._unlink(block)
+        self._free.clear()
+
+    def __enter__(self) -> "SharedPlanePool":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def attach_plane(descriptor: PlaneDescriptor) -> np.ndarray:
+    """
+    Returns a read-only array viewing the plane in shared memory, without copying.
+
+    Blocks are attached once per process and kept mapped, since the pool reuses the
+    same blocks for the following planes. The first plane of another pool unmaps
+    the blocks of the previous one, which its producer has unlinked or will.
+
+    Args:
+        descriptor (PlaneDescriptor): Descriptor returned by SharedPlanePool.put.
+
+    Returns:
+        np.ndarray: The plane.
+    """
+    global _attached_pool
+    if descriptor.pool_id != _attached_pool:
+        detach_all()
+        _attached_pool = descriptor.pool_id
+    block = _attached_blocks.get(descriptor.block_name)
+    if block is None:
+        block = shared_memory.SharedMemory(name=descriptor.block_name)
+        _attached_blocks[descriptor.block_name] = block
+    plane = np.ndarray(descriptor.shape, dtype=np.dtype(descriptor.dtype), buffer=block.buf)
+    plane.flags.writeable = False
+    return plane
+
+
+def detach_all() -> None:
+    """Unmaps all the blocks attached by the current process."""
+    for block in _attached_blocks.values():
+        try:
+            block.close()
+        except BufferError:
+            # a plane of the block is still referenced, it is unmapped once freed
+            logger.debug(f"Shared memory block {block.name} still in use.")
+    _attached_blocks.clear()
@@ -1,24 +1,52 @@
 import os
 import csv
-from collections import Counter
+import copy
+import multiprocessing as mp
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import numpy as np
-import tifffile
 from datetime import datetime
-from bioio import BioImage
-import bioio_nd2
-from ome_types import to_dict
-import pandas as pd
-from tqdm import tqdm
-from .feature_extraction import IntensityFeatures, Noise, Sharpness, TextureFeatures
+from ._lazy import lazy_import
+from .feature_extraction import IntensityFeatures, Noise, PerceptualHash, Sharpness, TextureFeatures
+from .file_operations import PlanePrefetcher, write_table
+from .histograms import HistogramAggregator
+from .illumination import PixelAccumulator
+from .scheduler import ResourceScheduler, estimate_file
+from .transport import PlaneDescriptor, SharedPlanePool, attach_plane
 
 
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
 import logging
 
+# Heavy dependencies, imported when first used
+bioio = lazy_import("bioio")
+bioio_nd2 = lazy_import("bioio_nd2")
+cv = lazy_import("cv2")
+ome_types = lazy_import("ome_types")
+pd = lazy_import("pandas")
+threadpoolctl = lazy_import("threadpoolctl")
+tifffile = lazy_import("tifffile")
+tqdm = lazy_import("tqdm")
+
 # Configure logging for the module
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Environment variables read by the native thread pools (BLAS, OpenMP, numexpr)
+NATIVE_THREAD_ENV_VARS = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+)
+
+# Feature groups computed by ND2ImageProcessor.extract_features_from_slice
+FEATURE_GROUPS = ('intensity', 'noise', 'sharpness', 'texture', 'hash')
+
+# Per-process processor used by the workers of ND2ImageProcessor.process_folder
+_worker_processor = None
+
 def get_file_types(path):
     file_names = os.listdir(path)
     extensions = [f.split('.')[-1] for f in file_names]
@@ -102,14 +130,63 @@ def write_image_info_to_csv(image_info, folder_path, csv_filename):
 
 
 class ND2ImageProcessor:
-    def __init__(self) -> None:
+    def __init__(self, plane_workers: int = 1, max_planes_in_flight: Optional[int] = None,
+                 prefetch_depth: int = 0, plane_executor: str = "thread",
+                 features: Sequence[str] = FEATURE_GROUPS, focus_search: bool = False,
+                 focus_neighbours: int = 1, focus_coarse_points: int = 8,
+                 keep_histograms: bool = True, pixel_statistics: bool = False,
+                 pixel_bin: int = 1) -> None:
         """
         Initializes the Metadata instance with default values.
+
+        Args:
+            plane_workers (int): Number of threads computing plane features within
+                one file. 1 computes the planes serially.
+            max_planes_in_flight (int, optional): Maximum number of decoded planes held
+                by the thread pool at any time. Defaults to twice ``plane_workers``.
+            prefetch_depth (int): Number of planes decoded ahead by a reader thread
+                while features are computed. 0 reads the planes on demand.
+            plane_executor (str): "thread" computes the plane features in a thread pool,
+                "process" in a process pool fed through shared memory.
+            features (Sequence[str]): Feature groups to extract, among "intensity",
+                "noise", "sharpness", "texture" and "hash".
+            focus_search (bool): Only compute the features of the best-focus plane of
+                each Z stack and of its neighbours, found by a coarse-to-fine search
+                (see ``find_focus``).
+            focus_neighbours (int): Number of planes on each side of the best-focus
+                plane whose features are computed in focus search mode.
+            focus_coarse_points (int): Number of planes of the coarse focus search.
+            keep_histograms (bool): Whether to keep the per-plane histograms in the
+                feature table. They are always added to ``histograms`` first.
+            pixel_statistics (bool): Whether to accumulate the per-pixel statistics of
+                each channel of the files processed by ``process_files`` in ``pixels``
+                (illumination profile, hot and dead pixels). In focus search mode,
+                only the planes decoded by the search are accumulated.
+            pixel_bin (int): Binning of the per-pixel mean and variance images.
         """
+        unknown = set(features) - set(FEATURE_GROUPS)
+        if unknown:
+            raise ValueError(f"Unknown feature groups {sorted(unknown)}, expected {FEATURE_GROUPS}.")
         self.file_path: Optional[str] = None
         self.image_extension: Optional[str] = None
         self.image_name: Optional[str] = None
         self.df: pd.DataFrame = None
+        self.plane_workers = plane_workers
+        self.max_planes_in_flight = max_planes_in_flight
+        self.prefetch_depth = prefetch_depth
+        self.plane_executor = plane_executor
+        self.features = list(features)
+        self.focus_search = focus_search
+        self.focus_neighbours = focus_neighbours
+        self.focus_coarse_points = focus_coarse_points
+        self.keep_histograms = keep_histograms
+        # per file and channel histograms of the files processed by process_files
+        self.histograms = HistogramAggregator()
+        self.pixel_statistics = pixel_statistics
+        self.pixel_bin = pixel_bin
+        # per channel pixel statistics of the files processed by process_files
+        self.pixels: Optional[PixelAccumulator] = None
+        self.pipeline_stats: Dict[str, float] = {}
 
     def set_image_path(self, file_path: str) -> None:
         """
@@ -126,12 +203,12 @@ class ND2ImageProcessor:
 
     def read_nd2(self):
         """Reads an ND2 file and returns a BioImage object."""
-        image = BioImage(self.file_path, reader=bioio_nd2.Reader)
+        image = bioio.BioImage(self.file_path, reader=bioio_nd2.Reader)
         return image
     
     def _get_bit_depth(self, image):
         """Reads the bit-depth from image."""
-        image_metadata_dict = to_dict(image.metadata)
+        image_metadata_dict = ome_types.to_dict(image.metadata)
         return image_metadata_dict.get("images", [])[0].get("pixels", []).get("significant_bits", [])
 
 
@@ -148,23 +225,32 @@ class ND2ImageProcessor:
 
     def extract_XY_slices(self, image):
         """Extracts XY slices from the ND2 image across all Z, C, and T."""
-        dims_order = image.dims.order
-        dim_map = {dim: i for i, dim in enumerate(dims_order)}
+        return list(self.iter_XY_slices(image))
+
+    def iter_XY_slices(self, image):
+        """Yields the XY slices of the ND2 image one at a time, in T, C, Z order.
+
+        Each plane is decoded only when it is requested, so the memory used is
+        bounded by the planes the caller holds on to rather than by the file size.
+        """
         Z_size = image.dims.Z
         C_size = image.dims.C
         T_size = image.dims.T
 
-        slices = []
         for t in range(T_size):
             for c in range(C_size):
                 for z in range(Z_size):
-                    indices = [slice(None)] * len(image.shape)
-                    indices[dim_map['T']] = t
-                    indices[dim_map['C']] = c
-                    indices[dim_map['Z']] = z
-                    XY_image = image.data[tuple(indices)]
-                    slices.append((t, c, z, XY_image))  # Append the XY slice with its T, C, Z coordinates
-        return slices
+                    XY_image = self._read_plane(image, t, c, z)
+                    yield t, c, z, XY_image  # The XY slice with its T, C, Z coordinates
+
+    def _read_plane(self, image, t, c, z):
+        """Decodes the XY plane at the given T, C and Z."""
+        dim_map = {dim: i for i, dim in enumerate(image.dims.order)}
+        indices = [slice(None)] * len(image.shape)
+        indices[dim_map['T']] = t
+        indices[dim_map['C']] = c
+        indices[dim_map['Z']] = z
+        return np.asarray(image.dask_data[tuple(indices)].compute())
     
     def _initialize_features_dict(self):
         features_dict = {
@@ -189,39 +275,91 @@ class ND2ImageProcessor:
 
     def extract_features_from_slice(self, XY_image, bit_depth):
         """Extract features from the given XY slice. You can modify this method based on your feature extraction logic."""
-        intensity = IntensityFeatures(bit_depth=bit_depth)
-        intensity.set_image(image=XY_image)
-        intensity_features = intensity.extract_all_features()
-        # all_features.update(intensity_features)
+        intensity_features, noise_features, sharp_features, tex_features, hash_features = {}, {}, {}, {}, {}
 
-        noise = Noise()
-        noise.set_image(image=XY_image)
-        noise_features = noise.extract_all_features()
-        # all_features.update(noise_features)
+        if 'intensity' in self.features:
+            intensity = IntensityFeatures(bit_depth=bit_depth)
+            intensity.set_image(image=XY_image)
+            intensity_features = intensity.extract_all_features()
 
-        sharp = Sharpness()
-        sharp.set_image(image=XY_image)
-        sharp_features = sharp.extract_all_features()
-        # all_features.update(sharp_features)
+        if 'noise' in self.features:
+            noise = Noise()
+            noise.set_image(image=XY_image)
+            noise_features = noise.extract_all_features()
 
-        tex = TextureFeatures()
-        tex.set_image(image=XY_image)
-        tex_features = tex.extract_all_features()
-        # all_features.update(tex_features)
+        if 'sharpness' in self.features:
+            sharp = Sharpness()
+            sharp.set_image(image=XY_image)
+            sharp_features = sharp.extract_all_features()
 
-        all_features = {**sharp_features, **noise_features, **intensity_features, **tex_features}
+        if 'texture' in self.features:
+            tex = TextureFeatures()
+            tex.set_image(image=XY_image)
+            tex_features = tex.extract_all_features()
+
+        if 'hash' in self.features:
+            perceptual_hash = PerceptualHash()
+            perceptual_hash.set_image(image=XY_image)
+            hash_features = perceptual_hash.extract_all_features()
+
+        all_features = {**sharp_features, **noise_features, **intensity_features, **tex_features, **hash_features}
 
         return all_features
 
-    def process_image(self):
-        """Processes the ND2 image and returns a list of feature dictionaries for each XY slice."""
+    def process_image(self, plane_workers: Optional[int] = None,
+                      max_planes_in_flight: Optional[int] = None,
+                      prefetch_depth: Optional[int] = None,
+                      histograms: Optional[HistogramAggregator] = None):
+        """Processes the ND2 image and returns a list of feature dictionaries for each XY slice.
+
+        In focus search mode, only the planes around the best focus of each Z stack are
+        returned, with their ``focus_score`` and the ``best_Z`` and ``focus_curve`` of
+        the stack, and the planes are processed serially.
+
+        Args:
+            plane_workers (int, optional): Number of threads computing plane features.
+                Defaults to the value given at initialization.
+            max_planes_in_flight (int, optional): Maximum number of planes decoded but
+                not yet processed. Defaults to the value given at initialization.
+            prefetch_depth (int, optional): Number of planes decoded ahead in a reader
+                thread. Defaults to the value given at initialization.
+            histograms (HistogramAggregator, optional): Receives the histogram of each
+                plane as soon as it is computed, which is then dropped from the row
+                unless ``keep_histograms``.
+        """
+        plane_workers = plane_workers or self.plane_workers
+        max_planes_in_flight = max_planes_in_flight or self.max_planes_in_flight
+        if prefetch_depth is None:
+            prefetch_depth = self.prefetch_depth
+
         results = []
+        self.pipeline_stats = {}
         image = self.read_nd2()
         bit_depth = self._get_bit_depth(image)
-        slices = self.extract_XY_slices(image)
+        if self.focus_search:
+            return self._process_image_focus(image, bit_depth, histograms)
+        slices = self.iter_XY_slices(image)
+        if self.pixels is not None:
+            slices = self._accumulate_pixels(slices, bit_depth)
+        if prefetch_depth > 0:
+            slices = PlanePrefetcher(slices, depth=prefetch_depth)
+
+        if plane_workers > 1 and self.plane_executor == "process":
+            slice_features = self._extract_features_shared(
+                slices, bit_depth, plane_workers, max_planes_in_flight or 2 * plane_workers
+            )
+        elif plane_workers > 1:
+            slice_features = self._extract_features_threaded(
+                slices, bit_depth, plane_workers, max_planes_in_flight or 2 * plane_workers
+            )
+        else:
+            slice_features = (
+                (t, c, z, self.extract_features_from_slice(XY_image, bit_depth))
+                for t, c, z, XY_image in slices
+            )
 
         # Extract features for each XY slice and add to results list
-        for t, c, z, XY_image in slices:
+        for t, c, z, plane_features in slice_features:
             features = self._initialize_features_dict()
             row = {
                 'T': t,
@@ -229,30 +367,428 @@ class ND2ImageProcessor:
                 'Z': z,
             }
             features.update(row)
-            features.update(self.extract_features_from_slice(XY_image, bit_depth))
+            features.update(plane_features)
+            self._add_histogram(features, histograms)
             
             results.append(features)
+
+        if isinstance(slices, PlanePrefetcher):
+            self.pipeline_stats = dict(slices.stats)
+            slices.log_stats(self.image_name)
         
         return results
+
+    def find_focus(self, read_plane: Callable[[int], np.ndarray], n_planes: int,
+                   planes: Optional[Dict[int, np.ndarray]] = None):
+        """Finds the sharpest plane of a Z stack while decoding only a few planes.
+
+        A cheap focus measure (``Sharpness.focus_measure``) is computed on a coarse
+        subset of about ``focus_coarse_points`` evenly spaced planes. The search then
+        repeatedly halves the step around the sharpest plane found so far, and ends
+        with a hill climb until both neighbours of the best plane are measured. The
+        best Z is refined below the plane spacing by fitting a parabola through the
+        best plane and its neighbours.
+
+        Args:
+            read_plane (Callable[[int], np.ndarray]): Decodes the plane at a given Z.
+            n_planes (int): Number of planes of the stack.
+            planes (Dict[int, np.ndarray], optional): Receives the decoded planes by Z,
+                so that they can be reused.
+
+        Returns:
+            Tuple[int, float, np.ndarray]: The best plane, the interpolated best Z and
+            the focus curve, with the focus measure of each Z and NaN for the planes
+            that were not decoded.
+        """
+        curve = np.full(n_planes, np.nan)
+        sharpness = Sharpness()
+
+        def measure(z):
+            if 0 <= z < n_planes and np.isnan(curve[z]):
+                plane = read_plane(z)
+                if planes is not None:
+                    planes[z] = plane
+                sharpness.set_image(plane)
+                curve[z] = sharpness.focus_measure()
+
+        step = max(1, -(-(n_planes - 1) // max(self.focus_coarse_points - 1, 1)))
+        for z in range(0, n_planes, step):
+            measure(z)
+        measure(n_planes - 1)
+
+        while step > 1:
+            step = (step + 1) // 2
+            best = int(np.nanargmax(curve))
+            measure(best - step)
+            measure(best + step)
+
+        # climb until the best plane is a local maximum of the measured planes
+        while True:
+            best = int(np.nanargmax(curve))
+            unmeasured = [z for z in (best - 1, best + 1) if 0 <= z < n_planes and np.isnan(curve[z])]
+            if not unmeasured:
+                break
+            for z in unmeasured:
+                measure(z)
+
+        best_z = float(best)
+        if 0 < best < n_planes - 1:
+            before, peak, after = curve[best - 1:best + 2]
+            curvature = before - 2 * peak + after
+            if curvature < 0:
+                best_z += 0.5 * (before - after) / curvature
+        return best, best_z, curve
+
+    def _add_histogram(self, features: Dict[str, Any], histograms: Optional[HistogramAggregator]) -> None:
+        """Adds the histogram of a plane's row to ``histograms``, dropping it unless kept."""
+        if histograms is None or features.get('histogram') is None:
+            return
+        histograms.add(features['file_path'], features['C'], features['histogram'])
+        if not self.keep_histograms:
+            del features['histogram']
+
+    def _accumulate_pixels(self, slices, bit_depth):
+        """Adds the planes to ``pixels`` as they go through the pipeline."""
+        for t, c, z, XY_image in slices:
+            self.pixels.add(c, XY_image, bit_depth)
+            yield t, c, z, XY_image
+
+    def _process_image_focus(self, image, bit_depth, histograms=None):
+        """Computes the features of the best-focus planes of each T and C, see ``find_focus``."""
+        results = []
+        n_planes = image.dims.Z
+        n_decoded = 0
+        for t in range(image.dims.T):
+            for c in range(image.dims.C):
+                planes: Dict[int, np.ndarray] = {}
+                best, best_z, curve = self.find_focus(
+                    lambda z: self._read_plane(image, t, c, z), n_planes, planes
+                )
+                for z in range(max(0, best - self.focus_neighbours),
+                               min(n_planes, best + self.focus_neighbours + 1)):
+                    if z not in planes:
+                        planes[z] = self._read_plane(image, t, c, z)
+                        sharpness = Sharpness()
+                        sharpness.set_image(planes[z])
+                        curve[z] = sharpness.focus_measure()
+                    features = self._initialize_features_dict()
+                    features.update({'T': t, 'C': c, 'Z': z})
+                    features.update(self.extract_features_from_slice(planes[z], bit_depth))
+                    features.update({'focus_score': curve[z], 'best_Z': best_z, 'focus_curve': curve})
+                    self._add_histogram(features, histograms)
+                    results.append(features)
+                n_decoded += len(planes)
+                if self.pixels is not None:
+                    for z in sorted(planes):
+                        self.pixels.add(c, planes[z], bit_depth)
+
+        n_total = image.dims.T * image.dims.C * n_planes
+        self.pipeline_stats = {'planes_decoded': n_decoded, 'planes_total': n_total}
+        logger.info(f"Focus search {self.image_name}: decoded {n_decoded} of {n_total} planes.")
+        return results
+
+    def _extract_features_threaded(self, slices, bit_depth, plane_workers: int, max_in_flight: int):
+        """Extracts the plane features in a thread pool, yielding them in input order.
+
+        OpenCV, NumPy and the SciPy FFT release the GIL for most of the work, so the
+        threads run concurrently. At most ``max_in_flight`` planes are submitted
+        but not yet yielded, which bounds the memory held by the pool.
+        """
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=plane_workers) as executor:
+            for t, c, z, XY_image in slices:
+                if len(pending) >= max_in_flight:
+                    yield pending.popleft().result()
+                pending.append(executor.submit(self._extract_slice_task, t, c, z, XY_image, bit_depth))
+            while pending:
+                yield pending.popleft().result()
+
+    def _extract_slice_task(self, t, c, z, XY_image, bit_depth):
+        return t, c, z, self.extract_features_from_slice(XY_image, bit_depth)
+
+    def _extract_features_shared(self, slices, bit_depth, plane_workers: int, max_in_flight: int):
+        """Extracts the plane features in a process pool, yielding them in input order.
+
+        Planes are copied into blocks of a SharedPlanePool and only their descriptors
+        are sent to the workers, so the pixels are never pickled. Each block holds one
+        plane in flight and is recycled once its worker has returned the features.
+        """
+        pending = deque()
+        with SharedPlanePool(max_blocks=max_in_flight) as pool, \
+                self._worker_pool(plane_workers, 1) as executor:
+            for t, c, z, XY_image in slices:
+                if len(pending) >= max_in_flight:
+                    yield self._collect_shared_task(pool, *pending.popleft())
+                descriptor = pool.put(XY_image, t, c, z)
+                pending.append((descriptor, executor.submit(_extract_shared_plane, descriptor, bit_depth)))
+            while pending:
+                yield self._collect_shared_task(pool, *pending.popleft())
+
+    def _collect_shared_task(self, pool, descriptor, future):
+        try:
+            return descriptor.T, descriptor.C, descriptor.Z, future.result()
+        finally:
+            pool.release(descriptor)
     
-    def process_folder(self, folder_path: str, output_csv: str):
+    def list_files(self, folder_path: str) -> List[str]:
+        """Returns the sorted paths of all ND2 files in the folder.
+
+        Sorting makes the row order of the results independent of the file system
+        and of the number of workers.
+
+        Args:
+            folder_path (str): Path to the folder containing ND2 files.
+
+        Returns:
+            List[str]: Sorted list of ND2 file paths.
+        """
+        file_names = sorted(f for f in os.listdir(folder_path) if f.endswith('.nd2'))
+        return [os.path.join(folder_path, f) for f in file_names]
+
+    def process_file(self, file_path: str,
+                     histograms: Optional[HistogramAggregator] = None) -> List[Dict[str, Any]]:
+        """Processes a single ND2 file and returns its feature rows.
+
+        Args:
+            file_path (str): Path to the ND2 file.
+            histograms (HistogramAggregator, optional): Receives the histogram of each
+                plane, see ``process_image``.
+
+        Returns:
+            List[Dict[str, Any]]: One feature dictionary per XY slice.
+        """
+        self.set_image_path(file_path)
+        return self.process_image(histograms=histograms)
+
+    def process_folder(self, folder_path: str, output_csv: str, workers: int = 1,
+                       threads_per_worker: int = 1, memory_budget: Optional[int | str] = None):
         """Processes all ND2 files in the specified folder and saves the extracted features to a CSV file.
         
         Args:
             folder_path (str): Path to the folder containing ND2 files.
             output_csv (str): Path to the CSV file where results will be saved.
+            workers (int): Number of worker processes. 1 processes the files serially
+                in this process, 0 or None uses one worker per CPU core.
+            threads_per_worker (int): Number of native (BLAS/OpenMP/OpenCV) threads
+                each worker process may use.
+            memory_budget (int | str, optional): Memory available to the workers, e.g.
+                "32G". When given, files are scheduled against this budget.
         """
-        # Collect all results from all files
-        all_results = []
+        self.process_files(self.list_files(folder_path), output_csv, workers, threads_per_worker,
+                           memory_budget)
+
+    def process_files(self, file_paths: List[str], output_csv: str, workers: int = 1,
+                      threads_per_worker: int = 1, memory_budget: Optional[int | str] = None):
+        """Processes the given ND2 files and saves the extracted features to a CSV file.
+
+        Args:
+            file_paths (List[str]): Paths of the ND2 files, in output order.
+            output_csv (str): Path to the CSV file where results will be saved.
+            workers (int): Number of worker processes. 1 processes the files serially
+                in this process, 0 or None uses one worker per CPU core.
+            threads_per_worker (int): Number of native (BLAS/OpenMP/OpenCV) threads
+                each worker process may use.
+            memory_budget (int | str, optional): Memory available to the workers, e.g.
+                "32G". When given, the files are admitted against this budget and
+                ``workers`` cores by a ResourceScheduler, which also sets the number of
+                workers and of native threads per worker.
+        """
+        if not workers:
+            workers = os.cpu_count() or 1
+        workers = min(workers, len(file_paths))
 
-        # Iterate through all files in the folder
-        for file_name in tqdm(os.listdir(folder_path), desc='processing file'):
-            if file_name.endswith('.nd2'):  # Process only ND2 files
-                self.set_image_path(os.path.join(folder_path, file_name))
-                image_results = self.process_image()
-                all_results.extend(image_results)
+        # Collect all results from all files
+        if memory_budget is not None and file_paths:
+            self._reset_accumulators()
+            per_file_results = self._process_files_scheduled(file_paths, workers, memory_budget)
+        else:
+            per_file_results: List[Optional[List[Dict[str, Any]]]] = [None] * len(file_paths)
+            files = self.iter_files(file_paths, workers, threads_per_worker)
+            for idx, image_results in tqdm.tqdm(files, total=len(file_paths), desc='processing file'):
+                per_file_results[idx] = image_results
+        all_results = [row for image_results in per_file_results for row in image_results]
 
         # Save results to CSV
-        # Convert metadata list to a pandas DataFrame and save to CSV
+        # Convert metadata list to a pandas DataFrame and save to CSV (or Parquet)
         self.df = pd.DataFrame(all_results)
-        self.df.to_csv(output_csv, index=False)
\ No newline at end of file
+        write_table(self.df, output_csv)
+
+    def iter_files(self, file_paths: List[str], workers: int = 1, threads_per_worker: int = 1,
+                   skip_errors: bool = False) -> Iterator[tuple[int, Optional[List[Dict[str, Any]]]]]:
+        """Processes the given ND2 files and yields the rows of each file as soon as it is done.
+
+        The histograms and pixel statistics are reset when the iteration starts and
+        hold those of the files yielded so far. Closing the iterator early (e.g. to
+        cancel a run) cancels the files not started yet and waits for the files in
+        progress in the worker processes.
+
+        Args:
+            file_paths (List[str]): Paths of the ND2 files.
+            workers (int): Number of worker processes. 1 processes the files serially
+                in this process.
+            threads_per_worker (int): Number of native threads each worker may use.
+            skip_errors (bool): Log the error of a file that fails and go on with the
+                other files, instead of raising it.
+
+        Yields:
+            tuple[int, List[Dict[str, Any]] | None]: The index of the file in
+            ``file_paths`` and its feature rows, in completion order. The rows are None
+            for a file that failed with ``skip_errors``; its histograms and pixel
+            statistics are left out.
+        """
+        self._reset_accumulators()
+        if workers <= 1:
+            for idx, file_path in enumerate(file_paths):
+                if not skip_errors:
+                    yield idx, self.process_file(file_path, self.histograms)
+                    continue
+                try:
+                    result = self._process_file_apart(file_path)
+                except Exception:
+                    logger.exception(f"Could not process {file_path}, skipping it.")
+                    yield idx, None
+                    continue
+                yield idx, self._collect(*result)
+            return
+
+        executor = self._worker_pool(workers, threads_per_worker)
+        try:
+            futures = {
+                executor.submit(_process_file_in_worker, file_path): idx
+                for idx, file_path in enumerate(file_paths)
+            }
+            for future in as_completed(futures):
+                idx = futures[future]
+                try:
+                    result = future.result()
+                except Exception:
+                    if not skip_errors:
+                        raise
+                    logger.exception(f"Could not process {file_paths[idx]}, skipping it.")
+                    yield idx, None
+                    continue
+                yield idx, self._collect(*result)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _process_file_apart(self, file_path: str) -> tuple[List[Dict[str, Any]], HistogramAggregator,
+                                                           Optional[PixelAccumulator]]:
+        """Processes a file in this process into its own histograms and pixel statistics,
+        as a worker process does, so a file that fails leaves those of the run untouched."""
+        run_pixels = self.pixels
+        if run_pixels is not None:
+            self.pixels = PixelAccumulator(self.pixel_bin)
+        try:
+            histograms = HistogramAggregator()
+            rows = self.process_file(file_path, histograms)
+            return rows, histograms, self.pixels
+        finally:
+            self.pixels = run_pixels
+
+    def _reset_accumulators(self) -> None:
+        """Empties the histograms and pixel statistics before processing files."""
+        self.histograms = HistogramAggregator()
+        self.pixels = PixelAccumulator(self.pixel_bin) if self.pixel_statistics else None
+
+    def _collect(self, image_results: List[Dict[str, Any]], histograms: HistogramAggregator,
+                 pixels: Optional[PixelAccumulator] = None) -> List[Dict[str, Any]]:
+        """Adds the histograms and pixel statistics of a file processed in a worker
+        process to ``histograms`` and ``pixels``, and returns its rows."""
+        self.histograms.merge(histograms)
+        if pixels is not None:
+            self.pixels.merge(pixels)
+        return image_results
+
+    def _process_files_scheduled(self, file_paths: List[str], cpu_budget: int,
+                                 memory_budget: int | str) -> List[List[Dict[str, Any]]]:
+        """Runs the files through a ResourceScheduler and returns the results in input order."""
+        estimates = [estimate_file(file_path) for file_path in file_paths]
+        scheduler = ResourceScheduler(memory_budget, cpu_budget, feature_groups=self.features,
+                                      planes_in_flight=self._planes_in_flight())
+        workers = scheduler.workers(estimates)
+        threads_per_worker = scheduler.threads_per_worker(workers)
+        logger.info(f"Scheduling {len(file_paths)} files on {workers} workers "
+                    f"with {threads_per_worker} threads each.")
+
+        results: List[Optional[List[Dict[str, Any]]]] = [None] * len(file_paths)
+        with self._worker_pool(workers, threads_per_worker) as executor:
+            scheduled = scheduler.run(executor, _process_file_in_worker, estimates, workers)
+            for idx, image_results in tqdm.tqdm(scheduled, total=len(file_paths), desc='processing file'):
+                results[idx] = self._collect(*image_results)
+        return results
+
+    def _planes_in_flight(self) -> int:
+        """Returns the number of planes one file holds in memory at the same time."""
+        in_flight = 1
+        if self.plane_workers > 1:
+            in_flight = self.max_planes_in_flight or 2 * self.plane_workers
+        return in_flight + self.prefetch_depth
+
+    def _worker_pool(self, workers: int, threads_per_worker: int) -> ProcessPoolExecutor:
+        """Returns a process pool whose workers hold a copy of this processor."""
+        # the workers only need the configuration, not the results of earlier runs
+        template = copy.copy(self)
+        template.df = None
+        template.histograms = HistogramAggregator()
+        template.pixels = None
+        # spawn rather than fork: the GUI and the reader libraries run threads
+        context = mp.get_context("spawn")
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(template, threads_per_worker),
+        )
+
+
+def limit_native_threads(n_threads: int = 1) -> None:
+    """Caps the number of threads used by BLAS, OpenMP and OpenCV in this process.
+
+    The BLAS and OpenMP pools of numpy, scipy and scikit-learn are already started
+    once they are imported, so they are resized with threadpoolctl. The environment
+    variables only apply to the libraries loaded afterwards.
+
+    Args:
+        n_threads (int): Maximum number of native threads.
+    """
+    for var in NATIVE_THREAD_ENV_VARS:
+        os.environ[var] = str(n_threads)
+    threadpoolctl.threadpool_limits(limits=n_threads)
+    cv.setNumThreads(n_threads)
+
+
+def _init_worker(processor: "ND2ImageProcessor", n_threads: int) -> None:
+    """Initializes a worker process of ND2ImageProcessor.process_folder.
+
+    Caps the native thread pools and runs the feature extractors once on a small
+    dummy plane so that the lazily loaded skimage/scipy/cv2 code paths are imported
+    once per worker rather than on the first task.
+    """
+    global _worker_processor
+    limit_native_threads(n_threads)
+    _worker_processor = processor
+    bioio_nd2.Reader  # imports the reader
+    _worker_processor.extract_features_from_slice(
+        np.arange(32 * 32, dtype=np.uint16).reshape(32, 32), 16
+    )
+
+
+def _process_file_in_worker(file_path: str) -> tuple[List[Dict[str, Any]], HistogramAggregator,
+                                                     Optional[PixelAccumulator]]:
+    """Processes one file with the processor of the current worker process.
+
+    Returns the feature rows, the histograms of the file, summed as each plane is
+    computed (the rows only hold them with ``keep_histograms``), and, with
+    ``pixel_statistics``, the pixel statistics of the file, which the parent process
+    merges.
+    """
+    if _worker_processor.pixel_statistics:
+        _worker_processor.pixels = PixelAccumulator(_worker_processor.pixel_bin)
+    histograms = HistogramAggregator()
+    rows = _worker_processor.process_file(file_path, histograms)
+    return rows, histograms, _worker_processor.pixels
+
+
+def _extract_shared_plane(descriptor: PlaneDescriptor, bit_depth) -> Dict[str, Any]:
+    """Extracts the features of a plane held in shared memory in a worker process."""
+    return _worker_processor.extract_features_from_slice(attach_plane(descriptor), bit_depth)
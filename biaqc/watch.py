@@ -0,0 +1,212 @@
+import os
+import time
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from .file_operations import RunStore
+from .metadata import Metadata
+from .utils import ND2ImageProcessor
+import logging
+
+# Configure logging for the module
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Number of times a file failing to be processed is tried, each time it changes,
+# before it is skipped
+MAX_ATTEMPTS = 3
+
+
+@dataclass
+class _Candidate:
+    """State of a file seen in a watched folder but not processed yet."""
+    size: int
+    mtime: float
+    first_seen: float
+    stable_since: float
+
+
+@dataclass
+class _Failure:
+    """State of a file that could not be processed, retried once it changes."""
+    size: int
+    mtime: float
+    attempts: int
+
+
+def is_locked(file_path: str) -> bool:
+    """
+    Returns whether another process still holds the file open for writing.
+
+    Acquisition software on Windows opens the file exclusively while writing it, so
+    opening it for update fails until the acquisition is finished. POSIX systems have
+    no such lock (and read-only files could not be opened for update), so the file is
+    never probed there and completion relies on its size and modification time being
+    stable.
+    """
+    if os.name != "nt":
+        return False
+    try:
+        with open(file_path, "rb+"):
+            return False
+    except OSError:
+        return True
+
+
+class QCWatcher:
+    """
+    Watches acquisition folders and runs QC on each new file as soon as it is complete.
+
+    Folders are polled, which also works on network mounts where file system events
+    are not delivered. A new file is complete once its size and modification time have
+    not changed for ``settle_time`` seconds and it is no longer locked by the writer.
+    Its features and metadata are then appended to a RunStore, together with the
+    latency from the last write of the file to the results being stored.
+
+    A file that fails, e.g. because it was still being copied over a slow network
+    share, is tried again once its size or modification time changes, up to
+    ``max_attempts`` times.
+    """
+
+    def __init__(self, folders: Sequence[str], store: RunStore, extensions: Tuple[str, ...] = (".nd2",),
+                 poll_interval: float = 5.0, settle_time: float = 10.0, plane_workers: int = 1,
+                 prefetch_depth: int = 0, max_attempts: int = MAX_ATTEMPTS) -> None:
+        """
+        Initializes the QCWatcher.
+
+        Args:
+            folders (Sequence[str]): Folders to watch.
+            store (RunStore): Store receiving the results.
+            extensions (Tuple[str, ...]): Extensions of the files to process.
+            poll_interval (float): Seconds between two scans of the folders.
+            settle_time (float): Seconds a file must stay unchanged to be complete.
+            plane_workers (int): Threads computing the plane features of a file.
+            prefetch_depth (int): Planes decoded ahead while features are computed.
+            max_attempts (int): Number of times a failing file is tried before it is
+                skipped for the rest of the session.
+        """
+        self.folders = list(folders)
+        self.store = store
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+        self.processor = ND2ImageProcessor(plane_workers=plane_workers, prefetch_depth=prefetch_depth)
+        self.metadata = Metadata()
+        self.max_attempts = max_attempts
+        self.processed = store.stored_files()
+        self._failures: Dict[str, _Failure] = {}
+        self._candidates: Dict[str, _Candidate] = {}
+        self._stop = threading.Event()
+
+    def scan(self) -> List[str]:
+        """Returns the sorted paths of the watched files that are not processed yet."""
+        paths = []
+        for folder in self.folders:
+            for file_name in os.listdir(folder):
+                path = os.path.join(folder, file_name)
+                if file_name.lower().endswith(self.extensions) and path not in self.processed:
+                    paths.append(path)
+        return sorted(paths)
+
+    def ready_files(self, now: Optional[float] = None) -> List[str]:
+        """Updates the state of the new files and returns those that are complete."""
+        now = time.time() if now is None else now
+        ready = []
+        for path in self.scan():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                self._candidates.pop(path, None)
+                self._failures.pop(path, None)
+                continue
+            failure = self._failures.get(path)
+            if failure is not None and (failure.size, failure.mtime) == (stat.st_size, stat.st_mtime):
+                continue
+            candidate = self._candidates.get(path)
+            if candidate is None or (candidate.size, candidate.mtime) != (stat.st_size, stat.st_mtime):
+                first_seen = now if candidate is None else candidate.first_seen
+                self._candidates[path] = _Candidate(stat.st_size, stat.st_mtime, first_seen, now)
+                continue
+            if now - candidate.stable_since >= self.settle_time and not is_locked(path):
+                ready.append(path)
+        return ready
+
+    def process(self, file_path: str) -> Dict[str, Any]:
+        """
+        Processes a complete file and appends its results to the store.
+
+        Args:
+            file_path (str): Path of the file.
+
+        Returns:
+            Dict[str, Any]: Timings of the file, in seconds.
+        """
+        candidate = self._candidates.pop(file_path, None)
+        start = time.time()
+        features = self.processor.process_file(file_path)
+        self.metadata.set_image_path(file_path)
+        metadata = self.metadata.get_nd2_metadata()
+        self.store.append("features", features)
+        self.store.append("metadata", metadata)
+        done = time.time()
+        self.processed.add(file_path)
+        self._failures.pop(file_path, None)
+
+        landed = candidate.mtime if candidate is not None else os.path.getmtime(file_path)
+        timings = {
+            "file_path": file_path,
+            "wait_time": start - landed,
+            "processing_time": done - start,
+            "latency": done - landed,
+            "n_planes": len(features),
+        }
+        self.store.append("latency", [timings])
+        logger.info(
+            f"QC of {os.path.basename(file_path)}: {len(features)} planes in "
+            f"{timings['processing_time']:.1f}s, {timings['latency']:.1f}s after the last write."
+        )
+        return timings
+
+    def poll_once(self) -> List[Dict[str, Any]]:
+        """Scans the folders once and processes the files that are complete."""
+        timings = []
+        for path in self.ready_files():
+            if self._stop.is_set():
+                break
+            try:
+                timings.append(self.process(path))
+            except Exception:
+                # keep watching: a corrupt file must not stop the session's QC
+                self._record_failure(path)
+        return timings
+
+    def _record_failure(self, path: str) -> None:
+        """Skips a file that failed until it changes, or for good after ``max_attempts``."""
+        failure = self._failures.pop(path, None)
+        attempts = 1 if failure is None else failure.attempts + 1
+        try:
+            stat = os.stat(path)
+        except OSError:
+            logger.exception(f"Could not process {path}, which is gone.")
+            return
+        if attempts >= self.max_attempts:
+            logger.exception(f"Could not process {path}, skipping it after {attempts} attempts.")
+            self.processed.add(path)
+            return
+        logger.exception(f"Could not process {path} (attempt {attempts} of {self.max_attempts}), "
+                         f"trying again once it changes.")
+        self._failures[path] = _Failure(stat.st_size, stat.st_mtime, attempts)
+
+    def run(self) -> None:
+        """Watches the folders until ``stop`` is called or the process is interrupted."""
+        logger.info(f"Watching {', '.join(self.folders)}.")
+        try:
+            while not self._stop.is_set():
+                self.poll_once()
+                self._stop.wait(self.poll_interval)
+        except KeyboardInterrupt:
+            logger.info("Stopped watching.")
+
+    def stop(self) -> None:
+        """Stops ``run`` after the current file."""
+        self._stop.set()
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+
+from qtpy.QtCore import QObject, Signal, Slot
+from biaqc._lazy import lazy_import
+from biaqc.analysis import FeaturePCA
+from biaqc.file_operations import write_table
+from biaqc.image_analysis import SCORE_COLUMNS, OutlierScorer
+from biaqc.metadata import Metadata
+from biaqc.utils import ND2ImageProcessor
+
+# Heavy dependencies, imported when first used
+pd = lazy_import("pandas")
+
+# Minimum number of seconds between two previews of the plots during an analysis
+PREVIEW_INTERVAL = 2.0
+# Minimum number of planes for a preview, the PCA and outlier scores need a few
+MIN_PREVIEW_PLANES = 10
+
+
+def score_features(features_df: pd.DataFrame) -> tuple[FeaturePCA, pd.DataFrame]:
+    """
+    Fits the PCA of the features and scores the planes as outliers.
+
+    Returns:
+        tuple[FeaturePCA, pd.DataFrame]: The fitted FeaturePCA, and the PCA table with
+        the outlier scores of each plane.
+    """
+    feature_pca = FeaturePCA()
+    feature_pca.set_data(features_df)
+    scores = OutlierScorer().score(features_df)
+    return feature_pca, pd.concat(
+        [feature_pca.combine_pcas(), scores[SCORE_COLUMNS].reset_index(drop=True)], axis=1
+    )
+
+
+class AnalysisWorker(QObject):
+    """
+    Runs the feature and metadata pipelines of a folder off the GUI thread.
+
+    Meant to be moved to a QThread and started with ``run``. The progress is sent
+    with ``fileProcessed`` as each file is done, and every PREVIEW_INTERVAL seconds
+    the PCA table of the planes analysed so far is computed here and sent with
+    ``previewReady``, so the plots can be updated while the analysis goes on. The
+    rows of the preview are in the order the files completed, so each preview only
+    appends rows to the previous one. ``cancel`` stops the run after the files in
+    progress; the files done so far are kept and written as usual. A file that fails
+    is logged and sent with ``fileFailed``, and the run goes on with the other files.
+    """
+
+    fileProcessed = Signal(int, int)  # files done, total
+    fileFailed = Signal(str)  # path of a file that could not be analysed
+    previewReady = Signal(object)  # PCA table with the outlier scores
+    metadataStarted = Signal()
+    finished = Signal(object, object, bool)  # features, metadata, cancelled
+    failed = Signal(str)
+
+    def __init__(self, folder_path: str, workers: int = 1, parent: QObject | None = None) -> None:
+        """
+        Args:
+            folder_path (str): Folder containing the ND2 files.
+            workers (int): Number of worker processes for the feature extraction.
+            parent (QObject, optional): The parent object.
+        """
+        super().__init__(parent)
+        self.folder_path = folder_path
+        self.workers = workers
+        self._cancel = threading.Event()
+
+    def cancel(self) -> None:
+        """Asks the run to stop after the files in progress. Safe to call from any thread."""
+        self._cancel.set()
+
+    def output_path(self, kind: str, ext: str = ".csv") -> str:
+        """Returns the path of a result file, next to the ND2 files as before."""
+        name = os.path.basename(os.path.normpath(self.folder_path))
+        return os.path.join(self.folder_path, f"{name}_{kind}{ext}")
+
+    @Slot()
+    def run(self) -> None:
+        try:
+            self._run()
+        except Exception as e:  # reported to the GUI, which would otherwise hang
+            self.failed.emit(f"{type(e).__name__}: {e}")
+
+    def _run(self) -> None:
+        processor = ND2ImageProcessor()
+        file_paths = processor.list_files(self.folder_path)
+        per_file_results = [None] * len(file_paths)
+
+        files = processor.iter_files(file_paths, workers=min(self.workers, len(file_paths)),
+                                     skip_errors=True)
+        # rows in the order the files completed, for the previews
+        completed_rows = []
+        last_preview = time.monotonic()
+        done = 0
+        try:
+            for done, (idx, image_results) in enumerate(files, start=1):
+                if image_results is None:
+                    self.fileFailed.emit(file_paths[idx])
+                else:
+                    per_file_results[idx] = image_results
+                    completed_rows.extend(image_results)
+                self.fileProcessed.emit(done, len(file_paths))
+                if self._cancel.is_set():
+                    break
+                if (done < len(file_paths) and len(completed_rows) >= MIN_PREVIEW_PLANES
+                        and time.monotonic() - last_preview >= PREVIEW_INTERVAL):
+                    self.previewReady.emit(score_features(pd.DataFrame(completed_rows))[1])
+                    last_preview = time.monotonic()
+        finally:
+            files.close()
+
+        # keep the files done, in the order of a complete run
+        done_paths = [path for path, rows in zip(file_paths, per_file_results) if rows is not None]
+        features = pd.DataFrame([row for rows in per_file_results if rows is not None for row in rows])
+        cancelled = done < len(file_paths)
+        write_table(features, self.output_path("features"))
+
+        self.metadataStarted.emit()
+        metadata = Metadata()
+        metadata.process_files(done_paths, output_csv=self.output_path("metadata"))
+        self.finished.emit(features, metadata.df, cancelled)
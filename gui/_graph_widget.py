@@ -1,6 +1,6 @@
 from __future__ import annotations
-import contextlib
-from typing import Callable
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any
 
 import numpy as np
 from qtpy.QtWidgets import (
@@ -11,13 +11,22 @@ from qtpy.QtWidgets import (
     QHBoxLayout,
     QVBoxLayout,
 )
+from matplotlib import colormaps
+from matplotlib.cm import ScalarMappable
+from matplotlib.colors import LogNorm, Normalize, to_rgba
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-import pandas as pd
-import mplcursors
-from matplotlib.axes import Axes
 from qtpy.QtCore import Signal
 from superqt.utils import signals_blocked
+from biaqc._lazy import lazy_import
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from matplotlib.axes import Axes
+    from matplotlib.backend_bases import MouseEvent
+
+# Heavy dependencies, imported when first used
+spatial = lazy_import("scipy.spatial")
 
 
 
@@ -31,6 +40,110 @@ TEXTURE = "Texture Features"
 
 ITEMS = [ALL, INTENSITY, NOISE, SHARPNESS, TEXTURE]
 
+# Columns and axis labels of each plot
+PLOTS = {
+    ALL: ('all_pca_1', 'all_pca_2', 'PCA 1 for All Features', 'PCA 2 for All Features'),
+    INTENSITY: ('intensity_pca_1', 'intensity_pca_2',
+                'PCA 1 for Intensity Features', 'PCA 2 for Intensity Features'),
+    NOISE: ('noise_noise_level', 'noise_snr', 'Noise Level', 'Signal to Noise Ratio'),
+    SHARPNESS: ('sharpness_pca_1', 'sharpness_pca_2',
+                'PCA 1 for Sharpness Features', 'PCA 2 for Sharpness Features'),
+    TEXTURE: ('texture_pca_1', 'texture_pca_2', 'PCA 1 for Texture Features', 'PCA 2 for Texture Features'),
+}
+
+# Colours of the points by outlier score: green when typical, yellow at the
+# outlier threshold (score 1) and red from twice the threshold
+OUTLIER_NORM = Normalize(vmin=0, vmax=2, clip=True)
+OUTLIER_CMAP = colormaps["RdYlGn_r"]
+
+# Colours of the selected point and of the planes most similar to it
+SELECTED_COLOR = to_rgba("magenta")
+SIMILAR_COLOR = to_rgba("cyan")
+
+# Number of points from which the density of the points is drawn in bins
+# instead of each point, and number of bins along each axis
+DENSITY_THRESHOLD = 50_000
+DENSITY_BINS = 256
+# Maximum distance in screen pixels between a click and the picked point
+PICK_RADIUS = 6
+
+
+@dataclass
+class _PlotData:
+    """The points of a plot for a channel, kept while the data does not change."""
+    # rows of feature_pca_df, ascending, and the coordinates and colour of each point
+    rows: np.ndarray
+    x: np.ndarray
+    y: np.ndarray
+    colors: np.ndarray
+    scores: np.ndarray | None
+    _tree: Any = None
+    _indexed: np.ndarray | None = None
+    _density: tuple[np.ma.MaskedArray, tuple[float, float, float, float]] | None = None
+    _scale: np.ndarray = field(default_factory=lambda: np.ones(2))
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def positions_of(self, rows: np.ndarray) -> np.ndarray:
+        """Returns the positions of the points of the given rows, those plotted."""
+        rows = np.asarray(rows, dtype=np.intp)
+        positions = np.searchsorted(self.rows, rows)
+        found = positions < len(self.rows)
+        found[found] = self.rows[positions[found]] == rows[found]
+        return positions[found]
+
+    def pick(self, ax: Axes, px: float, py: float, k: int = 8) -> int | None:
+        """
+        Returns the position of the point nearest to the screen position (px, py),
+        if within PICK_RADIUS pixels. The nearest points in data units, scaled by the
+        data range, are found with a KD-tree and the closest on screen is kept.
+        """
+        if len(self) == 0:
+            return None
+        if self._tree is None:
+            points = np.column_stack([self.x, self.y])
+            # positions of the points with finite coordinates, the ones indexed
+            self._indexed = np.flatnonzero(np.isfinite(points).all(axis=1))
+            points = points[self._indexed]
+            span = np.ptp(points, axis=0) if len(points) else np.ones(2)
+            self._scale = np.where(span > 0, span, 1.0)
+            self._tree = spatial.cKDTree(points / self._scale)
+        if len(self._indexed) == 0:
+            return None
+        xy = ax.transData.inverted().transform((px, py))
+        _, nearest = self._tree.query(xy / self._scale, k=min(k, len(self._indexed)))
+        candidates = self._indexed[np.atleast_1d(nearest)]
+        screen = ax.transData.transform(np.column_stack([self.x[candidates], self.y[candidates]]))
+        distances = np.hypot(screen[:, 0] - px, screen[:, 1] - py)
+        best = int(np.argmin(distances))
+        return int(candidates[best]) if distances[best] <= PICK_RADIUS else None
+
+    def density(self) -> tuple[np.ma.MaskedArray, tuple[float, float, float, float]]:
+        """
+        Bins the points in a DENSITY_BINS x DENSITY_BINS grid. Returns the highest
+        outlier score of each bin when scored, else the number of points, masked
+        where the bin is empty, and the extent of the grid.
+        """
+        if self._density is None:
+            finite = np.isfinite(self.x) & np.isfinite(self.y)
+            x, y = self.x[finite], self.y[finite]
+            x0, x1 = (x.min(), x.max()) if len(x) else (0.0, 1.0)
+            y0, y1 = (y.min(), y.max()) if len(y) else (0.0, 1.0)
+            x1, y1 = max(x1, x0 + 1e-12), max(y1, y0 + 1e-12)
+            ix = np.minimum(((x - x0) / (x1 - x0) * DENSITY_BINS).astype(np.intp), DENSITY_BINS - 1)
+            iy = np.minimum(((y - y0) / (y1 - y0) * DENSITY_BINS).astype(np.intp), DENSITY_BINS - 1)
+            bins = iy * DENSITY_BINS + ix
+            counts = np.bincount(bins, minlength=DENSITY_BINS ** 2)
+            if self.scores is None:
+                grid = counts.astype(float)
+            else:
+                grid = np.full(DENSITY_BINS ** 2, np.nan)
+                np.fmax.at(grid, bins, self.scores[finite])
+            grid = np.ma.masked_where(counts == 0, grid).reshape(DENSITY_BINS, DENSITY_BINS)
+            self._density = grid, (x0, x1, y0, y1)
+        return self._density
+
 
 class GraphWidget(QGroupBox):
     pointSelected = Signal(object)  # path, c, z, t or None
@@ -39,12 +152,20 @@ class GraphWidget(QGroupBox):
         super().__init__(parent)
 
         self.feature_pca_df: pd.DataFrame | None = None
+        # rows of each channel, and points of each plot and channel
+        self._channel_rows: dict[int, np.ndarray] = {}
+        self._cache: dict[tuple[str, int], _PlotData] = {}
 
-        self.all: Axes | None = None
-        self.intensity: Axes | None = None
-        self.noise: Axes | None = None
-        self.sharpness: Axes | None = None
-        self.texture: Axes | None = None
+        # the plotted points, their artist (the scatter, or the density image with
+        # the highlighted points drawn on top) and the highlighted positions
+        self._data: _PlotData | None = None
+        self._ax: Axes | None = None
+        self._artist = None
+        self._highlight = None
+        self._facecolors: np.ndarray | None = None
+        self._shown: np.ndarray = np.zeros(0, dtype=np.intp)
+        self._selected: int | None = None
+        self._similar: np.ndarray = np.zeros(0, dtype=np.intp)
 
         self.pca_type_combo = QComboBox()
         self.pca_type_combo.addItems(["", *ITEMS])
@@ -78,98 +199,151 @@ class GraphWidget(QGroupBox):
         # connections
         self.pca_type_combo.currentTextChanged.connect(self._plot)
         self.channel_combo.currentTextChanged.connect(self._plot)
+        self.canvas.mpl_connect("button_press_event", self._on_click)
 
     def set_dataframe(self, dataframe: pd.DataFrame) -> None:
+        # the plane selected, found again in the new data once plotted
+        selected = None
+        if self._data is not None and self._selected is not None:
+            df = self.feature_pca_df
+            row = self._data.rows[self._selected]
+            selected = tuple(df[column].iat[row] for column in ("file_path", "C", "Z", "T"))
+
         self.feature_pca_df = dataframe
+        self._channel_rows = {int(c): rows for c, rows in dataframe.groupby("C").indices.items()}
+        self._cache.clear()
 
         num_channels = dataframe.C.nunique()
         chs = [f"Channels {ch+1}" for ch in range(num_channels)]
+        # keep the channel shown when the data is refreshed, e.g. during an analysis
+        channel = self.channel_combo.currentIndex()
         with signals_blocked(self.channel_combo):
             self.channel_combo.clear()
             self.channel_combo.addItems(chs)
+            if 0 <= channel < num_channels:
+                self.channel_combo.setCurrentIndex(channel)
 
         self._plot()
+        if selected is not None and self._data is not None:
+            path, c, z, t = selected
+            rows = np.flatnonzero(((dataframe["file_path"] == path) & (dataframe["C"] == c)
+                                   & (dataframe["Z"] == z) & (dataframe["T"] == t)).to_numpy())
+            positions = self._data.positions_of(rows)
+            if len(positions):
+                self._selected = int(positions[0])
+                self._update_colors()
+
+    def _plot_data(self, plot_type: str, ch: int) -> _PlotData | None:
+        """Returns the points of a plot for a channel, extracted once per data."""
+        data = self._cache.get((plot_type, ch))
+        if data is None:
+            x_column, y_column = PLOTS[plot_type][:2]
+            df = self.feature_pca_df
+            if x_column not in df or y_column not in df:
+                return None
+            rows = self._channel_rows.get(ch, np.zeros(0, dtype=np.intp))
+            scores = df["outlier_score"].to_numpy(dtype=float)[rows] if "outlier_score" in df else None
+            data = self._cache[(plot_type, ch)] = _PlotData(
+                rows,
+                df[x_column].to_numpy(dtype=float)[rows],
+                df[y_column].to_numpy(dtype=float)[rows],
+                self._point_colors(scores, len(rows)),
+                scores,
+            )
+        return data
 
     def _plot(self) -> None:
         self.figure.clear()
+        self._data = self._ax = self._artist = self._highlight = self._facecolors = None
+        self._shown = np.zeros(0, dtype=np.intp)
+        self._selected = None
+        self._similar = np.zeros(0, dtype=np.intp)
 
         plot_type = self.pca_type_combo.currentText()
-
-        if plot_type == "" or self.feature_pca_df is None:
+        data = None
+        if plot_type in PLOTS and self.feature_pca_df is not None:
+            data = self._plot_data(plot_type, self.channel_combo.currentIndex())
+        if data is None:
             self.canvas.draw()
             self.pointSelected.emit(None)
             return
-        
-        ch = self.channel_combo.currentIndex()
-        temp_data = self.feature_pca_df[self.feature_pca_df.C==ch].reset_index()
+
         ax = self.figure.add_subplot(1, 1, 1)
+        if len(data) > DENSITY_THRESHOLD:
+            grid, extent = data.density()
+            if data.scores is None:
+                self._artist = ax.imshow(grid, origin="lower", extent=extent, aspect="auto",
+                                         interpolation="nearest", cmap="Greens", norm=LogNorm())
+                self.figure.colorbar(self._artist, ax=ax, label="Number of planes")
+            else:
+                self._artist = ax.imshow(grid, origin="lower", extent=extent, aspect="auto",
+                                         interpolation="nearest", cmap=OUTLIER_CMAP, norm=OUTLIER_NORM)
+            self._highlight = ax.scatter([], [], s=30, zorder=3)
+        else:
+            # smaller, rasterized markers keep tens of thousands of points fluid
+            many = len(data) > 5_000
+            self._facecolors = data.colors.copy()
+            self._artist = ax.scatter(data.x, data.y, c=self._facecolors, s=6 if many else 20,
+                                      linewidths=0, rasterized=many)
+        ax.set_xlabel(PLOTS[plot_type][2])
+        ax.set_ylabel(PLOTS[plot_type][3])
 
-        if plot_type == ALL:
-            self.all = ax.scatter(temp_data['all_pca_1'], temp_data['all_pca_2'], c='green')
-            ax.set_xlabel('PCA 1 for All Features')
-            ax.set_ylabel('PCA 2 for All Features')
-        
-        elif plot_type == INTENSITY:
-            self.intensity = ax.scatter(temp_data['intensity_pca_1'], temp_data['intensity_pca_2'], c='green')
-            ax.set_xlabel('PCA 1 for Intensity Features')
-            ax.set_ylabel('PCA 2 for Intensity Features')
-        
-        elif plot_type == NOISE:
-            self.noise = ax.scatter(temp_data['noise_noise_level'], temp_data['noise_snr'], c='green')
-            ax.set_xlabel('Noise Level')
-            ax.set_ylabel('Signal to Noise Ratio')
-        
-        elif plot_type == SHARPNESS:
-            self.sharpness = ax.scatter(temp_data['sharpness_pca_1'], temp_data['sharpness_pca_2'], c='green')
-            ax.set_xlabel('PCA 1 for Sharpness Features')
-            ax.set_ylabel('PCA 2 for Sharpness Features')
-        
-        elif plot_type == TEXTURE:
-            self.texture = ax.scatter(temp_data['texture_pca_1'], temp_data['texture_pca_2'], c='green')
-            ax.set_xlabel('PCA 1 for Texture Features')
-            ax.set_ylabel('PCA 2 for Texture Features')
+        if data.scores is not None:
+            label = "Highest outlier score" if self._highlight is not None else "Outlier score"
+            self.figure.colorbar(ScalarMappable(norm=OUTLIER_NORM, cmap=OUTLIER_CMAP), ax=ax, label=label)
 
-        else:
-            self.canvas.draw()
-            self.pointSelected.emit(None)
+        self._data = data
+        self._ax = ax
+        self.canvas.draw()
+
+    def _on_click(self, event: MouseEvent) -> None:
+        """Selects the point under the mouse, found with the spatial index of the plot."""
+        if self._data is None or event.inaxes is not self._ax or event.button != 1:
+            return
+        position = self._data.pick(self._ax, event.x, event.y)
+        if position is None:
             return
+        # the similar planes of the previous selection are no longer relevant
+        self._selected = position
+        self._similar = np.zeros(0, dtype=np.intp)
+        self._update_colors()
 
-        cursor = mplcursors.cursor(ax)
-        
-
-        @cursor.connect("add")  # type: ignore [misc]
-        def on_add(sel: mplcursors.Selection) -> None:
-            # hide the annotation when the point is deselected
-            with contextlib.suppress(AttributeError):
-                sel.annotation.set_visible(False)
-            if plot_type:
-                graph = self._get_graph(plot_type)
-                if graph is None:
-                    return
-                # reset all face colors to green and set the selected point to magenta
-                colors = ["green"] * len(graph.get_offsets())
-                colors[sel.index] = "magenta"
-                graph.set_facecolors(colors)
-                self.canvas.draw_idle()
-
-
-            path = temp_data['file_path'][sel.index]
-            c = temp_data['C'][sel.index]
-            z = temp_data['Z'][sel.index]
-            t = temp_data['T'][sel.index]
-            self.pointSelected.emit((path, c, z, t))
+        row = self._data.rows[position]
+        df = self.feature_pca_df
+        self.pointSelected.emit((
+            df["file_path"].iat[row], int(df["C"].iat[row]), int(df["Z"].iat[row]), int(df["T"].iat[row])
+        ))
 
-        self.canvas.draw()
-    
-    def _get_graph(self, plot_type: str) -> Axes | None:
-        if plot_type == INTENSITY:
-            return self.intensity
-        if plot_type == NOISE:
-            return self.noise
-        if plot_type == SHARPNESS:
-            return self.sharpness
-        if plot_type == TEXTURE:
-            return self.texture
-        if plot_type == ALL:
-            return self.all
-        return None
+    def highlight_similar(self, rows: np.ndarray) -> None:
+        """Highlights the given rows of the PCA table, those of the plotted channel."""
+        if self._data is None:
+            return
+        self._similar = self._data.positions_of(rows)
+        self._update_colors()
+
+    def _update_colors(self) -> None:
+        """Marks the selected point and the similar planes, only changing their colours."""
+        if self._data is None:
+            return
+        shown = self._similar
+        colors = np.tile(SIMILAR_COLOR, (len(shown), 1))
+        if self._selected is not None:
+            shown = np.append(shown, self._selected)
+            colors = np.vstack([colors, SELECTED_COLOR])
+
+        if self._highlight is not None:
+            self._highlight.set_offsets(np.column_stack([self._data.x[shown], self._data.y[shown]]))
+            self._highlight.set_facecolors(colors)
+        else:
+            # restore the points highlighted before, then mark the new ones
+            self._facecolors[self._shown] = self._data.colors[self._shown]
+            self._facecolors[shown] = colors
+            self._artist.set_facecolors(self._facecolors)
+        self._shown = shown
+        self.canvas.draw_idle()
+
+    def _point_colors(self, scores: np.ndarray | None, n: int) -> np.ndarray:
+        """Returns the colour of each point: by outlier score when scored, else green."""
+        if scores is not None:
+            return OUTLIER_CMAP(OUTLIER_NORM(scores))
+        return np.tile(to_rgba("green"), (n, 1))
@@ -5,27 +5,33 @@ from typing import TYPE_CHECKING
 
 import numpy as np
 from fonticon_mdi6 import MDI6
-from qtpy.QtCore import Qt
+from qtpy.QtCore import Qt, Signal
 from qtpy.QtWidgets import (
     QGroupBox,
     QHBoxLayout,
+    QLabel,
     QMessageBox,
     QPushButton,
     QSizePolicy,
+    QSpinBox,
     QVBoxLayout,
     QWidget,
 )
-from xarray import DataArray
 from superqt import QLabeledRangeSlider
 from superqt.fonticon import icon
 from superqt.utils import signals_blocked
 from vispy import scene
-from ndv import NDViewer
+from biaqc._lazy import lazy_import
 
 
 if TYPE_CHECKING:
     from typing import Literal
 
+    from xarray import DataArray
+
+# Heavy dependencies, imported when first used
+ndv = lazy_import("ndv")
+
 
 SS = """
 QSlider::groove:horizontal {
@@ -72,6 +78,9 @@ def show_error_dialog(parent: QWidget, message: str) -> None:
 class ImageViewer(QGroupBox):
     """A widget for displaying an image."""
 
+    planeRequested = Signal(int, int)  # z, t chosen with the navigation controls
+    playToggled = Signal(bool)
+
     def __init__(self, parent: QWidget | None = None):
         super().__init__(parent=parent)
 
@@ -109,6 +118,32 @@ class ImageViewer(QGroupBox):
         self._ndv.setToolTip("Open in ndv")
         self._ndv.setIcon(icon(MDI6.play_box_multiple_outline))
         self._ndv.clicked.connect(self._open_with_ndv)
+        # navigation controls --------------------------------------------------
+
+        self._t_spin = QSpinBox()
+        self._t_spin.setKeyboardTracking(False)
+        self._z_spin = QSpinBox()
+        self._z_spin.setKeyboardTracking(False)
+        self._t_spin.valueChanged.connect(self._on_position_changed)
+        self._z_spin.valueChanged.connect(self._on_position_changed)
+        self._play = QPushButton()
+        self._play.setCheckable(True)
+        self._play.setFocusPolicy(Qt.FocusPolicy.NoFocus)
+        self._play.setToolTip("Play over T")
+        self._play.setIcon(icon(MDI6.play))
+        self._play.toggled.connect(self._on_play_toggled)
+        nav_wdg = QWidget()
+        nav_wdg_layout = QHBoxLayout(nav_wdg)
+        nav_wdg_layout.setContentsMargins(0, 0, 0, 0)
+        nav_wdg_layout.addWidget(QLabel("T:"))
+        nav_wdg_layout.addWidget(self._t_spin)
+        nav_wdg_layout.addWidget(QLabel("Z:"))
+        nav_wdg_layout.addWidget(self._z_spin)
+        nav_wdg_layout.addWidget(self._play)
+        nav_wdg_layout.addStretch()
+        nav_wdg.setEnabled(False)
+        self._nav_wdg = nav_wdg
+
         # bottom widget
         lut_wdg = QWidget()
         lut_wdg_layout = QHBoxLayout(lut_wdg)
@@ -121,6 +156,7 @@ class ImageViewer(QGroupBox):
         # Layout ------------------------------------------------------------------
         main_layout = QVBoxLayout(self)
         main_layout.addWidget(self._viewer)
+        main_layout.addWidget(nav_wdg)
         main_layout.addWidget(lut_wdg)
 
     def setData(self, image: np.ndarray) -> None:
@@ -141,6 +177,38 @@ class ImageViewer(QGroupBox):
             self._auto_clim.setChecked(True)
             self._clims_auto(True)
 
+    def setFrame(self, image: np.ndarray) -> None:
+        """Replace the image with another frame of the same shape, keeping the view
+        and the contrast limits (e.g. during playback)."""
+        if self._viewer.image is None or self._viewer.image._data.shape != image.shape:
+            self.setData(image)
+            return
+        self._viewer.image.set_data(image)
+        self._viewer.image.update()
+
+    def setPosition(self, z: int, t: int, n_z: int, n_t: int) -> None:
+        """Show the Z and T of the displayed plane in the navigation controls."""
+        with signals_blocked(self._t_spin), signals_blocked(self._z_spin):
+            self._t_spin.setRange(0, n_t - 1)
+            self._z_spin.setRange(0, n_z - 1)
+            self._t_spin.setValue(t)
+            self._z_spin.setValue(z)
+        self._nav_wdg.setEnabled(True)
+        self._play.setEnabled(n_t > 1)
+
+    def setPlaying(self, playing: bool) -> None:
+        """Show whether the playback runs, without emitting playToggled."""
+        with signals_blocked(self._play):
+            self._play.setChecked(playing)
+        self._play.setIcon(icon(MDI6.pause if playing else MDI6.play))
+
+    def _on_position_changed(self) -> None:
+        self.planeRequested.emit(self._z_spin.value(), self._t_spin.value())
+
+    def _on_play_toggled(self, playing: bool) -> None:
+        self._play.setIcon(icon(MDI6.pause if playing else MDI6.play))
+        self.playToggled.emit(playing)
+
     def data(self) -> np.ndarray | None:
         """Return the image data."""
         return self._viewer.image._data if self._viewer.image is not None else None
@@ -181,10 +249,10 @@ class ImageViewer(QGroupBox):
         if self._ndv_file is None:
             return
         ary, c, z, t = self._ndv_file
-        ndv = NDViewer(ary, parent=self)
-        ndv.set_current_index({"C": c, "Z": z, "T": t})
-        ndv.setWindowFlags(Qt.WindowType.Dialog)
-        ndv.show()
+        viewer = ndv.NDViewer(ary, parent=self)
+        viewer.set_current_index({"C": c, "Z": z, "T": t})
+        viewer.setWindowFlags(Qt.WindowType.Dialog)
+        viewer.show()
 
 class _ImageCanvas(QWidget):
     """A Widget that displays an image."""
@@ -1,4 +1,7 @@
-import pandas as pd
+from __future__ import annotations
+
+import os
+
 from qtpy.QtWidgets import (
     QWidget,
     QMainWindow,
@@ -6,19 +9,37 @@ from qtpy.QtWidgets import (
     QSplitter,
     QHBoxLayout,
     QFileDialog,
+    QMessageBox,
+    QProgressBar,
+    QPushButton,
 )
-from qtpy.QtCore import Qt
+from qtpy.QtCore import Qt, QThread, QTimer
 from qtpy.QtGui import QIcon
+from ._analysis_worker import AnalysisWorker, score_features
 from ._graph_widget import GraphWidget
 from ._image_viewer import ImageViewer
 from ._metadata_summary_widget import MetaSummaryWidget
-from bioio import BioImage
-import bioio_nd2
-from biaqc.metadata import Metadata
-from biaqc.utils import ND2ImageProcessor
-from biaqc.analysis import FeaturePCA, MetadataAnalysis
+from biaqc._lazy import lazy_import
+from biaqc.analysis import MetadataAnalysis
+from biaqc.plane_cache import NeighbourPrefetcher, PlaneCache, playback
+from biaqc.similarity import SimilarityIndex
 from gui._load_csv_widget import LoadCSVWidget
-from xarray import DataArray
+import logging
+
+# Configure logging for the module
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Number of similar planes highlighted when a point is selected
+N_SIMILAR = 10
+
+# Memory kept for the decoded planes of the viewer
+PLANE_CACHE_BUDGET = "1G"
+# Frames per second of the playback over T
+PLAYBACK_FPS = 10
+
+# Heavy dependencies, imported when first used
+pd = lazy_import("pandas")
 
 
 class QCMainWindow(QMainWindow):
@@ -28,8 +49,24 @@ class QCMainWindow(QMainWindow):
         self.setWindowTitle("QC Main Window")
         self.feature_pca_df: pd.DataFrame | None = None
         self.metadata_analysis_list: list[str] | None = None
+        self.similarity: SimilarityIndex | None = None
 
-        self._files: dict[str, DataArray] = {}
+        # planes decoded on demand from the lazily opened files, most recent kept
+        self.plane_cache = PlaneCache(PLANE_CACHE_BUDGET)
+        # neighbours of the shown plane decoded in the background, and the
+        # playback over T with its frames decoded ahead
+        self.prefetcher = NeighbourPrefetcher(self.plane_cache)
+        self._current: tuple[str, int, int, int] | None = None
+        self._playback = None
+        self._playback_frames = None
+        self._play_timer = QTimer(self)
+        self._play_timer.setInterval(1000 // PLAYBACK_FPS)
+        self._play_timer.timeout.connect(self._on_play_tick)
+
+        # analysis running in the background
+        self._thread: QThread | None = None
+        self._worker: AnalysisWorker | None = None
+        self._failed_files: list[str] = []
 
         self.menubar = QMenuBar(self)
         self.setMenuBar(self.menubar)
@@ -62,71 +99,259 @@ class QCMainWindow(QMainWindow):
         layout = QHBoxLayout(self.central_widget)
         layout.addWidget(splitter2)
 
+        # progress of the analysis, shown while it runs
+        self.progress = QProgressBar(self)
+        self.progress.setFormat("%v/%m files")
+        self.cancel_button = QPushButton("Cancel", self)
+        self.cancel_button.clicked.connect(self._on_cancel)
+        self.statusBar().addPermanentWidget(self.progress)
+        self.statusBar().addPermanentWidget(self.cancel_button)
+        self.progress.hide()
+        self.cancel_button.hide()
+
         # connections
         self.graph.pointSelected.connect(self._on_point_selected)
+        self.image_viewer.planeRequested.connect(self._on_plane_requested)
+        self.image_viewer.playToggled.connect(self._on_play_toggled)
 
     def _on_open(self):
+        if self._thread is not None:
+            return
         folder_path = QFileDialog.getExistingDirectory(self, "Select Folder")
 
         if folder_path:
-            self._files.clear()
-
-            nd2_processor = ND2ImageProcessor()
-            csv_file = folder_path.split("/")[-1]
-            nd2_processor.process_folder(
-                folder_path=folder_path,
-                output_csv=f"{folder_path}/{csv_file}_features.csv",
-            )
-            feature_pca = FeaturePCA()
-            feature_pca.set_data(nd2_processor.df)
-            self.feature_pca_df = feature_pca.combine_pcas()
-            self.graph.set_dataframe(self.feature_pca_df)
-
-            metadata = Metadata()
-            metadata.process_folder(
-                folder_path=folder_path,
-                output_csv=f"{folder_path}/{csv_file}_metadata.csv",
-            )
-            metadata_analysis = MetadataAnalysis()
-            metadata_analysis.set_data(metadata.df)
-            self.metadata_analysis_list = metadata_analysis.generate_report()
-            self.metadata_summary.setText(self.metadata_analysis_list)
+            self._stop_playback()
+            self._current = None
+            self.plane_cache.clear()
+
+            # the analysis runs in a thread, the window stays responsive and
+            # shows the files analysed so far
+            self._worker = AnalysisWorker(folder_path, workers=os.cpu_count() or 1)
+            self._thread = QThread(self)
+            self._worker.moveToThread(self._thread)
+            self._thread.started.connect(self._worker.run)
+            self._failed_files = []
+            self._worker.fileProcessed.connect(self._on_file_processed)
+            self._worker.fileFailed.connect(self._on_file_failed)
+            self._worker.previewReady.connect(self._on_preview)
+            self._worker.metadataStarted.connect(self._on_metadata_started)
+            self._worker.finished.connect(self._on_analysis_finished)
+            self._worker.failed.connect(self._on_analysis_failed)
+
+            self.opened.setEnabled(False)
+            self.open_csv.setEnabled(False)
+            self.progress.setRange(0, 0)
+            self.progress.show()
+            self.cancel_button.setEnabled(True)
+            self.cancel_button.show()
+            self.statusBar().showMessage(f"Analysing {folder_path}...")
+            self._thread.start()
+
+    def _on_file_processed(self, done: int, total: int) -> None:
+        self.progress.setRange(0, total)
+        self.progress.setValue(done)
+
+    def _on_file_failed(self, file_path: str) -> None:
+        """Keeps the files that could not be analysed, listed when the analysis ends."""
+        self._failed_files.append(file_path)
+
+    def _on_preview(self, feature_pca_df: pd.DataFrame) -> None:
+        """Plots the PCA table of the planes analysed so far, computed by the worker."""
+        self.feature_pca_df = feature_pca_df
+        self.similarity = None
+        self.graph.set_dataframe(feature_pca_df)
+
+    def _on_metadata_started(self) -> None:
+        self.cancel_button.setEnabled(False)
+        self.statusBar().showMessage("Reading metadata...")
+
+    def _on_analysis_finished(self, features: pd.DataFrame, metadata_df: pd.DataFrame,
+                              cancelled: bool) -> None:
+        worker = self._worker
+        self._stop_analysis()
+        if self._failed_files:
+            QMessageBox.warning(self, "Some files failed",
+                                f"{len(self._failed_files)} files could not be analysed and are left out:\n"
+                                + "\n".join(self._failed_files))
+        if features.empty:
+            if self._failed_files:
+                self.statusBar().showMessage("No file could be analysed.", 5000)
+            elif cancelled:
+                self.statusBar().showMessage("Analysis cancelled, no file analysed.", 5000)
+            else:
+                self.statusBar().showMessage("No ND2 file found in the folder.", 5000)
+            return
+        self._set_features(features, worker.output_path("similarity", ".npz"))
+
+        metadata_analysis = MetadataAnalysis()
+        metadata_analysis.set_data(metadata_df)
+        self.metadata_analysis_list = metadata_analysis.generate_report()
+        self.metadata_summary.setText(self.metadata_analysis_list)
+        n_files = features["file_path"].nunique()
+        if cancelled:
+            self.statusBar().showMessage(f"Analysis cancelled, showing the {n_files} files analysed.")
+        else:
+            self.statusBar().showMessage(f"Analysed {n_files} files.", 5000)
+
+    def _on_analysis_failed(self, message: str) -> None:
+        self._stop_analysis()
+        self.statusBar().clearMessage()
+        QMessageBox.warning(self, "Analysis failed", message)
+
+    def _on_cancel(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            self.cancel_button.setEnabled(False)
+            self.statusBar().showMessage("Cancelling after the files in progress...")
+
+    def _stop_analysis(self) -> None:
+        """Ends the analysis thread and restores the controls."""
+        if self._thread is not None:
+            self._thread.quit()
+            self._thread.wait()
+            self._worker.deleteLater()
+            self._thread.deleteLater()
+        self._thread = None
+        self._worker = None
+        self.progress.hide()
+        self.cancel_button.hide()
+        self.opened.setEnabled(True)
+        self.open_csv.setEnabled(True)
+
+    def closeEvent(self, event) -> None:
+        self._stop_playback()
+        self.prefetcher.close()
+        # let the files in progress finish rather than killing the worker processes
+        if self._worker is not None:
+            self._worker.cancel()
+            self._thread.quit()
+            self._thread.wait()
+        super().closeEvent(event)
 
     def _on_open_csv(self):
         load_csv = LoadCSVWidget()
         if load_csv.exec_():
-            self._files.clear()
+            self._stop_playback()
+            self._current = None
+            self.plane_cache.clear()
             csv_path, meta_path = load_csv.value()
             if not csv_path or not meta_path:
                 raise ValueError("Both CSV and Metadata CSV paths are required.")
 
-            feature_pca = FeaturePCA()
-            feature_pca.set_data(pd.read_csv(csv_path))
-            self.feature_pca_df = feature_pca.combine_pcas()
-            self.graph.set_dataframe(self.feature_pca_df)
+            similarity_path = csv_path.replace("_features.csv", "_similarity.npz")
+            self._set_features(pd.read_csv(csv_path), similarity_path if similarity_path != csv_path else None)
 
             metadata_analysis = MetadataAnalysis()
             metadata_analysis.set_data(pd.read_csv(meta_path))
             self.metadata_analysis_list = metadata_analysis.generate_report()
             self.metadata_summary.setText(self.metadata_analysis_list)
 
+    def _set_features(self, features_df: pd.DataFrame, similarity_path: str | None = None) -> None:
+        """
+        Plots the PCA of the features, coloured by the outlier score of each plane,
+        and indexes the planes to find the ones similar to a selected plane. The
+        index is loaded from ``similarity_path`` when it exists and matches the
+        features, else it is built and saved there.
+        """
+        feature_pca, self.feature_pca_df = score_features(features_df)
+
+        self.similarity = None
+        if similarity_path and os.path.exists(similarity_path):
+            self.similarity = SimilarityIndex.load(similarity_path)
+            if len(self.similarity) != len(features_df):
+                self.similarity = None
+        if self.similarity is None:
+            self.similarity = SimilarityIndex().fit(features_df, feature_pca)
+            if similarity_path:
+                self.similarity.save(similarity_path)
+        self.graph.set_dataframe(self.feature_pca_df)
+
     def _on_point_selected(self, args: None | int | str) -> None:
+        self._stop_playback()
         if args is None:
+            self._current = None
             self.image_viewer.clear()
             return
         path, c, z, t = args
 
-        if path in self._files:
-            image = self._files[path].isel(C=c, Z=z, T=t).to_numpy()
-        else:
-            print(f"Loading {path}...")
-            _file = BioImage(path, reader=bioio_nd2.Reader)
-            self._files[path] = _file.xarray_data
-            image = _file.xarray_data.isel(C=c, Z=z, T=t).to_numpy()
-        self.image_viewer.setData(image)
-        self.image_viewer.ndv_file = (self._files[path], c, z, t)
+        image = self._show_plane(path, c, z, t)
+        self._show_similar(path, c, z, t)
         print(
-            f"-----------\nfile_shape: {self._files[path].shape},\n"
+            f"-----------\nfile_shape: {self.plane_cache.lazy_array(path).shape},\n"
             f"C: {c}, Z: {z}, T: {t},\nimage shape: {image.shape},\n"
             f"path: {path}\n-----------"
         )
+
+    def _show_plane(self, path: str, c: int, z: int, t: int):
+        """Shows a plane and starts decoding its neighbours along T and Z."""
+        # only the plane is decoded, ndv gets the lazy array of the file
+        image = self.plane_cache.get(path, c, z, t)
+        lazy_array = self.plane_cache.lazy_array(path)
+        self.image_viewer.setData(image)
+        self.image_viewer.ndv_file = (lazy_array, c, z, t)
+        self.image_viewer.setPosition(z, t, lazy_array.sizes["Z"], lazy_array.sizes["T"])
+        self._current = (path, c, z, t)
+        self.prefetcher.prefetch(path, c, z, t)
+        return image
+
+    def _on_plane_requested(self, z: int, t: int) -> None:
+        """Steps to another Z or T of the file and channel shown."""
+        self._stop_playback()
+        if self._current is not None:
+            path, c, _, _ = self._current
+            self._show_plane(path, c, z, t)
+
+    def _on_play_toggled(self, playing: bool) -> None:
+        if not playing:
+            self._stop_playback()
+            return
+        if self._current is None:
+            self.image_viewer.setPlaying(False)
+            return
+        path, c, z, t = self._current
+        self._playback = playback(self.plane_cache, path, c, z, start=t + 1)
+        self._playback_frames = iter(self._playback)
+        self._play_timer.start()
+
+    def _on_play_tick(self) -> None:
+        """Shows the next frame of the playback, or keeps the current one until it is decoded."""
+        if self._playback is None or not self._playback.ready:
+            return
+        try:
+            t, frame = next(self._playback_frames)
+        except StopIteration:
+            self._stop_playback()
+            return
+        except Exception as e:  # a frame could not be read, e.g. a truncated file
+            self._stop_playback()
+            self.statusBar().showMessage(f"Playback stopped: {type(e).__name__}: {e}", 5000)
+            return
+        path, c, z, _ = self._current
+        lazy_array = self.plane_cache.lazy_array(path)
+        self.image_viewer.setFrame(frame)
+        self.image_viewer.setPosition(z, t, lazy_array.sizes["Z"], lazy_array.sizes["T"])
+        self.image_viewer.ndv_file = (lazy_array, c, z, t)
+        self._current = (path, c, z, t)
+
+    def _stop_playback(self) -> None:
+        """Stops the playback, staying on the frame shown. The reader thread is not
+        waited for, it ends once the frame it is decoding is read."""
+        self._play_timer.stop()
+        if self._playback is not None:
+            self._playback.stop()
+            self._playback = None
+            self._playback_frames = None
+            if self._current is not None:
+                self.prefetcher.prefetch(*self._current)
+        self.image_viewer.setPlaying(False)
+
+    def _show_similar(self, path: str, c: int, z: int, t: int) -> None:
+        """Highlights the planes most similar to the selected one and logs them."""
+        if self.similarity is None:
+            return
+        position = self.similarity.position_of(path, c, z, t)
+        if position is None:
+            return
+        similar = self.similarity.neighbors(position, k=N_SIMILAR)
+        self.graph.highlight_similar(similar["position"].to_numpy())
+        logger.debug(f"Most similar planes:\n{similar.to_string(index=False)}")
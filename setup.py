@@ -0,0 +1,43 @@
+from setuptools import find_packages, setup
+
+setup(
+    name="biaqc",
+    version="0.1.0",
+    description="Automatic quality control for bioimage analysis.",
+    long_description=open("README.md").read(),
+    long_description_content_type="text/markdown",
+    license="MIT",
+    packages=find_packages(include=["biaqc", "biaqc.*", "gui", "gui.*"]),
+    python_requires=">=3.10",
+    install_requires=[
+        "numpy>=2.0",
+        "pandas",
+        "scipy",
+        "scikit-learn",
+        "scikit-image",
+        "PyWavelets",
+        "opencv-python",
+        "tifffile",
+        "imagecodecs",
+        "bioio",
+        "bioio-nd2",
+        "tqdm",
+        "threadpoolctl",
+    ],
+    extras_require={
+        "parquet": ["pyarrow"],
+        "gui": [
+            "qtpy",
+            "matplotlib",
+            "superqt",
+            "fonticon-materialdesignicons6",
+            "vispy",
+            "ndv",
+        ],
+    },
+    entry_points={
+        "console_scripts": [
+            "biaqc=biaqc.cli:main",
+        ],
+    },
+)
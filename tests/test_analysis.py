@@ -0,0 +1,177 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from biaqc.analysis import GROUP_COLUMNS, FeaturePCA, IncrementalFeaturePCA, MetadataAnalysis
+from biaqc.file_operations import RunStore, read_table, write_table
+
+
+def make_features(n=300, seed=0):
+    rng = np.random.default_rng(seed)
+    columns = [col for group in GROUP_COLUMNS.values() for col in group]
+    df = pd.DataFrame(rng.normal(size=(n, len(columns))), columns=columns)
+    df.insert(0, 'file_path', [f'/data/f{i % 3}.nd2' for i in range(n)])
+    df.insert(1, 'image_name', [f'f{i % 3}' for i in range(n)])
+    df.insert(2, 'extension', 'nd2')
+    df.insert(3, 'T', np.arange(n) // 6)
+    df.insert(4, 'C', np.arange(n) % 2)
+    df.insert(5, 'Z', 0)
+    df['histogram'] = [np.zeros(4, dtype=int)] * n
+    return df
+
+
+def make_metadata(n_files=3, size_t=5, size_c=2):
+    rows = []
+    for f in range(n_files):
+        for t in range(size_t):
+            for c in range(size_c):
+                rows.append({
+                    'file_path': f'/data/run{f % 2}/img{f}.nd2', 'image_name': f'img{f}', 'extension': 'nd2',
+                    'instrument_model': 'Camera A' if f < 2 else 'Camera B',
+                    'objective_lens_na': 0.75, 'objective_nominal_magnification': 20.0,
+                    'significant_bits': 12, 'size_x': 512, 'size_y': 512, 'size_z': 1,
+                    'size_c': size_c, 'size_t': size_t, 'physical_size_x': 0.325, 'physical_size_y': np.nan,
+                    'the_c': c, 'the_t': t, 'the_z': 0,
+                    'delta_t': 120.0 * t + 0.5 * c + f, 'delta_t_unit': 'UnitsTime.SECOND',
+                })
+    return pd.DataFrame(rows)
+
+
+class TestFeaturePCA(unittest.TestCase):
+    def test_combine_pcas_columns(self):
+        feature_pca = FeaturePCA()
+        feature_pca.set_data(make_features())
+        combined = feature_pca.combine_pcas()
+        self.assertEqual(
+            list(combined.columns[7:]),
+            ['intensity_pca_1', 'intensity_pca_2', 'texture_pca_1', 'texture_pca_2',
+             'noise_noise_level', 'noise_snr', 'sharpness_pca_1', 'sharpness_pca_2',
+             'all_pca_1', 'all_pca_2'],
+        )
+        self.assertEqual(combined['intensity_pca_1'].dtype, np.float32)
+        np.testing.assert_array_equal(combined['noise_snr'], make_features()['snr'].astype(np.float32))
+
+    def test_large_units_do_not_dominate(self):
+        df = make_features()
+        scaled = df.copy()
+        scaled['variance'] *= 1e6
+        scaled.loc[3, 'entropy'] = np.nan
+
+        results = []
+        for data in (df, scaled):
+            feature_pca = FeaturePCA()
+            feature_pca.set_data(data)
+            results.append(feature_pca.combine_pcas())
+
+        self.assertFalse(results[1][['intensity_pca_1', 'all_pca_1']].isna().any().any())
+        corr = np.corrcoef(results[0]['all_pca_1'], results[1]['all_pca_1'])[0, 1]
+        self.assertGreater(abs(corr), 0.99)
+
+    def test_large_solver_matches_full(self):
+        df = make_features(n=2000)
+        full, large = FeaturePCA(), FeaturePCA(large_min_samples=100)
+        full.set_data(df)
+        large.set_data(df)
+        np.testing.assert_allclose(
+            np.abs(full.combine_pcas()['all_pca_1']), np.abs(large.combine_pcas()['all_pca_1']), atol=1e-3
+        )
+
+    def test_skips_missing_groups(self):
+        df = make_features().drop(columns=GROUP_COLUMNS['texture'])
+        feature_pca = FeaturePCA()
+        feature_pca.set_data(df)
+        combined = feature_pca.combine_pcas()
+        self.assertNotIn('texture_pca_1', combined.columns)
+        self.assertIn('all_pca_1', combined.columns)
+
+
+class TestIncrementalFeaturePCA(unittest.TestCase):
+    def test_matches_in_memory_pca(self):
+        df = make_features(n=1000).drop(columns='histogram')
+        # a dominant direction, so that the first components are well defined
+        columns = [col for group in GROUP_COLUMNS.values() for col in group]
+        latent = np.random.default_rng(1).normal(size=(len(df), 1))
+        df[columns] += 3 * latent * np.linspace(1, 2, len(columns))
+        df.loc[5, 'entropy'] = np.nan
+        feature_pca = FeaturePCA()
+        feature_pca.set_data(df)
+        expected = feature_pca.combine_pcas()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            for ext in ('.csv', '.parquet'):
+                table = os.path.join(tmp, 'features' + ext)
+                write_table(df, table)
+                incremental = IncrementalFeaturePCA(chunk_size=128)
+                result = read_table(incremental.fit_transform(table, os.path.join(tmp, 'pca' + ext)))
+
+                self.assertEqual(list(result.columns), list(expected.columns))
+                self.assertEqual(incremental.n_samples, len(df))
+                np.testing.assert_allclose(incremental.mean, feature_pca.mean, rtol=1e-5, atol=1e-6)
+                np.testing.assert_allclose(incremental.scale, feature_pca.scale, rtol=1e-4)
+                for col in ('intensity_pca_1', 'all_pca_1'):
+                    corr = np.corrcoef(result[col], expected[col])[0, 1]
+                    self.assertGreater(abs(corr), 0.99)
+
+    def test_reads_run_store(self):
+        df = make_features(n=200).drop(columns='histogram')
+        with tempfile.TemporaryDirectory() as tmp:
+            store = RunStore(tmp, 'run')
+            for start in range(0, len(df), 50):
+                store.append('features', df.iloc[start:start + 50].to_dict('records'))
+            out = IncrementalFeaturePCA(chunk_size=64).fit_transform(store, os.path.join(tmp, 'pca.csv'))
+            result = read_table(out)
+        self.assertEqual(len(result), len(df))
+        self.assertEqual(list(result['file_path']), list(df['file_path']))
+
+
+class TestMetadataAnalysis(unittest.TestCase):
+    def test_report(self):
+        metadata_analysis = MetadataAnalysis()
+        metadata_analysis.set_data(make_metadata())
+        report = metadata_analysis.generate_report()
+        self.assertEqual(report[0], "[v] All images are of nd2 type.")
+        self.assertEqual(report[1], "[x] More than one instrument found. "
+                                    "Found instruments are ['Camera A' 'Camera B'].")
+        self.assertEqual(report[5], "[?] Time series data with 5 frames per image.")
+        self.assertEqual(report[7], "[v] Multi-channel image with 2 channels per image.")
+        self.assertEqual(report[-1], "[v] Time between frames: 2.0 +/- 0.0 minutes.")
+        # the report is cached and does not change the data
+        self.assertEqual(metadata_analysis.generate_report(), report)
+        self.assertNotIn('delta_time', metadata_analysis.metadata.columns)
+
+    def test_summary_matches_unique(self):
+        df = make_metadata(n_files=6)
+        df.loc[df['image_name'] == 'img3', 'size_x'] = 1024
+        metadata_analysis = MetadataAnalysis()
+        metadata_analysis.set_data(df)
+        summary = metadata_analysis.summary()['all']
+        for col in ('instrument_model', 'size_x', 'physical_size_y'):
+            self.assertEqual(summary[col][0], df[col].nunique())
+            np.testing.assert_array_equal(summary[col][1], pd.unique(df[col].to_numpy()))
+
+    def test_report_per_group(self):
+        metadata_analysis = MetadataAnalysis()
+        metadata_analysis.set_data(make_metadata())
+        by_instrument = metadata_analysis.generate_report(by='instrument_model')
+        self.assertEqual(list(by_instrument), ['Camera A', 'Camera B'])
+        self.assertEqual(by_instrument['Camera B'][1], "[v] All images are acquired using Camera B.")
+
+        by_folder = metadata_analysis.generate_report(by='folder')
+        self.assertEqual(list(by_folder), ['/data/run0', '/data/run1'])
+        self.assertEqual(by_folder['/data/run1'][1], "[v] All images are acquired using Camera A.")
+
+    def test_report_on_empty_table(self):
+        metadata_analysis = MetadataAnalysis()
+        metadata_analysis.set_data(make_metadata().iloc[:0])
+        report = metadata_analysis.generate_report()
+        self.assertEqual(report[0], "[x] Could not find the image type.")
+        self.assertEqual(report[-1], "[x] Could not find time delta.")
+        self.assertEqual(metadata_analysis.get_instrument(), "[x] Could not find the instrument name.")
+        self.assertEqual(metadata_analysis.generate_report(by='folder'), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
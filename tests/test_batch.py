@@ -0,0 +1,108 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from biaqc.batch import merge_shards, output_paths, parse_shard, partition_files, run_batch
+from biaqc.file_operations import read_table
+from biaqc.histograms import HistogramAggregator
+from biaqc.illumination import PixelAccumulator
+from biaqc.metadata import Metadata
+from test_utils import ArrayProcessor, write_test_folder
+
+
+class ArrayMetadata(Metadata):
+    """Describes the .npy arrays written by write_test_folder instead of reading ND2 metadata."""
+
+    def get_nd2_metadata(self):
+        size_t, size_c, size_z, size_y, size_x = np.load(self.file_path, mmap_mode='r').shape
+        return [
+            {'file_path': self.file_path, 'image_name': self.image_name, 'extension': 'nd2',
+             'instrument_model': 'Camera A', 'significant_bits': 12, 'size_x': size_x, 'size_y': size_y,
+             'size_z': size_z, 'size_c': size_c, 'size_t': size_t, 'the_c': c, 'the_t': t, 'the_z': z,
+             'delta_t': 60.0 * t}
+            for t in range(size_t) for c in range(size_c) for z in range(size_z)
+        ]
+
+
+class TestSharding(unittest.TestCase):
+    def test_parse_shard(self):
+        self.assertEqual(parse_shard("2/8"), (2, 8))
+        with self.assertRaises(ValueError):
+            parse_shard("8/8")
+        with self.assertRaises(ValueError):
+            parse_shard("1-8")
+
+    def test_partition_is_balanced_and_complete(self):
+        files = [f"f{i}.nd2" for i in range(10)]
+        weights = [100, 1, 1, 1, 1, 50, 50, 1, 1, 1]
+        shards = partition_files(files, 3, weights)
+
+        self.assertEqual(sorted(f for shard in shards for f in shard), sorted(files))
+        self.assertEqual(shards[0], ["f0.nd2"])
+        loads = [sum(weights[files.index(f)] for f in shard) for shard in shards]
+        self.assertLessEqual(max(loads[1:]) - min(loads[1:]), 1)
+        # each shard keeps the input order
+        for shard in shards:
+            self.assertEqual(shard, sorted(shard, key=files.index))
+
+    def test_partition_is_deterministic(self):
+        files = [f"f{i}.nd2" for i in range(20)]
+        weights = [i % 4 for i in range(20)]
+        self.assertEqual(partition_files(files, 4, weights), partition_files(list(files), 4, list(weights)))
+
+    def test_shard_output_paths(self):
+        paths = output_paths("out", "run", (3, 12))
+        self.assertEqual(paths["features"], "out/run_features.shard-03-of-12.csv")
+
+
+@mock.patch('biaqc.batch.Metadata', ArrayMetadata)
+@mock.patch('biaqc.batch.ND2ImageProcessor', ArrayProcessor)
+class TestMergeShards(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.folder = os.path.join(self.tmp.name, 'run')
+        os.makedirs(self.folder)
+        write_test_folder(self.folder, n_files=5, shape=(2, 2, 1, 32, 32))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_merged_shards_match_single_run(self):
+        options = dict(features=['intensity', 'noise'], pixel_statistics=True)
+        single = run_batch(self.folder, os.path.join(self.tmp.name, 'single'), **options)
+        sharded_dir = os.path.join(self.tmp.name, 'sharded')
+        for index in range(2):
+            run_batch(self.folder, sharded_dir, shard=(index, 2), **options)
+        merged = merge_shards(sharded_dir, 'run')
+
+        # the shards hold interleaved files, which the merge puts back in path order
+        shard_paths = pd.concat([read_table(output_paths(sharded_dir, 'run', (index, 2))['features'])
+                                 for index in range(2)])['file_path']
+        self.assertFalse(shard_paths.is_monotonic_increasing)
+        for kind in ('features', 'metadata', 'histograms', 'illumination'):
+            expected, actual = read_table(single[kind]), read_table(merged[kind])
+            pd.testing.assert_frame_equal(actual, expected, check_exact=False, rtol=1e-5)
+        self.assertTrue(read_table(merged['features'])['file_path'].is_monotonic_increasing)
+
+        expected, actual = (HistogramAggregator.load(single['histogram_counts']),
+                            HistogramAggregator.load(merged['histogram_counts']))
+        self.assertEqual(actual.n_planes, expected.n_planes)
+        for key, counts in expected.files.items():
+            np.testing.assert_array_equal(actual.files[key], counts)
+
+        expected, actual = (PixelAccumulator.load(single['pixel_statistics']),
+                            PixelAccumulator.load(merged['pixel_statistics']))
+        self.assertEqual(sorted(actual.channels), sorted(expected.channels))
+        for channel, state in expected.channels.items():
+            self.assertEqual(actual.channels[channel].count, state.count)
+            np.testing.assert_allclose(actual.channels[channel].mean, state.mean, rtol=1e-5)
+            np.testing.assert_allclose(actual.channels[channel].m2, state.m2, rtol=1e-4)
+            np.testing.assert_array_equal(actual.channels[channel].saturated, state.saturated)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import subprocess
+import sys
+import unittest
+
+from biaqc.cli import build_parser
+
+
+class TestCLI(unittest.TestCase):
+    def test_run_arguments(self):
+        args = build_parser().parse_args(
+            ['run', 'data', '--out', 'results', '--workers', '4',
+             '--features', 'intensity,sharpness', '--format', 'parquet']
+        )
+        self.assertEqual(args.features, ['intensity', 'sharpness'])
+        self.assertEqual(args.format, 'parquet')
+        self.assertEqual(args.workers, 4)
+
+    def test_rejects_unknown_features(self):
+        with self.assertRaises(SystemExit):
+            build_parser().parse_args(['run', 'data', '--out', 'results', '--features', 'color'])
+
+    def test_does_not_import_gui_modules(self):
+        code = (
+            "import sys, biaqc.cli; "
+            "print(','.join(m for m in sys.modules "
+            "if m.split('.')[0] in ('qtpy', 'PyQt5', 'PyQt6', 'PySide6', 'vispy', 'matplotlib', 'ndv')))"
+        )
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+        self.assertEqual(out.stdout.strip(), '')
+
+    def test_heavy_dependencies_are_imported_lazily(self):
+        code = (
+            "import sys, biaqc.cli; "
+            "print(','.join(m for m in sys.modules "
+            "if m.split('.')[0] in ('cv2', 'skimage', 'scipy', 'sklearn', 'pandas', 'bioio', 'tifffile')))"
+        )
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+        self.assertEqual(out.stdout.strip(), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
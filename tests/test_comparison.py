@@ -0,0 +1,93 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from biaqc.comparison import COMPARISON_COLUMNS, DistributionComparison, _two_sample_stats
+from biaqc.file_operations import read_table, write_table
+from test_image_analysis import make_features
+
+
+def make_histograms(n, shift, seed):
+    rng = np.random.default_rng(seed)
+    values = rng.normal(1000 + shift, 200, size=(n, 500)).clip(0, 4095).astype(int)
+    return [np.bincount(row, minlength=4096) for row in values]
+
+
+class TestTwoSampleStats(unittest.TestCase):
+    def test_matches_scipy(self):
+        rng = np.random.default_rng(0)
+        # rounded values, so that the samples have ties, and missing values
+        a = np.round(rng.normal(size=(300, 4)), 1)
+        b = np.round(rng.normal(0.3, 1.5, size=(200, 4)), 1)
+        a[::7, 1] = np.nan
+        b[::5, 2] = np.nan
+
+        result = _two_sample_stats(a, b)
+
+        for j in range(4):
+            x, y = a[:, j][~np.isnan(a[:, j])], b[:, j][~np.isnan(b[:, j])]
+            self.assertAlmostEqual(result['ks_statistic'][j], stats.ks_2samp(x, y).statistic)
+            self.assertAlmostEqual(result['wasserstein'][j], stats.wasserstein_distance(x, y))
+            self.assertEqual(result['n_reference'][j], len(x))
+            self.assertEqual(result['n_test'][j], len(y))
+
+
+class TestDistributionComparison(unittest.TestCase):
+    def test_ranks_drifted_feature_first(self):
+        reference = make_features(seed=0)
+        test = make_features(seed=1)
+        # channel 1 of the test run is out of focus
+        test.loc[test['C'] == 1, 'laplacian'] -= 1.5
+
+        comparison = DistributionComparison().compare(test, reference)
+
+        self.assertEqual(list(comparison.columns), ['feature', 'C', *COMPARISON_COLUMNS])
+        self.assertEqual(len(comparison), 2 * (test.shape[1] - 4))
+        self.assertEqual((comparison.loc[0, 'feature'], comparison.loc[0, 'C']), ('laplacian', 1))
+        self.assertEqual(comparison['drifted'].sum(), 1)
+        self.assertAlmostEqual(comparison.loc[0, 'effect_size'], -1.5, delta=0.3)
+
+    def test_same_run_does_not_drift(self):
+        features = make_features()
+        comparison = DistributionComparison().compare(features, features)
+        self.assertFalse(comparison['drifted'].any())
+        np.testing.assert_array_equal(comparison['ks_statistic'], 0)
+
+    def test_histogram_divergences(self):
+        reference = pd.DataFrame({'C': [0] * 4 + [1] * 4, 'histogram': make_histograms(8, 0, 0)})
+        test = pd.DataFrame({'C': [0] * 4 + [1] * 4,
+                             'histogram': make_histograms(4, 0, 1) + make_histograms(4, 400, 2)})
+        # histograms read back from the CSV tables of older versions, which are shortened, are skipped
+        test.loc[8] = [1, '[0 0 0 ... 0 0 0]']
+
+        comparison = DistributionComparison().compare_histograms(test, reference)
+
+        self.assertEqual(comparison['C'].tolist(), [1, 0])
+        self.assertEqual(comparison['n_test'].tolist(), [4, 4])
+        self.assertGreater(comparison.loc[0, 'js_divergence'], 0.3)
+        self.assertLess(comparison.loc[1, 'js_divergence'], 0.05)
+        # the mean moved by 400 of 4096 intensity levels
+        self.assertAlmostEqual(comparison.loc[0, 'wasserstein'], 400 / 4096, delta=0.01)
+
+    def test_histograms_round_trip_through_csv(self):
+        reference = pd.DataFrame({'C': [0] * 4, 'histogram': make_histograms(4, 0, 0)})
+        test = pd.DataFrame({'C': [0] * 4, 'histogram': make_histograms(4, 400, 1)})
+        expected = DistributionComparison().compare_histograms(test, reference)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            for name, df in (('reference', reference), ('test', test)):
+                write_table(df, os.path.join(tmp, f'{name}.csv'))
+            reference = read_table(os.path.join(tmp, 'reference.csv'))
+            test = read_table(os.path.join(tmp, 'test.csv'))
+        comparison = DistributionComparison().compare_histograms(test, reference)
+
+        self.assertEqual(comparison['n_test'].tolist(), [4])
+        pd.testing.assert_frame_equal(comparison, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+from scipy import ndimage
+
+from biaqc.duplicates import HashIndex, find_duplicates, hamming_distance
+from biaqc.feature_extraction import PerceptualHash
+
+
+def plane_hash(plane):
+    perceptual_hash = PerceptualHash()
+    perceptual_hash.set_image(plane)
+    return perceptual_hash.dct_hash()
+
+
+class TestPerceptualHash(unittest.TestCase):
+    def test_same_field_hashes_close(self):
+        rng = np.random.default_rng(0)
+        field = ndimage.gaussian_filter(rng.random((128, 128)), 4) * 4000
+        other = ndimage.gaussian_filter(rng.random((128, 128)), 4) * 4000
+        noisy = field * 1.05 + rng.normal(0, 5, field.shape)
+
+        self.assertLessEqual(hamming_distance(np.int64(plane_hash(field)), np.int64(plane_hash(noisy))), 4)
+        self.assertGreater(hamming_distance(np.int64(plane_hash(field)), np.int64(plane_hash(other))), 10)
+
+    def test_hash_size_is_64_bits(self):
+        with self.assertRaises(ValueError):
+            PerceptualHash(hash_size=16)
+
+
+class TestHashIndex(unittest.TestCase):
+    def test_pairs_match_brute_force(self):
+        rng = np.random.default_rng(1)
+        hashes = rng.integers(np.iinfo(np.int64).min, np.iinfo(np.int64).max, size=400, dtype=np.int64)
+        # near copies with 1 to 5 flipped bits
+        for i in range(0, 100, 2):
+            flipped = rng.choice(64, size=i % 5 + 1, replace=False)
+            hashes[i + 1] = hashes[i] ^ np.bitwise_or.reduce(np.uint64(1) << flipped.astype(np.uint64)).view(np.int64)
+
+        first, second, distance = HashIndex(hashes, max_distance=4).pairs()
+
+        all_distances = hamming_distance(hashes[:, None], hashes[None, :])
+        expected = {(i, j) for i, j in zip(*np.nonzero(all_distances <= 4)) if i < j}
+        self.assertEqual(set(zip(first.tolist(), second.tolist())), expected)
+        np.testing.assert_array_equal(distance, all_distances[first, second])
+
+    def test_query(self):
+        hashes = np.array([0, 0b111, 0b1111111, -1], dtype=np.int64)
+        positions, distance = HashIndex(hashes, max_distance=3).query(0)
+        np.testing.assert_array_equal(positions, [0, 1])
+        np.testing.assert_array_equal(distance, [0, 3])
+
+
+class TestFindDuplicates(unittest.TestCase):
+    def test_duplicates_and_frozen_frames(self):
+        rng = np.random.default_rng(2)
+        features = pd.DataFrame({
+            'file_path': np.repeat(['a.nd2', 'b.nd2', 'c.nd2'], 10),
+            'T': np.tile(np.arange(10), 3),
+            'C': 0,
+            'Z': 0,
+            'phash': rng.integers(np.iinfo(np.int64).min, np.iinfo(np.int64).max, size=30, dtype=np.int64),
+            'plane_checksum': rng.integers(0, 2**32, size=30),
+        })
+        # a camera repeating timepoint 3 of a.nd2, and c.nd2 re-acquiring a field of b.nd2
+        features.loc[4, ['phash', 'plane_checksum']] = features.loc[3, ['phash', 'plane_checksum']]
+        features.loc[25, 'phash'] = features.loc[12, 'phash'] ^ 0b101
+
+        result = find_duplicates(features)
+
+        self.assertEqual(result.index[result['frozen_frame']].tolist(), [4])
+        grouped = result.index[result['duplicate_group'] >= 0].tolist()
+        self.assertEqual(grouped, [12, 25])
+        self.assertEqual(result.loc[12, 'group_files'], 2)
+        # the repeated frame stays within one series
+        self.assertEqual(result.loc[3, 'duplicate_group'], -1)
+
+    def test_noisy_frames_of_static_scene_are_not_frozen(self):
+        rng = np.random.default_rng(3)
+        scene = ndimage.gaussian_filter(rng.random((128, 128)), 4) * 4000
+        planes = [rng.poisson(scene).astype(np.uint16) for _ in range(10)]
+        # the camera repeats timepoint 6
+        planes[7] = planes[6].copy()
+        rows = []
+        for t, plane in enumerate(planes):
+            perceptual_hash = PerceptualHash()
+            perceptual_hash.set_image(plane)
+            rows.append({'file_path': 'a.nd2', 'T': t, 'C': 0, 'Z': 0, **perceptual_hash.extract_all_features()})
+        features = pd.DataFrame(rows)
+
+        # the noise barely changes the perceptual hash, only the checksum
+        self.assertGreater((features['phash'].diff() == 0).sum(), 3)
+        result = find_duplicates(features)
+        self.assertEqual(result.index[result['frozen_frame']].tolist(), [7])
+
+    def test_requires_hash_column(self):
+        with self.assertRaises(ValueError):
+            find_duplicates(pd.DataFrame({'T': [0, 1]}))
+
+
+if __name__ == '__main__':
+    unittest.main()
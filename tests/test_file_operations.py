@@ -0,0 +1,99 @@
+import json
+import tempfile
+import time
+import unittest
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from biaqc.file_operations import PlanePrefetcher, RunStore, TableWriter, iter_table
+
+
+def slow_source(n, delay=0.0):
+    for i in range(n):
+        time.sleep(delay)
+        yield i
+
+
+class TestPlanePrefetcher(unittest.TestCase):
+    def test_preserves_order(self):
+        prefetcher = PlanePrefetcher(slow_source(20), depth=3)
+        self.assertEqual(list(prefetcher), list(range(20)))
+        self.assertEqual(prefetcher.stats['planes'], 20)
+
+    def test_reports_compute_stall_when_reader_is_slow(self):
+        prefetcher = PlanePrefetcher(slow_source(5, delay=0.02), depth=2)
+        list(prefetcher)
+        self.assertGreater(prefetcher.stats['compute_stall'], 0.05)
+
+    def test_forwards_reader_errors(self):
+        def failing_source():
+            yield 0
+            raise OSError("read failed")
+
+        with self.assertRaises(OSError):
+            list(PlanePrefetcher(failing_source(), depth=2))
+
+    def test_early_exit_stops_reader(self):
+        prefetcher = PlanePrefetcher(slow_source(1000), depth=2)
+        for i in prefetcher:
+            if i == 3:
+                break
+        prefetcher.close()
+        self.assertFalse(prefetcher._thread.is_alive())
+
+    def test_stop_does_not_wait_for_reader(self):
+        prefetcher = PlanePrefetcher(slow_source(1000, delay=0.5), depth=2)
+        frames = iter(prefetcher)
+        self.assertEqual(next(frames), 0)
+
+        start = time.perf_counter()
+        prefetcher.stop()
+        del frames  # closing the iterator does not wait either
+        self.assertLess(time.perf_counter() - start, 0.2)
+        prefetcher._thread.join(timeout=2)
+        self.assertFalse(prefetcher._thread.is_alive())
+
+
+class TestRunStore(unittest.TestCase):
+    def test_append_aligns_to_header(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            store = RunStore(tmp, 'run')
+            store.append('features', [{'file_path': 'a', 'x': 1}])
+            store.append('features', [{'x': 2, 'file_path': 'b', 'extra': 3}])
+            df = store.read('features')
+            self.assertEqual(list(df.columns), ['file_path', 'x'])
+            self.assertEqual(list(df.x), [1, 2])
+            self.assertEqual(store.stored_files(), {'a', 'b'})
+
+
+class TestChunkedTables(unittest.TestCase):
+    def test_round_trip_in_chunks(self):
+        df = pd.DataFrame({'file_path': [f'f{i}.nd2' for i in range(25)], 'value': range(25)})
+        with tempfile.TemporaryDirectory() as tmp:
+            for ext in ('.csv', '.parquet'):
+                path = os.path.join(tmp, 'table' + ext)
+                with TableWriter(path) as writer:
+                    for start in range(0, len(df), 10):
+                        writer.write(df.iloc[start:start + 10])
+                chunks = list(iter_table(path, chunk_size=7))
+                self.assertEqual([len(chunk) for chunk in chunks], [7, 7, 7, 4])
+                pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), df)
+
+    def test_csv_chunks_keep_arrays_whole(self):
+        histograms = [np.arange(2000) * i for i in range(4)]
+        df = pd.DataFrame({'value': range(4), 'histogram': histograms})
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'table.csv')
+            with TableWriter(path) as writer:
+                writer.write(df.iloc[:2])
+                writer.write(df.iloc[2:])
+            stored = pd.concat(iter_table(path), ignore_index=True)
+        for cell, histogram in zip(stored['histogram'], histograms):
+            np.testing.assert_array_equal(json.loads(cell), histogram)
+
+
+if __name__ == '__main__':
+    unittest.main()
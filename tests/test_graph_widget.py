@@ -0,0 +1,67 @@
+import unittest
+
+import numpy as np
+
+try:
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    from gui._graph_widget import DENSITY_BINS, PICK_RADIUS, _PlotData
+except ImportError:  # the gui extras (matplotlib and a Qt binding) are not installed
+    _PlotData = None
+
+
+def make_plot_data(x, y, scores=None, rows=None):
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    rows = np.arange(len(x)) if rows is None else np.asarray(rows)
+    scores = None if scores is None else np.asarray(scores, dtype=float)
+    return _PlotData(rows, x, y, np.zeros((len(x), 4)), scores)
+
+
+@unittest.skipIf(_PlotData is None, "needs the gui extras")
+class TestPlotData(unittest.TestCase):
+    def setUp(self):
+        figure = Figure(figsize=(4, 4), dpi=100)
+        FigureCanvasAgg(figure)
+        self.ax = figure.add_subplot(1, 1, 1)
+        self.ax.set_xlim(-1, 11)
+        self.ax.set_ylim(-1, 11)
+        figure.canvas.draw()
+
+    def screen(self, x, y):
+        return self.ax.transData.transform((x, y))
+
+    def test_pick_nearest_point_within_radius(self):
+        data = make_plot_data([0, 5, 5.2, 10, np.nan], [0, 5, 5, 10, 5])
+        px, py = self.screen(5, 5)
+        self.assertEqual(data.pick(self.ax, px + 2, py + 1), 1)
+        px, py = self.screen(5.2, 5)
+        self.assertEqual(data.pick(self.ax, px + 1, py), 2)
+        px, py = self.screen(10, 10)
+        self.assertEqual(data.pick(self.ax, px - PICK_RADIUS + 1, py), 3)
+        # too far from any point, and the point without coordinates is never picked
+        self.assertIsNone(data.pick(self.ax, px - PICK_RADIUS - 2, py))
+        self.assertIsNone(data.pick(self.ax, *self.screen(2.5, 7.5)))
+        self.assertIsNone(make_plot_data([], []).pick(self.ax, px, py))
+
+    def test_positions_of_ignores_other_channels(self):
+        # rows of the channel plotted, the others belong to other channels
+        data = make_plot_data([0, 1, 2, 3], [0, 1, 2, 3], rows=[1, 4, 6, 9])
+        np.testing.assert_array_equal(data.positions_of([4, 5, 9, 0, 12]), [1, 3])
+        self.assertEqual(len(data.positions_of([])), 0)
+
+    def test_density_ignores_nan_and_keeps_highest_score(self):
+        x, y = [0, 0.001, 1, np.nan, 0.5], [0, 0.001, 1, 0.5, np.nan]
+        grid, extent = make_plot_data(x, y, scores=[0.5, 1.5, 0.2, 9, 9]).density()
+
+        self.assertEqual(extent, (0, 1, 0, 1))
+        self.assertEqual(grid.shape, (DENSITY_BINS, DENSITY_BINS))
+        self.assertEqual(grid.count(), 2)
+        self.assertEqual(grid[0, 0], 1.5)
+        self.assertAlmostEqual(grid[-1, -1], 0.2)
+
+        counts, _ = make_plot_data(x, y).density()
+        self.assertEqual((counts[0, 0], counts[-1, -1], counts.sum()), (2, 1, 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from biaqc.histograms import HistogramAggregator
+from biaqc.utils import _process_file_in_worker
+from test_utils import ArrayProcessor, write_test_folder
+
+
+class TestHistogramAggregator(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.planes = {
+            ('a.nd2', 0): rng.integers(100, 1000, size=(3, 64, 64)),
+            ('a.nd2', 1): rng.integers(0, 4096, size=(3, 64, 64)),
+            ('b.nd2', 0): rng.integers(500, 4096, size=(2, 64, 64)),
+        }
+        # a few saturated pixels in channel 0 of b.nd2
+        self.planes[('b.nd2', 0)][0, :2] = 4095
+        self.aggregator = HistogramAggregator()
+        for (file_path, channel), planes in self.planes.items():
+            for plane in planes:
+                self.aggregator.add(file_path, channel, np.bincount(plane.ravel(), minlength=4096))
+
+    def test_summary_matches_pixels(self):
+        summary = self.aggregator.summary()
+
+        dataset = summary[summary['level'] == 'dataset'].set_index('C')
+        pixels = np.concatenate([self.planes[('a.nd2', 0)].ravel(), self.planes[('b.nd2', 0)].ravel()])
+        self.assertEqual(dataset.loc[0, 'n_planes'], 5)
+        self.assertEqual(dataset.loc[0, 'n_pixels'], len(pixels))
+        self.assertEqual(dataset.loc[0, 'min'], pixels.min())
+        self.assertEqual(dataset.loc[0, 'max'], 4095)
+        self.assertEqual(dataset.loc[0, 'p50'], np.percentile(pixels, 50, method='inverted_cdf'))
+        self.assertEqual(dataset.loc[0, 'p99'], np.percentile(pixels, 99, method='inverted_cdf'))
+        self.assertAlmostEqual(dataset.loc[0, 'saturated_fraction'], np.mean(pixels == 4095))
+        self.assertEqual(dataset.loc[0, 'display_max'], np.percentile(pixels, 99.9, method='inverted_cdf'))
+
+        files = summary[summary['level'] == 'file']
+        self.assertEqual(len(files), 3)
+        a0 = files[(files['file_path'] == 'a.nd2') & (files['C'] == 0)].iloc[0]
+        self.assertEqual((a0['min'], a0['max']), (self.planes[('a.nd2', 0)].min(), self.planes[('a.nd2', 0)].max()))
+        self.assertEqual(a0['saturated_fraction'], 0)
+        self.assertAlmostEqual(a0['effective_bits'], np.log2(a0['display_max'] - a0['display_min'] + 1))
+
+    def test_lower_bit_depth_fills_first_levels(self):
+        aggregator = HistogramAggregator()
+        aggregator.add('a.nd2', 0, np.bincount([3, 3, 255], minlength=256))
+        aggregator.add('b.nd2', 0, np.bincount([3, 4000], minlength=4096))
+        histogram, n_planes, saturated = aggregator.channels()[0]
+        self.assertEqual(len(histogram), 4096)
+        self.assertEqual(histogram[3], 3)
+        self.assertEqual((histogram[255], histogram[4000]), (1, 1))
+        self.assertEqual((n_planes, saturated), (2, 1))
+
+    def test_save_load_and_merge(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'counts.npz')
+            self.aggregator.save(path)
+            loaded = HistogramAggregator.load(path)
+        merged = HistogramAggregator().merge(loaded).merge(loaded)
+
+        for key, histogram in self.aggregator.files.items():
+            np.testing.assert_array_equal(merged.files[key], 2 * histogram)
+            self.assertEqual(merged.n_planes[key], 2 * self.aggregator.n_planes[key])
+        self.assertEqual(merged.summary()['p50'].tolist(), self.aggregator.summary()['p50'].tolist())
+
+
+class TestProcessorHistograms(unittest.TestCase):
+    def test_histograms_are_aggregated_while_processing(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            write_test_folder(tmp, n_files=2, shape=(2, 2, 1, 32, 32))
+            processor = ArrayProcessor(features=['intensity'], keep_histograms=False)
+            processor.process_folder(tmp, os.path.join(tmp, 'features.csv'))
+            data = np.load(os.path.join(tmp, 'image_1.nd2'))
+
+        self.assertNotIn('histogram', processor.df.columns)
+        histogram = processor.histograms.files[(os.path.join(tmp, 'image_1.nd2'), 1)]
+        np.testing.assert_array_equal(histogram, np.bincount(data[:, 1].ravel(), minlength=4096))
+        self.assertEqual(processor.histograms.n_planes[(os.path.join(tmp, 'image_1.nd2'), 1)], 2)
+
+    def test_workers_return_summed_histograms_only(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            write_test_folder(tmp, n_files=2, shape=(2, 2, 1, 32, 32))
+            path = os.path.join(tmp, 'image_1.nd2')
+            serial = ArrayProcessor(features=['intensity'], keep_histograms=False)
+            serial.process_folder(tmp, os.path.join(tmp, 'serial.csv'))
+
+            processor = ArrayProcessor(features=['intensity'], keep_histograms=False)
+            with processor._worker_pool(1, threads_per_worker=1) as executor:
+                rows, histograms, pixels = executor.submit(_process_file_in_worker, path).result()
+
+        self.assertEqual(len(rows), 4)
+        self.assertTrue(all('histogram' not in row for row in rows))
+        self.assertIsNone(pixels)
+        self.assertEqual(sorted(histograms.files), [(path, 0), (path, 1)])
+        for key, histogram in histograms.files.items():
+            np.testing.assert_array_equal(histogram, serial.histograms.files[key])
+            self.assertEqual(histograms.n_planes[key], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
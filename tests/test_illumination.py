@@ -0,0 +1,109 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from biaqc.illumination import PixelAccumulator
+from test_utils import ArrayProcessor, write_test_folder
+
+
+def make_planes(n=20, shape=(64, 80), seed=0):
+    """Noisy planes of a vignetted illumination, with planted hot and dead pixels."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[:shape[0], :shape[1]]
+    radius2 = ((y - shape[0] / 2) / shape[0]) ** 2 + ((x - shape[1] / 2) / shape[1]) ** 2
+    illumination = 1000 * np.exp(-2 * radius2)
+    planes = rng.poisson(illumination, size=(n, *shape)).astype(np.uint16)
+    planes[:, 5, 7] = 4095
+    planes[:, 40, 60] += 900
+    planes[:, 20, 30] = 0
+    planes[:, 50, 10] = 300
+    return planes
+
+
+class TestPixelAccumulator(unittest.TestCase):
+    def setUp(self):
+        self.planes = make_planes()
+        self.accumulator = PixelAccumulator()
+        for plane in self.planes:
+            self.accumulator.add(0, plane, bit_depth=12)
+
+    def test_running_mean_and_variance(self):
+        state = self.accumulator.channels[0]
+        self.assertEqual(state.count, len(self.planes))
+        np.testing.assert_allclose(state.mean, self.planes.mean(axis=0), rtol=1e-5)
+        np.testing.assert_allclose(state.variance, self.planes.var(axis=0, ddof=1), rtol=1e-3, atol=1e-2)
+        np.testing.assert_array_equal(state.saturated, (self.planes == 4095).sum(axis=0))
+
+    def test_defect_maps(self):
+        hot, dead = self.accumulator.defect_maps(0)
+        self.assertEqual(list(zip(*np.nonzero(hot))), [(5, 7), (40, 60)])
+        self.assertEqual(list(zip(*np.nonzero(dead))), [(20, 30), (50, 10)])
+
+    def test_vignetting(self):
+        flat = self.accumulator.flat_field(0)
+        self.assertAlmostEqual(flat.mean(), 1, places=5)
+        vignetting = self.accumulator.vignetting(0, flat)
+        self.assertLess(vignetting['corner_ratio'], 0.7)
+        self.assertLess(abs(vignetting['center_offset_x']), 0.05)
+        self.assertLess(abs(vignetting['center_offset_y']), 0.05)
+
+        summary = self.accumulator.summary()
+        self.assertEqual(summary.loc[0, 'n_planes'], 20)
+        self.assertEqual((summary.loc[0, 'n_hot_pixels'], summary.loc[0, 'n_dead_pixels']), (2, 2))
+
+    def test_merge_matches_single_pass(self):
+        first, second = PixelAccumulator(bin_factor=4), PixelAccumulator(bin_factor=4)
+        for plane in self.planes[:7]:
+            first.add(0, plane, bit_depth=12)
+        for plane in self.planes[7:]:
+            second.add(0, plane, bit_depth=12)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'pixels.npz')
+            second.save(path)
+            merged = first.merge(PixelAccumulator.load(path))
+
+        binned = self.planes.reshape(20, 16, 4, 20, 4).mean(axis=(2, 4))
+        state = merged.channels[0]
+        self.assertEqual(state.count, 20)
+        np.testing.assert_allclose(state.mean, binned.mean(axis=0), rtol=1e-5)
+        np.testing.assert_allclose(state.variance, binned.var(axis=0, ddof=1), rtol=1e-3, atol=1e-2)
+        np.testing.assert_array_equal(state.zeros, (self.planes == 0).sum(axis=0))
+        # binned statistics only find the defects from the saturated and zero counts
+        hot, dead = merged.defect_maps(0)
+        self.assertEqual((hot.shape, hot.sum(), dead.sum()), (self.planes.shape[1:], 1, 1))
+
+
+class TestProcessorPixelStatistics(unittest.TestCase):
+    def test_pixels_are_accumulated_while_processing(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            write_test_folder(tmp, n_files=2, shape=(2, 2, 1, 32, 32))
+            processor = ArrayProcessor(features=['intensity'], pixel_statistics=True)
+            processor.process_folder(tmp, os.path.join(tmp, 'features.csv'))
+            data = np.concatenate([np.load(os.path.join(tmp, f'image_{i}.nd2')) for i in range(2)])
+
+            parallel = ArrayProcessor(features=['intensity'], pixel_statistics=True)
+            parallel.process_folder(tmp, os.path.join(tmp, 'parallel.csv'), workers=2)
+
+        self.assertEqual(sorted(processor.pixels.channels), [0, 1])
+        for accumulator in (processor.pixels, parallel.pixels):
+            state = accumulator.channels[1]
+            self.assertEqual(state.count, 4)
+            np.testing.assert_allclose(state.mean, data[:, 1, 0].mean(axis=0), rtol=1e-5)
+            np.testing.assert_allclose(state.variance, data[:, 1, 0].var(axis=0, ddof=1), rtol=1e-4)
+
+    def test_focus_search_accumulates_the_decoded_planes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            write_test_folder(tmp, n_files=1, shape=(1, 2, 20, 32, 32))
+            processor = ArrayProcessor(features=['intensity'], pixel_statistics=True, focus_search=True)
+            processor.process_folder(tmp, os.path.join(tmp, 'features.csv'))
+
+        n_decoded = processor.pipeline_stats['planes_decoded']
+        self.assertLess(n_decoded, 40)
+        self.assertEqual(sorted(processor.pixels.channels), [0, 1])
+        self.assertEqual(sum(state.count for state in processor.pixels.channels.values()), n_decoded)
+
+
+if __name__ == '__main__':
+    unittest.main()
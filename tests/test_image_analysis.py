@@ -0,0 +1,74 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from biaqc.analysis import GROUP_COLUMNS
+from biaqc.image_analysis import SCORE_COLUMNS, OutlierScorer
+
+
+def make_features(n=400, seed=0):
+    rng = np.random.default_rng(seed)
+    columns = [col for group in GROUP_COLUMNS.values() for col in group]
+    df = pd.DataFrame(rng.normal(size=(n, len(columns))), columns=columns)
+    df.insert(0, 'file_path', [f'/data/f{i % 4}.nd2' for i in range(n)])
+    df.insert(1, 'T', np.arange(n) // 2)
+    df.insert(2, 'C', np.arange(n) % 2)
+    df.insert(3, 'Z', 0)
+    return df
+
+
+class TestOutlierScorer(unittest.TestCase):
+    def test_flags_extreme_feature_with_reason(self):
+        df = make_features()
+        df.loc[7, 'laplacian'] = 40.0
+        scores = OutlierScorer().score(df)
+
+        self.assertEqual(list(scores.columns), SCORE_COLUMNS)
+        self.assertTrue(scores.loc[7, 'is_outlier'])
+        self.assertEqual(scores.loc[7, 'robust_z_feature'], 'laplacian')
+        self.assertIn('high laplacian', scores.loc[7, 'outlier_reasons'])
+        self.assertEqual(scores['outlier_score'].idxmax(), 7)
+        self.assertLess(scores['is_outlier'].mean(), 0.1)
+        self.assertTrue((scores.loc[~scores['is_outlier'], 'outlier_reasons'] == '').all())
+
+    def test_scores_each_channel_separately(self):
+        df = make_features()
+        # channel 1 is ten times brighter, which is not unusual for that channel
+        df.loc[df['C'] == 1, 'mean_intensity'] = df['mean_intensity'] * 0.1 + 10
+        scores = OutlierScorer().score(df)
+        self.assertLess(scores['is_outlier'].mean(), 0.1)
+
+        channel = df[df['C'] == 1]
+        pd.testing.assert_frame_equal(scores.loc[channel.index], OutlierScorer().score(channel))
+
+    def test_mahalanobis_flags_unusual_combination(self):
+        rng = np.random.default_rng(1)
+        df = make_features(n=1000)
+        # two correlated features, and one plane breaking the correlation
+        base = rng.normal(size=len(df))
+        df['laplacian'] = base
+        df['tenengrad'] = base + rng.normal(scale=0.05, size=len(df))
+        df.loc[3, ['laplacian', 'tenengrad']] = [2.0, -2.0]
+        scores = OutlierScorer(n_components=len(df.columns)).score(df)
+        self.assertLess(scores.loc[3, 'robust_z_max'], 3.5)
+        self.assertTrue(scores.loc[3, 'is_outlier'])
+        self.assertIn('unusual feature combination', scores.loc[3, 'outlier_reasons'])
+
+    def test_isolation_forest_and_order(self):
+        df = make_features().sample(frac=1.0, random_state=0)
+        scores = OutlierScorer(isolation_forest=True).score(df)
+        self.assertIn('isolation_score', scores.columns)
+        self.assertTrue(scores.index.equals(df.index))
+
+    def test_constant_and_missing_features(self):
+        df = make_features()
+        df['bit_depth'] = 12
+        df.loc[:10, 'entropy'] = np.nan
+        scores = OutlierScorer().score(df)
+        self.assertFalse(scores[['outlier_score', 'mahalanobis']].isna().any().any())
+        self.assertFalse((scores['robust_z_feature'] == 'bit_depth').any())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+
+import dask.array as da
+import numpy as np
+import xarray as xr
+
+from biaqc.plane_cache import NeighbourPrefetcher, PlaneCache, neighbour_planes, playback
+
+
+class CountingArray:
+    """A TCZYX array that counts the planes read from it."""
+
+    def __init__(self, data):
+        self.data = data
+        self.shape, self.dtype, self.ndim = data.shape, data.dtype, data.ndim
+        self.reads = 0
+
+    def __getitem__(self, key):
+        plane = self.data[key]
+        # dask probes the array with empty slices
+        self.reads += plane.size > 0
+        return plane
+
+
+class TestPlaneCache(unittest.TestCase):
+    def setUp(self):
+        self.data = np.random.default_rng(0).integers(0, 4096, size=(3, 2, 4, 16, 16), dtype=np.uint16)
+        self.arrays = {}
+        self.opened = []
+        self.cache = PlaneCache(max_bytes=3 * 16 * 16 * 2, open_image=self.open_image)
+
+    def open_image(self, path):
+        self.opened.append(path)
+        array = self.arrays[path] = CountingArray(self.data)
+        dask_data = da.from_array(array, chunks=(1, 1, 1, 16, 16))
+        return SimpleNamespace(xarray_dask_data=xr.DataArray(dask_data, dims=list('TCZYX')))
+
+    def test_decodes_only_the_requested_plane(self):
+        plane = self.cache.get('a.nd2', 1, 2, 0)
+        np.testing.assert_array_equal(plane, self.data[0, 1, 2])
+        self.assertEqual(self.arrays['a.nd2'].reads, 1)
+        self.assertFalse(plane.flags.writeable)
+
+        self.assertIs(self.cache.get('a.nd2', 1, 2, 0), plane)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        self.assertEqual(self.arrays['a.nd2'].reads, 1)
+        # the lazy array of the file is not loaded either
+        self.assertEqual(self.cache.lazy_array('a.nd2').shape, self.data.shape)
+        self.assertEqual((self.opened, self.arrays['a.nd2'].reads), (['a.nd2'], 1))
+
+    def test_evicts_least_recently_used_over_budget(self):
+        for z in range(3):
+            self.cache.get('a.nd2', 0, z, 0)
+        self.cache.get('a.nd2', 0, 0, 0)  # most recently used again
+        self.cache.get('a.nd2', 0, 3, 0)
+
+        self.assertEqual(len(self.cache), 3)
+        self.assertEqual(self.cache.nbytes, 3 * 16 * 16 * 2)
+        self.assertIn(('a.nd2', 0, 0, 0), self.cache)
+        self.assertNotIn(('a.nd2', 0, 1, 0), self.cache)
+
+        self.cache.clear()
+        self.assertEqual((len(self.cache), self.cache.nbytes), (0, 0))
+
+    def test_concurrent_reads(self):
+        planes = [(c, z, t) for t in range(3) for c in range(2) for z in range(4)]
+        errors = []
+
+        def read():
+            try:
+                for c, z, t in planes:
+                    np.testing.assert_array_equal(self.cache.get('a.nd2', c, z, t), self.data[t, c, z])
+            except AssertionError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=read) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertLessEqual(self.cache.nbytes, self.cache.max_bytes)
+
+
+class TestPrefetch(unittest.TestCase):
+    def setUp(self):
+        self.data = np.random.default_rng(0).integers(0, 4096, size=(5, 2, 3, 16, 16), dtype=np.uint16)
+        dask_data = da.from_array(self.data, chunks=(1, 1, 1, 16, 16))
+        image = SimpleNamespace(xarray_dask_data=xr.DataArray(dask_data, dims=list('TCZYX')))
+        self.cache = PlaneCache(open_image=lambda path: image)
+
+    def test_neighbour_planes(self):
+        self.assertEqual(neighbour_planes(0, 3, n_z=3, n_t=5, radius=2),
+                         [(0, 4), (0, 2), (1, 3), (0, 1), (2, 3)])
+
+    def test_prefetches_neighbours_of_same_channel(self):
+        prefetcher = NeighbourPrefetcher(self.cache, radius=1)
+        prefetcher.prefetch('a.nd2', 1, 1, 0).result()
+        prefetcher.close()
+
+        self.assertEqual(sorted(key[1:] for key in self.cache._planes), [(1, 0, 0), (1, 1, 1), (1, 2, 0)])
+        self.assertEqual(prefetcher.prefetched, 3)
+        np.testing.assert_array_equal(self.cache.get('a.nd2', 1, 1, 1), self.data[1, 1, 1])
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_playback_loops_over_timepoints(self):
+        frames = playback(self.cache, 'a.nd2', 0, 2, start=3, depth=4)
+        # the frames are decoded ahead, before being asked for
+        for _ in range(500):
+            if frames.ready:
+                break
+            time.sleep(0.01)
+        self.assertTrue(frames.ready)
+        played = []
+        for t, frame in frames:
+            np.testing.assert_array_equal(frame, self.data[t, 0, 2])
+            played.append(t)
+            if len(played) == 7:
+                break
+        frames.close()
+        self.assertEqual(played, [3, 4, 0, 1, 2, 3, 4])
+
+        once = playback(self.cache, 'a.nd2', 0, 2, start=3, loop=False)
+        self.assertEqual([t for t, _ in once], [3, 4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from biaqc.analysis import FeaturePCA
+from biaqc.image_analysis import OutlierScorer
+from biaqc.reference import FORMAT_VERSION, ReferenceModel
+from test_image_analysis import make_features
+
+
+class TestReferenceModel(unittest.TestCase):
+    def setUp(self):
+        self.reference = make_features(n=600, seed=0)
+        self.batch = make_features(n=200, seed=1)
+        self.batch.loc[4, 'snr'] = 30.0
+
+    def test_transform_matches_fitted_pca(self):
+        model = ReferenceModel().fit(self.reference)
+        feature_pca = FeaturePCA()
+        feature_pca.set_data(self.reference)
+        expected = feature_pca.combine_pcas()
+        pd.testing.assert_frame_equal(model.transform(self.reference), expected, atol=1e-4, rtol=1e-4)
+
+    def test_scores_new_batch_against_reference(self):
+        model = ReferenceModel().fit(self.reference)
+        scores = model.score(self.batch)
+        self.assertTrue(scores.loc[4, 'is_outlier'])
+        self.assertEqual(scores.loc[4, 'robust_z_feature'], 'snr')
+
+        # the reference statistics are used, not those of the batch
+        shifted = self.batch.copy()
+        shifted['entropy'] += 10
+        self.assertTrue(model.score(shifted)['is_outlier'].all())
+        self.assertFalse(OutlierScorer().score(shifted)['is_outlier'].all())
+
+    def test_scorer_is_not_modified(self):
+        scorer = OutlierScorer(z_threshold=4.0, isolation_forest=True)
+        model = ReferenceModel(scorer=scorer).fit(self.reference)
+
+        self.assertTrue(scorer.isolation_forest)
+        self.assertEqual(scorer.group_stats, {})
+        self.assertFalse(model.scorer.isolation_forest)
+        self.assertEqual(model.scorer.z_threshold, 4.0)
+
+    def test_save_and_load(self):
+        model = ReferenceModel().fit(self.reference)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'reference.npz')
+            model.save(path)
+            loaded = ReferenceModel.load(path)
+        self.assertEqual(loaded.info, model.info)
+        pd.testing.assert_frame_equal(loaded.transform(self.batch), model.transform(self.batch))
+        pd.testing.assert_frame_equal(loaded.score(self.batch), model.score(self.batch))
+
+    def test_rejects_newer_format_and_missing_features(self):
+        model = ReferenceModel().fit(self.reference)
+        with self.assertRaises(ValueError):
+            model.transform(self.batch.drop(columns='laplacian'))
+        with self.assertRaises(ValueError):
+            model.score(self.batch.assign(C=5))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'reference.npz')
+            model.save(path)
+            with np.load(path) as arrays:
+                content = dict(arrays)
+            content['header'] = np.array(
+                str(content['header']).replace(f'"format_version": {FORMAT_VERSION}',
+                                               f'"format_version": {FORMAT_VERSION + 1}')
+            )
+            np.savez(path, **content)
+            with self.assertRaises(ValueError):
+                ReferenceModel.load(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from biaqc.scheduler import (DEFAULT_PLANE_SIZE, FileEstimate, ResourceScheduler, _estimate_from_pixels,
+                             parse_size)
+
+
+def make_estimate(name, size_xy, n_t=1):
+    return FileEstimate(name, size_xy, size_xy, 1, 1, n_t, 12)
+
+
+class TestResourceScheduler(unittest.TestCase):
+    def test_parse_size(self):
+        self.assertEqual(parse_size("512M"), 512 * 2**20)
+        self.assertEqual(parse_size("1.5G"), 3 * 2**29)
+        self.assertEqual(parse_size(1000), 1000)
+        with self.assertRaises(ValueError):
+            parse_size("lots")
+
+    def test_estimate_fills_missing_sizes(self):
+        pixels = {'size_x': [], 'size_y': [], 'size_z': [], 'size_c': 2, 'size_t': 5,
+                  'significant_bits': []}
+        with self.assertLogs('biaqc.scheduler', level='WARNING'):
+            estimate = _estimate_from_pixels('a.nd2', pixels)
+        self.assertEqual((estimate.size_x, estimate.size_y), (DEFAULT_PLANE_SIZE, DEFAULT_PLANE_SIZE))
+        self.assertEqual((estimate.size_z, estimate.n_planes, estimate.significant_bits), (1, 10, 16))
+
+    def test_largest_first_within_budget(self):
+        estimates = [make_estimate('small', 256), make_estimate('big', 2048), make_estimate('mid', 1024)]
+        scheduler = ResourceScheduler(memory_budget=0, cpu_budget=4)
+        costs = {e.file_path: scheduler.task_bytes(e) for e in estimates}
+        scheduler.memory_budget = costs['big'] + costs['small']
+
+        started, running, peak = [], [], [0]
+        lock = threading.Lock()
+
+        def task(path):
+            with lock:
+                started.append(path)
+                running.append(path)
+                peak[0] = max(peak[0], sum(costs[p] for p in running))
+            time.sleep(0.05)
+            with lock:
+                running.remove(path)
+            return path
+
+        with ThreadPoolExecutor(4) as executor:
+            results = dict(scheduler.run(executor, task, estimates, max_running=4))
+
+        self.assertEqual(results, {0: 'small', 1: 'big', 2: 'mid'})
+        self.assertEqual(started[:2], ['big', 'small'])
+        self.assertLessEqual(peak[0], scheduler.memory_budget)
+
+    def test_oversized_task_runs_alone(self):
+        estimates = [make_estimate('huge', 4096), make_estimate('small', 64)]
+        scheduler = ResourceScheduler(memory_budget="1M", cpu_budget=2)
+        with ThreadPoolExecutor(2) as executor:
+            order = [idx for idx, _ in scheduler.run(executor, lambda p: p, estimates, max_running=2)]
+        self.assertEqual(sorted(order), [0, 1])
+
+    def test_threads_per_worker(self):
+        scheduler = ResourceScheduler(memory_budget="64G", cpu_budget=16)
+        self.assertEqual(scheduler.threads_per_worker(4), 4)
+        self.assertEqual(scheduler.workers([make_estimate('a', 1024)] * 40), 16)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from biaqc.analysis import FeaturePCA
+from biaqc.similarity import SimilarityIndex
+from test_image_analysis import make_features
+
+
+class TestSimilarityIndex(unittest.TestCase):
+    def setUp(self):
+        self.features = make_features()
+        # plane 5 is a slightly noisy copy of plane 300
+        columns = self.features.columns[4:]
+        rng = np.random.default_rng(1)
+        self.features.loc[5, columns] = self.features.loc[300, columns] + rng.normal(0, 0.01, len(columns))
+
+    def test_neighbors_match_brute_force(self):
+        feature_pca = FeaturePCA()
+        feature_pca.set_data(self.features)
+        index = SimilarityIndex().fit(self.features, feature_pca)
+
+        similar = index.neighbors(300, k=5)
+
+        vectors = feature_pca.feature_matrix()
+        distance = np.linalg.norm(vectors - vectors[300], axis=1)
+        expected = [i for i in np.argsort(distance) if i != 300][:5]
+        self.assertEqual(similar['position'].tolist(), expected)
+        self.assertEqual(similar['position'][0], 5)
+        np.testing.assert_allclose(similar['distance'], distance[expected], rtol=1e-4)
+        self.assertEqual(similar.loc[0, 'file_path'], self.features.loc[5, 'file_path'])
+
+    def test_position_of(self):
+        index = SimilarityIndex().fit(self.features)
+        row = self.features.loc[123]
+        self.assertEqual(index.position_of(row['file_path'], row['C'], row['Z'], row['T']), 123)
+        self.assertIsNone(index.position_of('/data/other.nd2', 0, 0, 0))
+        self.assertIsNone(index.position_of(row['file_path'], row['C'] + 10, row['Z'], row['T']))
+        self.assertIsNone(index.position_of(row['file_path'], row['C'], np.nan, row['T']))
+        # a table without the plane coordinates indexes no plane by key
+        keyless = SimilarityIndex().fit(self.features.drop(columns='Z'))
+        self.assertIsNone(keyless.position_of(row['file_path'], row['C'], row['Z'], row['T']))
+
+    def test_save_and_load(self):
+        index = SimilarityIndex().fit(self.features)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'similarity.npz')
+            index.save(path)
+            loaded = SimilarityIndex.load(path)
+
+        self.assertEqual(len(loaded), len(self.features))
+        self.assertEqual(loaded.feature_columns, index.feature_columns)
+        self.assertEqual(loaded.neighbors(300, k=5).values.tolist(), index.neighbors(300, k=5).values.tolist())
+        row = self.features.loc[42]
+        self.assertEqual(loaded.position_of(row['file_path'], row['C'], row['Z'], row['T']), 42)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from biaqc.time_series import DriftAnalysis
+
+
+def make_series(file_path, c=0, z=0, n_t=50, rate=0.0, drop_at=None, jump_at=None, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(n_t)
+    intensity = 1000 * np.exp(-rate * t) * (1 + 0.01 * rng.normal(size=n_t))
+    sharpness = 50 * (1 + 0.02 * rng.normal(size=n_t))
+    if drop_at is not None:
+        sharpness[drop_at:] *= 0.5
+    if jump_at is not None:
+        intensity[jump_at] *= 2
+    return pd.DataFrame({'file_path': file_path, 'C': c, 'Z': z, 'T': t,
+                         'mean_intensity': intensity, 'laplacian': sharpness})
+
+
+class TestDriftAnalysis(unittest.TestCase):
+    def setUp(self):
+        df = pd.concat([
+            make_series('stable.nd2'),
+            make_series('bleached.nd2', rate=0.02),
+            make_series('drift.nd2', drop_at=30),
+            make_series('jump.nd2', jump_at=20),
+            make_series('short.nd2', n_t=2),
+        ])
+        # the analysis does not depend on the row order
+        self.result = DriftAnalysis().analyze(df.sample(frac=1.0, random_state=0)).set_index('file_path')
+
+    def test_stable_series(self):
+        stable = self.result.loc['stable.nd2']
+        self.assertEqual(stable['n_timepoints'], 50)
+        self.assertTrue(np.isnan(stable['first_bad_T']))
+        self.assertEqual(stable['n_jumps'], 0)
+        self.assertNotIn('short.nd2', self.result.index)
+
+    def test_bleaching(self):
+        bleached = self.result.loc['bleached.nd2']
+        self.assertAlmostEqual(bleached['bleach_rate'], 0.02, delta=0.002)
+        self.assertAlmostEqual(bleached['bleach_half_life'], np.log(2) / 0.02, delta=4)
+        self.assertGreater(bleached['bleach_r2'], 0.9)
+        # 20% of the intensity is lost after ln(0.8) / -0.02 = 11.2 frames
+        self.assertEqual(bleached['first_bad_T'], 12)
+
+    def test_focus_drift_break(self):
+        drift = self.result.loc['drift.nd2']
+        self.assertEqual(drift['break_T'], 30)
+        self.assertAlmostEqual(drift['break_change'], -0.5, delta=0.05)
+        self.assertLess(drift['sharpness_slope'], 0)
+        self.assertEqual(drift['first_bad_T'], 30)
+
+    def test_jump(self):
+        jump = self.result.loc['jump.nd2']
+        self.assertEqual(jump['first_jump_T'], 20)
+        self.assertEqual(jump['first_bad_T'], 20)
+
+    def test_series_per_channel_and_z(self):
+        df = pd.concat([make_series('a.nd2', c=c, z=z) for c in range(2) for z in range(3)])
+        result = DriftAnalysis().analyze(df)
+        self.assertEqual(len(result), 6)
+        self.assertEqual(set(zip(result['C'], result['Z'])), {(c, z) for c in range(2) for z in range(3)})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+
+import numpy as np
+
+from biaqc import transport
+from biaqc.transport import SharedPlanePool, attach_plane, detach_all
+
+
+class TestSharedPlanePool(unittest.TestCase):
+    def tearDown(self):
+        detach_all()
+
+    def test_attach_views_the_plane(self):
+        plane = np.arange(12, dtype=np.uint16).reshape(3, 4)
+        with SharedPlanePool(max_blocks=2) as pool:
+            descriptor = pool.put(plane, 1, 2, 3)
+            attached = attach_plane(descriptor)
+            np.testing.assert_array_equal(attached, plane)
+            self.assertFalse(attached.flags.writeable)
+            self.assertEqual((descriptor.T, descriptor.C, descriptor.Z), (1, 2, 3))
+            del attached
+
+    def test_blocks_of_previous_pools_are_detached(self):
+        plane = np.ones((4, 4), dtype=np.uint8)
+        with SharedPlanePool(max_blocks=1) as pool:
+            first = pool.put(plane, 0, 0, 0)
+            attach_plane(first)
+            pool.release(first)
+            # a larger plane replaces the block: the old one is unmapped
+            second = pool.put(np.ones((8, 8), dtype=np.uint8), 1, 0, 0)
+            attach_plane(second)
+            self.assertEqual(list(transport._attached_blocks), [second.block_name])
+            self.assertNotEqual(first.pool_id, second.pool_id)
+
+        with SharedPlanePool(max_blocks=1) as other:
+            third = other.put(plane, 0, 0, 0)
+            attach_plane(third)
+            self.assertEqual(list(transport._attached_blocks), [third.block_name])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+from bioio import BioImage
+
+from biaqc.utils import NATIVE_THREAD_ENV_VARS, ND2ImageProcessor
+
+
+class ArrayProcessor(ND2ImageProcessor):
+    """Reads .npy arrays saved under an .nd2 name instead of real ND2 files."""
+
+    def read_nd2(self):
+        with open(self.file_path, 'rb') as f:
+            return BioImage(np.load(f))
+
+    def _get_bit_depth(self, image):
+        return 12
+
+
+def native_thread_counts():
+    """Runs in a worker: the number of threads of each BLAS/OpenMP pool."""
+    from threadpoolctl import threadpool_info
+    return [pool['num_threads'] for pool in threadpool_info()]
+
+
+def write_test_folder(folder_path, n_files=3, shape=(2, 2, 1, 48, 48)):
+    rng = np.random.default_rng(0)
+    for i in range(n_files):
+        data = rng.integers(0, 2**12, size=shape, dtype=np.uint16)
+        with open(os.path.join(folder_path, f'image_{i}.nd2'), 'wb') as f:
+            np.save(f, data)
+
+
+class TestProcessFolder(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        write_test_folder(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_parallel_matches_serial(self):
+        serial = ArrayProcessor()
+        serial.process_folder(self.tmp.name, os.path.join(self.tmp.name, 'serial.csv'))
+
+        parallel = ArrayProcessor()
+        parallel.process_folder(self.tmp.name, os.path.join(self.tmp.name, 'parallel.csv'), workers=2)
+
+        self.assertEqual(len(serial.df), 12)
+        self.assertEqual(list(serial.df.image_name), list(parallel.df.image_name))
+        with open(os.path.join(self.tmp.name, 'serial.csv')) as a, \
+                open(os.path.join(self.tmp.name, 'parallel.csv')) as b:
+            self.assertEqual(a.read(), b.read())
+
+    def test_iter_files_can_stop_early(self):
+        processor = ArrayProcessor()
+        file_paths = processor.list_files(self.tmp.name)
+        for workers in (1, 2):
+            files = processor.iter_files(file_paths, workers=workers)
+            idx, rows = next(files)
+            files.close()
+
+            self.assertEqual(len(rows), 4)
+            self.assertEqual(rows[0]['file_path'], file_paths[idx])
+            self.assertEqual(list(processor.histograms.n_planes.values()), [2, 2])
+
+    def test_iter_files_skips_failing_files(self):
+        with open(os.path.join(self.tmp.name, 'image_1.nd2'), 'wb') as f:
+            f.write(b'not an array')
+        processor = ArrayProcessor()
+        file_paths = processor.list_files(self.tmp.name)
+        for workers in (1, 2):
+            with self.assertLogs('biaqc.utils', level='ERROR'):
+                results = dict(processor.iter_files(file_paths, workers=workers, skip_errors=True))
+
+            self.assertEqual(sorted(results), [0, 1, 2])
+            self.assertIsNone(results[1])
+            self.assertEqual([len(results[0]), len(results[2])], [4, 4])
+            # the failing file adds no histogram
+            self.assertEqual(sum(processor.histograms.n_planes.values()), 8)
+
+            with self.assertRaises(Exception):
+                list(processor.iter_files(file_paths, workers=workers))
+
+    def test_workers_limit_native_threads(self):
+        processor = ArrayProcessor()
+        # the worker inherits larger pools, started as soon as numpy is imported
+        with mock.patch.dict(os.environ, {var: '3' for var in NATIVE_THREAD_ENV_VARS}), \
+                processor._worker_pool(1, threads_per_worker=1) as executor:
+            counts = executor.submit(native_thread_counts).result()
+        # numpy always brings a BLAS pool
+        self.assertGreater(len(counts), 0)
+        self.assertEqual(set(counts), {1})
+
+
+class TestProcessImage(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        write_test_folder(self.tmp.name, n_files=1, shape=(3, 2, 2, 48, 48))
+        self.file_path = os.path.join(self.tmp.name, 'image_0.nd2')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_threaded_planes_match_serial(self):
+        processor = ArrayProcessor()
+        processor.set_image_path(self.file_path)
+        serial = processor.process_image()
+        threaded = processor.process_image(plane_workers=4, max_planes_in_flight=3)
+
+        self.assertEqual(len(serial), 12)
+        self.assertEqual([(r['T'], r['C'], r['Z']) for r in serial],
+                         [(r['T'], r['C'], r['Z']) for r in threaded])
+        for a, b in zip(serial, threaded):
+            self.assertEqual(a['laplacian'], b['laplacian'])
+            np.testing.assert_array_equal(a['histogram'], b['histogram'])
+
+    def test_prefetched_planes_match_serial(self):
+        processor = ArrayProcessor()
+        processor.set_image_path(self.file_path)
+        serial = processor.process_image()
+        prefetched = processor.process_image(plane_workers=2, prefetch_depth=2)
+
+        self.assertEqual([r['laplacian'] for r in serial], [r['laplacian'] for r in prefetched])
+        self.assertEqual(processor.pipeline_stats['planes'], 12)
+
+    def test_shared_memory_planes_match_serial(self):
+        processor = ArrayProcessor(plane_executor="process")
+        processor.set_image_path(self.file_path)
+        serial = processor.process_image()
+        shared = processor.process_image(plane_workers=2, max_planes_in_flight=3)
+
+        self.assertEqual([(r['T'], r['C'], r['Z']) for r in serial],
+                         [(r['T'], r['C'], r['Z']) for r in shared])
+        self.assertEqual([r['laplacian'] for r in serial], [r['laplacian'] for r in shared])
+
+
+class TestFocusSearch(unittest.TestCase):
+    def setUp(self):
+        # a textured plane blurred more the further it is from Z 13
+        from scipy import ndimage
+        rng = np.random.default_rng(0)
+        texture = rng.random((64, 64)) * 4000
+        self.focus = 13
+        stack = [ndimage.gaussian_filter(texture, 0.3 + 0.5 * abs(z - self.focus)) for z in range(40)]
+        data = np.stack(stack).astype(np.uint16)[None, None].repeat(2, axis=1)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.tmp.name, 'stack.nd2')
+        with open(self.file_path, 'wb') as f:
+            np.save(f, data)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_finds_best_plane_with_few_reads(self):
+        processor = ArrayProcessor(focus_search=True)
+        processor.set_image_path(self.file_path)
+        rows = processor.process_image()
+
+        self.assertEqual([(r['C'], r['Z']) for r in rows],
+                         [(c, z) for c in range(2) for z in (12, 13, 14)])
+        for row in rows:
+            self.assertAlmostEqual(row['best_Z'], self.focus, delta=0.5)
+            self.assertEqual(len(row['focus_curve']), 40)
+            self.assertEqual(row['focus_score'], row['focus_curve'][row['Z']])
+            self.assertIn('laplacian', row)
+        self.assertEqual(processor.pipeline_stats['planes_total'], 80)
+        self.assertLess(processor.pipeline_stats['planes_decoded'], 40)
+
+    def test_small_stack_is_fully_measured(self):
+        processor = ArrayProcessor(focus_coarse_points=50)
+        planes = {}
+        best, best_z, curve = processor.find_focus(lambda z: np.full((8, 8), z % 2 * 100.0), 3, planes)
+        self.assertEqual(sorted(planes), [0, 1, 2])
+        self.assertFalse(np.isnan(curve).any())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from biaqc.comparison import _histogram_matrix
+from biaqc.file_operations import RunStore
+from biaqc.watch import QCWatcher
+from test_batch import ArrayMetadata
+from test_utils import ArrayProcessor, write_test_folder
+
+
+class TestQCWatcher(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.folder = os.path.join(self.tmp.name, 'acquisition')
+        os.makedirs(self.folder)
+        self.store = RunStore(os.path.join(self.tmp.name, 'store'), 'live')
+        self.watcher = QCWatcher([self.folder], self.store, settle_time=10)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name, data):
+        with open(os.path.join(self.folder, name), 'ab') as f:
+            f.write(data)
+
+    def test_waits_until_size_is_stable(self):
+        self.write('a.nd2', b'0' * 10)
+        self.write('notes.txt', b'0')
+        self.assertEqual(self.watcher.ready_files(now=0), [])
+        self.assertEqual(self.watcher.ready_files(now=5), [])
+
+        self.write('a.nd2', b'0' * 10)  # still being written
+        self.assertEqual(self.watcher.ready_files(now=12), [])
+        self.assertEqual(self.watcher.ready_files(now=20), [])
+        self.assertEqual(self.watcher.ready_files(now=22), [os.path.join(self.folder, 'a.nd2')])
+
+    def test_read_only_files_are_not_locked(self):
+        self.write('a.nd2', b'0' * 10)
+        path = os.path.join(self.folder, 'a.nd2')
+        os.chmod(path, 0o444)
+        self.assertEqual(self.watcher.ready_files(now=0), [])
+        self.assertEqual(self.watcher.ready_files(now=11), [path])
+
+    def test_skips_files_already_in_store(self):
+        self.write('a.nd2', b'0')
+        path = os.path.join(self.folder, 'a.nd2')
+        self.store.append('features', [{'file_path': path, 'T': 0}])
+
+        watcher = QCWatcher([self.folder], self.store, settle_time=0)
+        self.assertEqual(watcher.scan(), [])
+
+    def test_histograms_are_read_back_from_the_store(self):
+        write_test_folder(self.folder, n_files=1, shape=(2, 2, 1, 32, 32))
+        path = os.path.join(self.folder, 'image_0.nd2')
+        self.watcher.processor = ArrayProcessor(features=['intensity'])
+        self.watcher.metadata = ArrayMetadata()
+        self.watcher.process(path)
+
+        features = self.store.read('features')
+        data = np.load(path)
+        histogram = np.array(json.loads(features.loc[3, 'histogram']))
+        np.testing.assert_array_equal(histogram, np.bincount(data[1, 1].ravel(), minlength=len(histogram)))
+        matrix, rows = _histogram_matrix(features['histogram'], 256)
+        self.assertEqual(rows.tolist(), [0, 1, 2, 3])
+        self.assertEqual(matrix.sum(axis=1).tolist(), [32 * 32] * 4)
+
+    def test_failed_files_are_retried_once_changed(self):
+        watcher = QCWatcher([self.folder], self.store, settle_time=0, max_attempts=2)
+        watcher.processor = ArrayProcessor(features=['intensity'])
+        watcher.metadata = ArrayMetadata()
+        path = os.path.join(self.folder, 'image_0.nd2')
+        self.write('image_0.nd2', b'partial copy')
+
+        self.assertEqual(watcher.poll_once(), [])  # seen
+        with self.assertLogs('biaqc.watch', level='ERROR'):
+            self.assertEqual(watcher.poll_once(), [])  # fails
+        self.assertEqual(watcher.poll_once(), [])  # unchanged, not tried again
+        self.assertNotIn(path, watcher.processed)
+
+        # the copy completes
+        os.remove(path)
+        write_test_folder(self.folder, n_files=1, shape=(1, 1, 1, 16, 16))
+        self.assertEqual(watcher.poll_once(), [])
+        self.assertEqual([t['file_path'] for t in watcher.poll_once()], [path])
+        self.assertEqual(len(self.store.read('features')), 1)
+
+    def test_failing_files_are_skipped_after_max_attempts(self):
+        watcher = QCWatcher([self.folder], self.store, settle_time=0, max_attempts=2)
+        watcher.processor = ArrayProcessor(features=['intensity'])
+        path = os.path.join(self.folder, 'a.nd2')
+        with self.assertLogs('biaqc.watch', level='ERROR'):
+            for data in (b'corrupt', b'still corrupt'):
+                self.write('a.nd2', data)
+                watcher.poll_once()
+                watcher.poll_once()
+        self.assertIn(path, watcher.processed)
+        self.assertEqual(watcher.scan(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()